@@ -1,4 +1,4 @@
-from flask import Flask, request
+from flask import Flask, request, g
 from flask_restx import Api
 from typing import Optional
 
@@ -9,9 +9,17 @@ from .middlewares.auth import AuthMiddleware
 from .middlewares.rate_limiter import RateLimiterMiddleware
 from .middlewares.caching import CachingMiddleware
 from .middlewares.circuit_breaker import CircuitBreakerMiddleware
+from .middlewares.admission import AdmissionControlMiddleware
 from .logging_setup import setup_logging
 from .utils.openapi_aggregator import OpenAPIAggregator
 from .utils.service_discovery import ConsulServiceDiscovery
+from .utils.load_balancer import ServiceLoadBalancer
+from .utils.http_client import UpstreamSessionPool
+from .utils.hedging import RequestHedger
+from .utils.concurrency import AdaptiveConcurrencyLimiter
+from .utils.cache_events import CacheInvalidationConsumer
+from .utils.token_cache import build_token_cache
+from .utils.route_classifier import build_route_classifier, ROUTE_PROXY, ROUTE_OTHER
 from .utils.errors import register_error_handlers
 from .metrics import metrics_bp
 
@@ -24,9 +32,14 @@ api = Api(
 
 openapi_aggregator: Optional[OpenAPIAggregator] = None
 service_discovery_client: Optional[ConsulServiceDiscovery] = None
+upstream_session_pool: Optional[UpstreamSessionPool] = None
+request_hedger: Optional[RequestHedger] = None
+concurrency_limiter: Optional[AdaptiveConcurrencyLimiter] = None
+cache_invalidation_consumer: Optional[CacheInvalidationConsumer] = None
 
 def create_app():
-    global openapi_aggregator, service_discovery_client
+    global openapi_aggregator, service_discovery_client, upstream_session_pool, request_hedger, concurrency_limiter, \
+        cache_invalidation_consumer
 
     app = Flask(__name__)
     app.config.from_object(Config)
@@ -39,31 +52,66 @@ def create_app():
 
     consul_host = app.config.get('CONSUL_HOST')
     consul_port = app.config.get('CONSUL_PORT')
-    service_discovery_client = ConsulServiceDiscovery(host=consul_host, port=consul_port)
+    discoverable_services = app.config.get('DISCOVERABLE_SERVICES', [])
+    service_discovery_client = ConsulServiceDiscovery(
+        host=consul_host,
+        port=consul_port,
+        services=discoverable_services,
+        settings=app.config.get('SERVICE_DISCOVERY_SETTINGS', {}),
+        load_balancer=ServiceLoadBalancer(app.config.get('LOAD_BALANCER_SETTINGS', {}))
+    )
     app.logger.info("ConsulServiceDiscovery client initialized.")
 
-    discoverable_services = app.config.get('DISCOVERABLE_SERVICES', [])
     openapi_aggregator = OpenAPIAggregator(service_discovery_client, discoverable_services)
     app.logger.info("OpenAPIAggregator initialized.")
 
+    upstream_session_pool = UpstreamSessionPool(app.config.get('UPSTREAM_POOL_SETTINGS', {}))
+    app.logger.info("UpstreamSessionPool initialized.")
+
+    request_hedger = RequestHedger(app.config.get('HEDGING_SETTINGS', {}))
+    app.logger.info("RequestHedger initialized.")
+
+    concurrency_limiter = AdaptiveConcurrencyLimiter(app.config.get('ADAPTIVE_CONCURRENCY_SETTINGS', {}))
+    app.logger.info("AdaptiveConcurrencyLimiter initialized.")
+
+    app.route_classifier = build_route_classifier(app.config)
     app.middleware_manager = MiddlewareManager()
-    app.middleware_manager.add_middleware(CircuitBreakerMiddleware()) 
-    app.middleware_manager.add_middleware(CachingMiddleware())
-    # auth_middleware = AuthMiddleware()
-    # auth_middleware.set_excluded_paths(app.config.get('AUTH_EXCLUDED_PATHS', []))
-    # app.middleware_manager.add_middleware(auth_middleware)
-    app.middleware_manager.add_middleware(RateLimiterMiddleware())
-
-    register_routes(app, api, openapi_aggregator, service_discovery_client)
+    if app.config.get('ADMISSION_CONTROL_SETTINGS', {}).get('ENABLED'):
+        admission_control = AdmissionControlMiddleware()
+        app.middleware_manager.add_middleware(admission_control)
+        app.teardown_request(admission_control.teardown_request)
+    # Health checks and scrapes only go through admission control.
+    circuit_breaker = CircuitBreakerMiddleware()
+    app.middleware_manager.add_middleware(circuit_breaker, [ROUTE_PROXY])
+    # Verified JWTs, shared by the cache key builder and the auth middleware.
+    token_cache = build_token_cache(app.config.get('AUTH_TOKEN_CACHE_SETTINGS', {}))
+    caching_middleware = CachingMiddleware(circuit_breaker, token_cache)
+    app.middleware_manager.add_middleware(caching_middleware, [ROUTE_PROXY, ROUTE_OTHER])
+    if app.config.get('AUTH_ENABLED'):
+        app.middleware_manager.add_middleware(AuthMiddleware(token_cache), [ROUTE_PROXY, ROUTE_OTHER])
+    app.middleware_manager.add_middleware(RateLimiterMiddleware(), [ROUTE_PROXY, ROUTE_OTHER])
+
+    if app.config.get('CACHE_INVALIDATION_SETTINGS', {}).get('EVENTS_ENABLED'):
+        def invalidate_from_event(service_name, resource_path):
+            with app.app_context():
+                caching_middleware.invalidate(service_name, resource_path, source='event', recursive=False)
+
+        cache_invalidation_consumer = CacheInvalidationConsumer(app.config, invalidate_from_event)
+        if cache_invalidation_consumer.start():
+            app.logger.info("CacheInvalidationConsumer started.")
+
+    register_routes(app, api, openapi_aggregator, service_discovery_client, upstream_session_pool, request_hedger,
+                    circuit_breaker, concurrency_limiter)
     app.register_blueprint(metrics_bp) 
     @app.before_request
     def before_request_middleware():
-        response = app.middleware_manager.process_request(request)
+        g.route = app.route_classifier.classify(request.path)
+        response = app.middleware_manager.process_request(request, g.route.route_class)
         if response:
             return response 
 
     @app.after_request
     def after_request_middleware(response):
-        return app.middleware_manager.process_response(request, response)
+        return app.middleware_manager.process_response(request, response, g.route.route_class)
 
     return app
\ No newline at end of file
@@ -0,0 +1,158 @@
+"""
+Asyncio engine for the gateway's /proxy/<service_name>/<path> hot path.
+
+Runs on aiohttp instead of Flask so in-flight upstream calls do not pin a thread.
+It shares configuration, error mapping and cache/breaker state formats with the Flask app,
+so both engines can run side by side against the same Redis and Consul.
+"""
+import asyncio
+import logging
+import time
+import traceback
+from http import HTTPStatus
+
+from aiohttp import web
+from prometheus_client import generate_latest
+
+from ..config import Config
+from ..logging_setup import setup_logging
+from ..metrics import REQUEST_COUNT, REQUEST_LATENCY, IN_PROGRESS_REQUESTS
+from ..utils.errors import APIError
+from ..utils.service_discovery import ConsulServiceDiscovery
+from ..utils.load_balancer import ServiceLoadBalancer
+from ..utils.cache_events import CacheInvalidationConsumer
+from ..utils.concurrency import AdaptiveConcurrencyLimiter
+from ..utils.route_classifier import build_route_classifier, ROUTE_PROXY, ROUTE_OTHER
+from ..utils.token_cache import build_token_cache
+from .middlewares import (
+    AsyncMiddlewareManager,
+    AsyncAdmissionControlMiddleware,
+    AsyncCircuitBreakerMiddleware,
+    AsyncCachingMiddleware,
+    AsyncAuthMiddleware,
+    AsyncRateLimiterMiddleware,
+)
+from .proxy import AsyncUpstreamSessionPool, proxy_handler
+
+logger = logging.getLogger(__name__)
+
+
+def _error_response(request: web.Request, e: Exception) -> web.Response:
+    """
+    Renders exceptions the way the Flask app does. Errors raised by the proxy resource go
+    through Flask-RESTx, which only returns the message; anything else is rendered like
+    utils.errors.handle_api_error.
+    """
+    if isinstance(e, APIError):
+        logger.warning(f"API Error ({e.code}): {e.message} - Path: {request.path}")
+        return web.json_response({"message": e.message}, status=e.code, headers=e.headers)
+    if isinstance(e, web.HTTPException):
+        logger.warning(f"HTTP Exception ({e.status}): {e.reason} - Path: {request.path}")
+        return web.json_response({"message": e.reason, "status_code": e.status}, status=e.status)
+
+    logger.exception(f"Unhandled Exception: {e} - Path: {request.path}")
+    status_code = HTTPStatus.INTERNAL_SERVER_ERROR.value
+    error_response = {"message": "An unexpected error occurred.", "status_code": status_code}
+    if request.app['config'].get('DEBUG'):
+        error_response["exception"] = str(e)
+        error_response["traceback"] = traceback.format_exc().splitlines()
+    return web.json_response(error_response, status=status_code)
+
+
+@web.middleware
+async def metrics_middleware(request: web.Request, handler):
+    start_time = time.time()
+    endpoint = request.match_info.route.name or 'unknown'
+    IN_PROGRESS_REQUESTS.labels(request.method, endpoint).inc()
+    status_code = HTTPStatus.INTERNAL_SERVER_ERROR.value
+    try:
+        response = await handler(request)
+        status_code = response.status
+        return response
+    finally:
+        REQUEST_COUNT.labels(request.method, endpoint, status_code).inc()
+        REQUEST_LATENCY.labels(request.method, endpoint, status_code).observe(time.time() - start_time)
+        IN_PROGRESS_REQUESTS.labels(request.method, endpoint).dec()
+
+
+@web.middleware
+async def gateway_middleware(request: web.Request, handler):
+    """Runs the async middleware chain around the handler, like the Flask before/after_request hooks."""
+    middleware_manager = request.app['middleware_manager']
+    route = request['route'] = request.app['route_classifier'].classify(request.path)
+    response = await middleware_manager.process_request(request, route.route_class)
+    if response is None:
+        try:
+            response = await handler(request)
+        except Exception as e:
+            response = _error_response(request, e)
+    return await middleware_manager.process_response(request, response, route.route_class)
+
+
+async def health_handler(request: web.Request) -> web.Response:
+    return web.json_response({"status": "Gateway is healthy"})
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(body=generate_latest(), content_type='text/plain')
+
+
+def create_async_app() -> web.Application:
+    config = {key: getattr(Config, key) for key in dir(Config) if key.isupper()}
+
+    setup_logging(config)
+    logger.info("Async gateway logging initialized.")
+
+    app = web.Application(middlewares=[metrics_middleware, gateway_middleware])
+    app['config'] = config
+    app['route_classifier'] = build_route_classifier(config)
+
+    app['service_discovery_client'] = ConsulServiceDiscovery(
+        host=config.get('CONSUL_HOST'),
+        port=config.get('CONSUL_PORT'),
+        services=config.get('DISCOVERABLE_SERVICES', []),
+        settings=config.get('SERVICE_DISCOVERY_SETTINGS', {}),
+        load_balancer=ServiceLoadBalancer(config.get('LOAD_BALANCER_SETTINGS', {}))
+    )
+    app['upstream_session_pool'] = AsyncUpstreamSessionPool(config.get('UPSTREAM_POOL_SETTINGS', {}))
+    app.on_cleanup.append(app['upstream_session_pool'].close)
+    app['concurrency_limiter'] = AdaptiveConcurrencyLimiter(config.get('ADAPTIVE_CONCURRENCY_SETTINGS', {}))
+
+    middleware_manager = AsyncMiddlewareManager()
+    if config.get('ADMISSION_CONTROL_SETTINGS', {}).get('ENABLED'):
+        middleware_manager.add_middleware(AsyncAdmissionControlMiddleware(config))
+    app['circuit_breaker'] = AsyncCircuitBreakerMiddleware(config)
+    middleware_manager.add_middleware(app['circuit_breaker'], [ROUTE_PROXY])
+    # Verified JWTs, shared by the cache key builder and the auth middleware.
+    token_cache = build_token_cache(config.get('AUTH_TOKEN_CACHE_SETTINGS', {}))
+    caching_middleware = AsyncCachingMiddleware(config, token_cache)
+    middleware_manager.add_middleware(caching_middleware, [ROUTE_PROXY, ROUTE_OTHER])
+    if config.get('AUTH_ENABLED'):
+        middleware_manager.add_middleware(AsyncAuthMiddleware(config, token_cache), [ROUTE_PROXY, ROUTE_OTHER])
+    middleware_manager.add_middleware(AsyncRateLimiterMiddleware(config), [ROUTE_PROXY, ROUTE_OTHER])
+    app['middleware_manager'] = middleware_manager
+
+    if config.get('CACHE_INVALIDATION_SETTINGS', {}).get('EVENTS_ENABLED'):
+        async def start_cache_invalidation_consumer(app: web.Application):
+            loop = asyncio.get_running_loop()
+
+            def invalidate_from_event(service_name: str, resource_path: str):
+                # Runs on the consumer thread; the purge itself runs on the event loop.
+                future = asyncio.run_coroutine_threadsafe(
+                    caching_middleware.invalidate(service_name, resource_path, source='event', recursive=False), loop)
+                future.result(timeout=10)
+
+            app['cache_invalidation_consumer'] = CacheInvalidationConsumer(config, invalidate_from_event)
+            app['cache_invalidation_consumer'].start()
+
+        async def stop_cache_invalidation_consumer(app: web.Application):
+            app['cache_invalidation_consumer'].stop()
+
+        app.on_startup.append(start_cache_invalidation_consumer)
+        app.on_cleanup.append(stop_cache_invalidation_consumer)
+
+    app.router.add_get('/gateway/health', health_handler, name='gateway_gateway_health')
+    app.router.add_get('/metrics', metrics_handler, name='metrics.metrics')
+    app.router.add_route('*', '/proxy/{service_name}/{path:.+}', proxy_handler, name='proxy_proxy_resource')
+
+    return app
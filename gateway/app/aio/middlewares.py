@@ -0,0 +1,811 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+import weakref
+from http import HTTPStatus
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Protocol, Tuple, runtime_checkable
+
+import jwt
+import redis.asyncio as aioredis
+from aiohttp import web
+from multidict import CIMultiDict
+
+from ..middleware_manager import PipelineStage, compile_pipelines
+from ..metrics import (
+    CACHE_COALESCED_REQUESTS,
+    CACHE_LOOKUPS,
+    CACHE_STALE_SERVED,
+    CACHE_NOT_MODIFIED,
+    CACHE_INVALIDATIONS,
+    CACHE_INVALIDATED_ENTRIES,
+    RATE_LIMIT_DECISIONS,
+)
+from ..middlewares.caching import (
+    build_etag_key,
+    build_tag_version_key,
+    build_fill_lock_key,
+    build_revalidate_lock_key,
+    build_local_cache,
+    build_default_cache_policy,
+    build_cache_policies,
+    cache_entry_age,
+    cache_entry_size,
+    cache_storage_ttl,
+    max_storage_ttl,
+    cache_entry_tags,
+    cacheable_headers,
+    invalidation_tags,
+    compute_etag,
+    etag_matches,
+    serialize_cache_entry,
+    serialize_etag_entry,
+    deserialize_cache_entry,
+    purge_tags_args,
+    store_entry_args,
+    RELEASE_FILL_LOCK_SCRIPT,
+    PURGE_TAGS_SCRIPT,
+    STORE_ENTRY_SCRIPT,
+    INVALIDATING_METHODS,
+)
+from ..middlewares.circuit_breaker import (
+    BREAKER_EVENTS_CHANNEL,
+    CIRCUIT_HALF_OPEN,
+    ACQUIRE_PERMISSION_SCRIPT,
+    RECORD_OUTCOMES_SCRIPT,
+    RELEASE_PERMISSION_SCRIPT,
+    BreakerStateCache,
+    acquire_permission_args,
+    record_outcomes_args,
+    build_breaker_key,
+    build_breaker_outcomes,
+    build_instance_breaker_name,
+    local_breaker_decision,
+    log_transition,
+)
+from ..middlewares.rate_limiter import (
+    GCRA_SCRIPT,
+    build_rate_limit_key,
+    build_rate_limit_rules,
+    gcra_args,
+    parse_gcra_result,
+    rate_limit_headers,
+)
+from ..utils.admission import AdmissionSlot, AsyncAdmissionController, ADMITTED
+from ..utils.cache_keys import CacheKeyBuilder
+from ..utils.route_classifier import ROUTE_CLASSES, ROUTE_PROXY
+from ..utils.rate_limits import (
+    RateLimitDecision, SlidingWindowRateLimiter, client_ip, parse_api_keys, parse_trusted_proxies, request_identity
+)
+from ..utils.single_flight import AsyncSingleFlight
+from ..utils.token_cache import VerifiedTokenCache, verify_token
+from .proxy import call_on_close
+
+logger = logging.getLogger(__name__)
+
+
+def full_path(request: web.Request) -> str:
+    """Equivalent of Flask's request.full_path, so both engines log the same paths."""
+    return f"{request.path}?{request.query_string}"
+
+
+def _message_response(message: str, status: int, headers: Optional[Dict[str, str]] = None) -> web.Response:
+    return web.json_response({"message": message}, status=status, headers=headers)
+
+
+@runtime_checkable
+class AsyncMiddleware(Protocol):
+    """
+    Protocol defining the interface for middleware objects of the asyncio engine.
+    Mirrors app.middleware_manager.Middleware with coroutine methods.
+    """
+    async def process_request(self, request: web.Request) -> Optional[web.StreamResponse]:
+        """
+        Process an incoming request before the handler runs.
+        Returning a response short-circuits the chain.
+        """
+        pass
+
+    async def process_response(self, request: web.Request, response: web.StreamResponse) -> web.StreamResponse:
+        """
+        Process the outgoing response. Called in reverse order of middleware addition.
+        """
+        pass
+
+
+class AsyncMiddlewareManager:
+    """
+    Asyncio counterpart of MiddlewareManager with the same ordering, per-route-class pipelines,
+    instrumentation and error semantics: process_request in the order added, process_response
+    in reverse order.
+    """
+    def __init__(self, route_classes: Iterable[str] = ROUTE_CLASSES):
+        self.middlewares: List[AsyncMiddleware] = []
+        self.route_classes = tuple(route_classes)
+        self._middleware_route_classes: List[FrozenSet[str]] = []
+        self.pipelines: Dict[str, Tuple[PipelineStage, ...]] = {}
+        logger.info("AsyncMiddlewareManager initialized.")
+
+    def add_middleware(self, middleware: AsyncMiddleware, route_classes: Optional[Iterable[str]] = None):
+        middleware_name = type(middleware).__name__
+        if not isinstance(middleware, AsyncMiddleware):
+            logger.error(f"Attempted to add object that does not implement AsyncMiddleware Protocol: {middleware_name}")
+            raise TypeError("Middleware object must implement the AsyncMiddleware Protocol (have 'process_request' and 'process_response' coroutines).")
+
+        self.middlewares.append(middleware)
+        self._middleware_route_classes.append(frozenset(self.route_classes if route_classes is None else route_classes))
+        self.pipelines = compile_pipelines(self.middlewares, self._middleware_route_classes, self.route_classes)
+        logger.info(f"Async middleware added successfully: {middleware_name}. Total middlewares: {len(self.middlewares)}")
+
+    async def process_request(self, request: web.Request, route_class: str = ROUTE_PROXY) -> Optional[web.StreamResponse]:
+        for middleware_name, middleware, request_timer, _, short_circuits in self.pipelines[route_class]:
+            started = time.perf_counter()
+            try:
+                response = await middleware.process_request(request)
+                request_timer.observe(time.perf_counter() - started)
+                if response is not None:
+                    short_circuits.inc()
+                    logger.info(f"Request short-circuited by middleware: {middleware_name} (Status: {getattr(response, 'status', 'N/A')})")
+                    if not isinstance(response, web.StreamResponse):
+                        logger.error(f"Middleware {middleware_name} returned unexpected type {type(response)} in process_request for {request.method} {request.path}. Returning 500.")
+                        return web.Response(text="Internal Server Error: Invalid middleware response type.", status=HTTPStatus.INTERNAL_SERVER_ERROR.value)
+                    return response
+            except Exception as e:
+                request_timer.observe(time.perf_counter() - started)
+                short_circuits.inc()
+                logger.exception(f"Error in process_request of {middleware_name} for {request.method} {request.path}: {e}")
+                return web.Response(text="Internal Server Error: Middleware processing failed.", status=HTTPStatus.INTERNAL_SERVER_ERROR.value)
+        return None
+
+    async def process_response(self, request: web.Request, response: web.StreamResponse,
+                               route_class: str = ROUTE_PROXY) -> web.StreamResponse:
+        processed_response = response
+        for middleware_name, middleware, _, response_timer, _ in reversed(self.pipelines[route_class]):
+            started = time.perf_counter()
+            try:
+                middleware_response = await middleware.process_response(request, processed_response)
+                response_timer.observe(time.perf_counter() - started)
+                if not isinstance(middleware_response, web.StreamResponse):
+                    logger.error(f"Response Middleware {middleware_name} returned unexpected type {type(middleware_response)} in process_response for {request.method} {request.path}. Attempting to continue with previous response.")
+                else:
+                    processed_response = middleware_response
+            except Exception as e:
+                response_timer.observe(time.perf_counter() - started)
+                logger.exception(f"Error in process_response of {middleware_name} for {request.method} {request.path}: {e}")
+        return processed_response
+
+
+class AsyncAdmissionControlMiddleware:
+    """Asyncio port of AdmissionControlMiddleware."""
+    def __init__(self, config: Dict[str, Any]):
+        self.controller = AsyncAdmissionController(config.get('ADMISSION_CONTROL_SETTINGS', {}))
+
+    async def process_request(self, request: web.Request) -> Optional[web.StreamResponse]:
+        priority_class = self.controller.classify(request.path, request.method, request.headers)
+        result = await self.controller.admit(priority_class)
+        if result != ADMITTED:
+            logger.warning(f"Request {request.method} {request.path} shed by admission control as {priority_class} ({result}).")
+            return _message_response("Gateway is overloaded. Please try again later.",
+                                     HTTPStatus.SERVICE_UNAVAILABLE.value,
+                                     headers={'Retry-After': str(self.controller.retry_after_seconds)})
+        slot = request['admission_slot'] = AdmissionSlot(self.controller)
+        # Stands in for teardown_request: gives the slot back if the response chain never runs.
+        weakref.finalize(request, slot.release)
+        return None
+
+    async def process_response(self, request: web.Request, response: web.StreamResponse) -> web.StreamResponse:
+        slot = request.pop('admission_slot', None)
+        if slot is not None:
+            call_on_close(response, slot.release)
+        return response
+
+
+class _AsyncRedisMixin:
+    """
+    Lazily connects a redis.asyncio client. While Redis is unreachable the middleware is
+    disabled and reconnects are attempted at most every REDIS_RECONNECT_INTERVAL_SECONDS.
+    """
+    REDIS_RECONNECT_INTERVAL_SECONDS = 5
+    REDIS_DECODE_RESPONSES = True
+    REDIS_SOCKET_TIMEOUT: Optional[float] = None
+    redis_client = None
+    _next_connect_attempt = 0.0
+
+    async def _init_redis_client(self) -> bool:
+        if self.redis_client is None and time.monotonic() >= self._next_connect_attempt:
+            self._next_connect_attempt = time.monotonic() + self.REDIS_RECONNECT_INTERVAL_SECONDS
+            try:
+                client = aioredis.StrictRedis(
+                    host=self.config.get('REDIS_HOST'),
+                    port=self.config.get('REDIS_PORT'),
+                    db=self.config.get('REDIS_DB'),
+                    password=self.config.get('REDIS_PASSWORD'),
+                    decode_responses=self.REDIS_DECODE_RESPONSES,
+                    socket_timeout=self.REDIS_SOCKET_TIMEOUT,
+                    socket_connect_timeout=self.REDIS_SOCKET_TIMEOUT
+                )
+                await client.ping()
+                await self._on_redis_connected(client)
+                self.redis_client = client
+                logger.info(f"Async Redis client initialized successfully for {type(self).__name__}.")
+            except Exception as e:
+                logger.error(f"An unexpected error occurred during async Redis client initialization for {type(self).__name__}: {e}. Retrying in {self.REDIS_RECONNECT_INTERVAL_SECONDS}s.")
+                self.redis_client = None
+        return self.redis_client is not None
+
+    async def _on_redis_connected(self, client):
+        """Hook for per-connection setup, run before the client is published."""
+        pass
+
+
+class AsyncCircuitBreakers:
+    """Asyncio port of circuit_breaker.CircuitBreakers."""
+    def __init__(self, redis_client, config: Dict[str, Any]):
+        self.config = config
+        self.local_states = BreakerStateCache(ttl_seconds=config.get('LOCAL_STATE_TTL_SECONDS', 1))
+        self._redis_client = redis_client
+        self._acquire_permission = redis_client.register_script(ACQUIRE_PERMISSION_SCRIPT)
+        self._record_outcomes = redis_client.register_script(RECORD_OUTCOMES_SCRIPT)
+        self._release_permission = redis_client.register_script(RELEASE_PERMISSION_SCRIPT)
+        self._subscription: Optional[asyncio.Task] = None
+        self.subscribe()
+
+    def subscribe(self):
+        if self._subscription is None:
+            self._subscription = asyncio.create_task(self._listen())
+
+    async def _listen(self):
+        try:
+            async with self._redis_client.pubsub(ignore_subscribe_messages=True) as pubsub:
+                await pubsub.subscribe(BREAKER_EVENTS_CHANNEL)
+                async for message in pubsub.listen():
+                    if message['type'] == 'message':
+                        self.local_states.on_event(message['data'])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Circuit breaker event subscription failed: {e}. Resubscribing on the next request.")
+        finally:
+            self._subscription = None
+
+    def is_open(self, breaker_name: str) -> bool:
+        return self.local_states.is_open(breaker_name, time.time(), self.config)
+
+    async def acquire(self, breaker_name: str) -> Tuple[bool, bool]:
+        self.subscribe()
+        current_time = time.time()
+        cached_state = self.local_states.get(breaker_name)
+        allowed = None if cached_state is None else local_breaker_decision(*cached_state, current_time, self.config)
+        if allowed is not None:
+            return allowed, False
+
+        allowed, state, since, changed = await self._acquire_permission(
+            keys=[build_breaker_key(breaker_name)],
+            args=acquire_permission_args(breaker_name, current_time, self.config)
+        )
+        self.local_states.update(breaker_name, state, float(since))
+        if changed:
+            log_transition(breaker_name, state)
+        return bool(allowed), bool(allowed) and state == CIRCUIT_HALF_OPEN
+
+    async def allow(self, breaker_name: str) -> bool:
+        return (await self.acquire(breaker_name))[0]
+
+    async def release(self, breaker_name: str):
+        await self._release_permission(keys=[build_breaker_key(breaker_name)])
+
+    async def record(self, outcomes: List[Tuple[str, bool, bool]]):
+        results = await self._record_outcomes(
+            keys=[build_breaker_key(breaker_name) for breaker_name, _, _ in outcomes],
+            args=record_outcomes_args(outcomes, time.time(), self.config)
+        )
+        for (breaker_name, _, _), (state, since, changed, calls, failures, slow_calls) in zip(outcomes, results):
+            self.local_states.update(breaker_name, state, float(since))
+            if changed:
+                log_transition(breaker_name, state, calls, failures, slow_calls)
+
+
+class AsyncCircuitBreakerMiddleware(_AsyncRedisMixin):
+    def __init__(self, config: Dict[str, Any]):
+        self.config = config
+        self.settings = config.get('CIRCUIT_BREAKER_SETTINGS', {})
+        self.breakers: Optional[AsyncCircuitBreakers] = None
+
+    async def _on_redis_connected(self, client):
+        self.breakers = AsyncCircuitBreakers(client, self.settings)
+
+    async def allow_instance(self, service_name: str, instance_url: str) -> bool:
+        """Asyncio port of CircuitBreakerMiddleware.allow_instance."""
+        if not self.settings.get('INSTANCE_BREAKERS_ENABLED', True) or not await self._init_redis_client():
+            return True
+        try:
+            return await self.breakers.allow(build_instance_breaker_name(service_name, instance_url))
+        except Exception as e:
+            logger.error(f"Circuit breaker check for {service_name} instance {instance_url} failed: {e}. Allowing request.")
+            return True
+
+    def service_is_open(self, service_name: str) -> bool:
+        """Asyncio port of CircuitBreakerMiddleware.service_is_open."""
+        return self.breakers is not None and self.breakers.is_open(service_name)
+
+    async def process_request(self, request: web.Request) -> Optional[web.StreamResponse]:
+        service_name = request['route'].breaker_name
+        if service_name is None or not await self._init_redis_client():
+            return None
+
+        request['breaker_started'] = time.time()
+        try:
+            allowed, request['breaker_trial'] = await self.breakers.acquire(service_name)
+        except Exception as e:
+            logger.error(f"Circuit breaker check for service '{service_name}' failed: {e}. Allowing request.")
+            allowed = True
+
+        if not allowed:
+            logger.warning(f"Circuit for service '{service_name}' is OPEN. Request rejected.")
+            fallback_message = self.config.get('CIRCUIT_BREAKER_FALLBACK_MESSAGE', "Service is currently unavailable.")
+            return _message_response(fallback_message, HTTPStatus.SERVICE_UNAVAILABLE.value)
+        return None
+
+    async def process_response(self, request: web.Request, response: web.StreamResponse) -> web.StreamResponse:
+        service_name = request['route'].breaker_name
+        if service_name is None or not await self._init_redis_client():
+            return response
+
+        attempts = request.get('upstream_attempts')
+        try:
+            if attempts:
+                # A stale cached copy may have replaced a failed response; record what the origin returned.
+                status_code = request.get('origin_status_code', response.status)
+                duration = time.time() - request.get('breaker_started', time.time())
+                await self.breakers.record(build_breaker_outcomes(service_name, status_code, duration, attempts, self.settings))
+            elif request.get('breaker_trial'):
+                await self.breakers.release(service_name)
+        except Exception as e:
+            logger.error(f"Failed to record circuit breaker outcome for service '{service_name}': {e}")
+        return response
+
+
+def _cached_web_response(data: Dict[str, Any]) -> web.Response:
+    headers = CIMultiDict((name, value) for name, value in data['headers'] if name.lower() not in ('content-length', 'age'))
+    headers['Age'] = str(int(cache_entry_age(data)))
+    return web.Response(body=data['body'], status=data['status_code'], headers=headers)
+
+
+def _not_modified_web_response(data: Dict[str, Any]) -> web.Response:
+    return web.Response(status=304, headers={'ETag': data['etag'], 'Age': str(int(cache_entry_age(data)))})
+
+
+class AsyncCachingMiddleware(_AsyncRedisMixin):
+    # Cache entries are binary.
+    REDIS_DECODE_RESPONSES = False
+
+    def __init__(self, config: Dict[str, Any], token_cache: Optional[VerifiedTokenCache] = None):
+        self.config = config
+        self.compression = config.get('CACHE_COMPRESSION_SETTINGS', {})
+        self.key_builder = CacheKeyBuilder(config.get('CACHE_KEY_SETTINGS', {}), config.get('JWT_SECRET_KEY'), token_cache)
+        self.default_policy = build_default_cache_policy(config)
+        self.route_policies = config.get('CACHE_ROUTE_POLICIES', {})
+        self.policies = build_cache_policies(self.default_policy, self.route_policies)
+        self.invalidation = config.get('CACHE_INVALIDATION_SETTINGS', {})
+        self.tag_ttl = max_storage_ttl(self.default_policy, self.route_policies)
+        self.coalescing = config.get('CACHE_COALESCING_SETTINGS', {})
+        self.single_flight = AsyncSingleFlight(abandon_after=self.coalescing.get('WAIT_TIMEOUT_SECONDS', 5))
+        self.local_cache = build_local_cache(config.get('CACHE_L1_SETTINGS', {}))
+        self._revalidations: Dict[str, asyncio.Task] = {}
+
+    def _cache_key(self, request: web.Request) -> str:
+        """Asyncio port of CachingMiddleware._cache_key; the raw query string matches Flask's."""
+        if 'cache_key' not in request:
+            request['cache_key'] = self.key_builder.build(request.path, request.rel_url.raw_query_string, request.headers)
+        return request['cache_key']
+
+    async def process_request(self, request: web.Request) -> Optional[web.StreamResponse]:
+        if request.method != 'GET' or not request['route'].cacheable:
+            return None
+        if not await self._init_redis_client():
+            return None
+        if request.get('cache_revalidating'):
+            await self._record_tag_versions(request)
+            return None
+
+        cache_key = self._cache_key(request)
+        policy = self.policies[request['route'].cache_route]
+
+        if request.headers.get('If-None-Match'):
+            not_modified = await self._check_not_modified(request, cache_key, policy)
+            if not_modified is not None:
+                return not_modified
+
+        data = await self._lookup(cache_key, policy)
+
+        if data is not None:
+            age = cache_entry_age(data)
+            if age <= policy['TTL_SECONDS']:
+                logger.info(f"Serving from cache: {full_path(request)}")
+                return self._serve_cached(request, data)
+            if age <= policy['TTL_SECONDS'] + policy['STALE_WHILE_REVALIDATE_SECONDS']:
+                await self._schedule_revalidation(request, cache_key)
+                CACHE_STALE_SERVED.labels('revalidate').inc()
+                logger.info(f"Serving stale response while revalidating: {full_path(request)}")
+                return self._serve_cached(request, data)
+            request['stale_cache_entry'] = data
+
+        await self._record_tag_versions(request)
+        if self.coalescing.get('ENABLED'):
+            return await self._coalesce_miss(request, cache_key, policy)
+        return None
+
+    def _entry_tags(self, request: web.Request) -> List[str]:
+        route = request['route']
+        if route.service_name is None or not self.invalidation.get('ENABLED', True):
+            return []
+        return cache_entry_tags(route.service_name, route.resource_path)
+
+    async def _record_tag_versions(self, request: web.Request):
+        """Asyncio port of CachingMiddleware._record_tag_versions."""
+        tags = self._entry_tags(request)
+        if not tags:
+            request['cache_tag_versions'] = []
+            return
+        try:
+            request['cache_tag_versions'] = await self.redis_client.mget([build_tag_version_key(tag) for tag in tags])
+        except Exception as e:
+            logger.warning(f"Failed to read cache tag versions for {full_path(request)}: {e}")
+
+    def _serve_cached(self, request: web.Request, data: Dict[str, Any]) -> web.Response:
+        request['served_from_cache'] = True
+        if etag_matches(request.headers.get('If-None-Match'), data.get('etag')):
+            CACHE_NOT_MODIFIED.inc()
+            return _not_modified_web_response(data)
+        return _cached_web_response(data)
+
+    async def _check_not_modified(self, request: web.Request, cache_key: str, policy: Dict[str, float]) -> Optional[web.Response]:
+        """Asyncio port of CachingMiddleware._check_not_modified."""
+        validator = self.local_cache.get(cache_key) if self.local_cache is not None else None
+        # An L1 entry decoded from headers without an ETag has no etag, but its Redis etag record may.
+        if validator is None or not validator.get('etag'):
+            etag_entry = await self.redis_client.get(build_etag_key(cache_key))
+            if not etag_entry:
+                return None
+            try:
+                validator = json.loads(etag_entry)
+            except json.JSONDecodeError:
+                return None
+
+        if not etag_matches(request.headers.get('If-None-Match'), validator.get('etag')):
+            return None
+
+        age = cache_entry_age(validator)
+        if age > policy['TTL_SECONDS']:
+            if age > policy['TTL_SECONDS'] + policy['STALE_WHILE_REVALIDATE_SECONDS']:
+                return None
+            await self._schedule_revalidation(request, cache_key)
+
+        logger.debug(f"Not modified: {full_path(request)}")
+        request['served_from_cache'] = True
+        CACHE_NOT_MODIFIED.inc()
+        return _not_modified_web_response(validator)
+
+    async def _lookup(self, cache_key: str, policy: Dict[str, float]) -> Optional[Dict[str, Any]]:
+        """Asyncio port of CachingMiddleware._lookup."""
+        if self.local_cache is not None:
+            data = self.local_cache.get(cache_key)
+            if data is not None and cache_entry_age(data) <= policy['TTL_SECONDS']:
+                CACHE_LOOKUPS.labels('l1', 'hit').inc()
+                return data
+            CACHE_LOOKUPS.labels('l1', 'miss').inc()
+
+        cached_response = await self.redis_client.get(cache_key)
+        CACHE_LOOKUPS.labels('l2', 'hit' if cached_response else 'miss').inc()
+        if not cached_response:
+            return None
+
+        try:
+            data = deserialize_cache_entry(cached_response)
+        except Exception as e:
+            logger.warning(f"Failed to decode cached response for {cache_key}: {e}. Fetching from origin.")
+            await self.redis_client.delete(cache_key)
+            return None
+
+        self._store_local(cache_key, data, policy)
+        return data
+
+    async def _coalesce_miss(self, request: web.Request, cache_key: str, policy: Dict[str, float]) -> Optional[web.StreamResponse]:
+        """Asyncio port of CachingMiddleware._coalesce_miss."""
+        flight, is_leader = self.single_flight.join(cache_key)
+        if not is_leader:
+            try:
+                await asyncio.wait_for(flight.event.wait(), self.coalescing.get('WAIT_TIMEOUT_SECONDS', 5))
+            except asyncio.TimeoutError:
+                return None
+            if flight.result is None:
+                return None
+            CACHE_COALESCED_REQUESTS.labels('process').inc()
+            logger.debug(f"Serving coalesced response for: {full_path(request)}")
+            return self._serve_cached(request, flight.result)
+
+        lock_key = build_fill_lock_key(cache_key)
+        lock_token = uuid.uuid4().hex
+        request['cache_flight'] = (cache_key, flight, None)
+        try:
+            if await self.redis_client.set(lock_key, lock_token, nx=True, px=self.coalescing.get('LOCK_TTL_MS', 5000)):
+                request['cache_flight'] = (cache_key, flight, lock_token)
+                return None
+
+            deadline = time.monotonic() + self.coalescing.get('LOCK_WAIT_SECONDS', 2)
+            while time.monotonic() < deadline:
+                await asyncio.sleep(self.coalescing.get('POLL_INTERVAL_SECONDS', 0.05))
+                cached_response, lock_holder = await self.redis_client.mget(cache_key, lock_key)
+                if cached_response:
+                    data = deserialize_cache_entry(cached_response)
+                    self._store_local(cache_key, data, policy)
+                    del request['cache_flight']
+                    self.single_flight.complete(cache_key, flight, data)
+                    CACHE_COALESCED_REQUESTS.labels('cluster').inc()
+                    logger.debug(f"Serving response cached by another worker for: {full_path(request)}")
+                    return self._serve_cached(request, data)
+                if lock_holder is None:
+                    break
+        except Exception as e:
+            logger.error(f"Cache fill coordination failed for {full_path(request)}: {e}. Fetching from origin.")
+        return None
+
+    def _store_local(self, cache_key: str, data: Dict[str, Any], policy: Dict[str, float]):
+        if self.local_cache is not None:
+            self.local_cache.set(cache_key, data, cache_entry_size(data), ttl_seconds=cache_storage_ttl(policy))
+
+    async def _schedule_revalidation(self, request: web.Request, cache_key: str):
+        """
+        Refreshes a stale entry in a background task that dispatches a copy of the request through
+        the app's middleware chain. Same de-duplication and breaker check as the Flask middleware.
+        """
+        if cache_key in self._revalidations:
+            return
+        breaker_name = request['route'].breaker_name
+        circuit_breaker = request.app.get('circuit_breaker')
+        if breaker_name is not None and circuit_breaker is not None and circuit_breaker.service_is_open(breaker_name):
+            logger.debug(f"Not revalidating {cache_key}: the circuit for '{breaker_name}' is open.")
+            return
+        try:
+            claimed = await self.redis_client.set(build_revalidate_lock_key(cache_key), 1, nx=True,
+                                                  px=self.coalescing.get('LOCK_TTL_MS', 5000))
+        except Exception as e:
+            logger.warning(f"Failed to claim revalidation of {cache_key}: {e}")
+            claimed = False
+        if not claimed or cache_key in self._revalidations:
+            return
+
+        headers = {k: v for k, v in request.headers.items() if k.lower() != 'if-none-match'}
+        revalidation_request = request.clone(headers=headers)
+        # The clone starts with a copy of this request's state (admission slot, breaker permit...),
+        # which belongs to this request; the middlewares build their own for the clone.
+        for key in list(revalidation_request):
+            del revalidation_request[key]
+        revalidation_request['cache_revalidating'] = True
+        task = asyncio.create_task(self._revalidate(revalidation_request, cache_key))
+        self._revalidations[cache_key] = task
+        task.add_done_callback(lambda _: self._revalidations.pop(cache_key, None))
+
+    async def _revalidate(self, request: web.Request, cache_key: str):
+        # Imported here since the app module imports this one.
+        from . import gateway_middleware
+        try:
+            # Admission, the circuit breaker, auth and rate limits apply as they do to client requests.
+            response = await gateway_middleware(request, request.match_info.handler)
+            logger.debug(f"Revalidated {cache_key} (status {response.status}).")
+        except Exception as e:
+            logger.error(f"Background revalidation of {cache_key} failed: {e}")
+
+    async def _serve_stale_if_error(self, request: web.Request, response: web.StreamResponse) -> Optional[web.StreamResponse]:
+        """Asyncio port of CachingMiddleware._serve_stale_if_error."""
+        if not request['route'].cacheable or not await self._init_redis_client():
+            return None
+
+        policy = self.policies[request['route'].cache_route]
+        data = request.pop('stale_cache_entry', None)
+        if data is None:
+            try:
+                data = await self._lookup(self._cache_key(request), policy)
+            except Exception as e:
+                logger.error(f"Failed to look up stale response for {full_path(request)}: {e}")
+                return None
+
+        if data is None or cache_entry_age(data) > policy['TTL_SECONDS'] + policy['STALE_IF_ERROR_SECONDS']:
+            return None
+
+        request['origin_status_code'] = response.status
+        CACHE_STALE_SERVED.labels('error').inc()
+        logger.warning(f"Serving stale response for {full_path(request)} after upstream error {response.status}.")
+        return _cached_web_response(data)
+
+    async def _finish_flight(self, request: web.Request, data: Optional[Dict[str, Any]]):
+        cache_flight = request.pop('cache_flight', None)
+        if cache_flight is None:
+            return
+        cache_key, flight, lock_token = cache_flight
+        self.single_flight.complete(cache_key, flight, data)
+        if lock_token is not None:
+            try:
+                await self.redis_client.eval(RELEASE_FILL_LOCK_SCRIPT, 1, build_fill_lock_key(cache_key), lock_token)
+            except Exception as e:
+                logger.warning(f"Failed to release cache fill lock for {cache_key}: {e}")
+
+    async def invalidate(self, service_name: str, resource_path: str, source: str, recursive: bool = True) -> int:
+        """Asyncio port of CachingMiddleware.invalidate."""
+        if not await self._init_redis_client():
+            return 0
+
+        tags = invalidation_tags(service_name, resource_path, recursive)
+        purged = {cache_key.decode('utf-8') for cache_key in
+                  await self.redis_client.eval(PURGE_TAGS_SCRIPT, *purge_tags_args(tags, self.tag_ttl))}
+        if self.local_cache is not None:
+            for cache_key in purged:
+                self.local_cache.delete(cache_key)
+
+        CACHE_INVALIDATIONS.labels(source).inc()
+        CACHE_INVALIDATED_ENTRIES.inc(len(purged))
+        logger.info(f"Invalidated {len(purged)} cache entries for {service_name}{resource_path} ({source}).")
+        return len(purged)
+
+    async def process_response(self, request: web.Request, response: web.StreamResponse) -> web.StreamResponse:
+        if request.method in INVALIDATING_METHODS:
+            route = request['route']
+            if route.service_name is not None and response.status < 400 and self.invalidation.get('ENABLED', True):
+                try:
+                    await self.invalidate(route.service_name, route.resource_path, source='request',
+                                          recursive=request.method != 'POST')
+                except Exception as e:
+                    logger.error(f"Failed to invalidate cache after {request.method} {request.path}: {e}")
+            return response
+
+        if request.method == 'GET' and response.status >= 500 and not request.get('cache_revalidating'):
+            stale_response = await self._serve_stale_if_error(request, response)
+            if stale_response is not None:
+                await self._finish_flight(request, None)
+                return stale_response
+
+        if request.get('served_from_cache'):
+            return response
+        if request.method != 'GET' or response.status != 200:
+            await self._finish_flight(request, None)
+            return response
+        if not isinstance(response, web.Response) or not isinstance(response.body, bytes):
+            # Streamed responses are never cached.
+            await self._finish_flight(request, None)
+            return response
+        if not request['route'].cacheable or not await self._init_redis_client():
+            await self._finish_flight(request, None)
+            return response
+
+        cache_key = self._cache_key(request)
+        policy = self.policies[request['route'].cache_route]
+        stored_at = time.time()
+        etag = response.headers.get('ETag') or compute_etag(response.body)
+        response.headers['ETag'] = etag
+        data = {"body": response.body, "status_code": response.status, "headers": cacheable_headers(response.headers.items()),
+                "stored_at": stored_at, "etag": etag}
+        cache_entry = serialize_cache_entry(response.body, data['status_code'], data['headers'], stored_at, self.compression)
+        stored = False
+        tag_versions = request.get('cache_tag_versions')
+        if tag_versions is None:
+            logger.debug(f"Not caching {full_path(request)}: its tag versions are unknown.")
+        else:
+            try:
+                stored = await self.redis_client.eval(STORE_ENTRY_SCRIPT, *store_entry_args(
+                    cache_key, cache_entry, serialize_etag_entry(etag, stored_at), cache_storage_ttl(policy),
+                    self._entry_tags(request), tag_versions, self.tag_ttl))
+                if stored:
+                    logger.info(f"Cached response for: {full_path(request)}")
+                else:
+                    logger.info(f"Not caching {full_path(request)}: it was purged while being fetched.")
+            except Exception as e:
+                logger.error(f"Failed to cache response for {full_path(request)}: {e}")
+                stored = True
+            if stored:
+                self._store_local(cache_key, data, policy)
+        await self._finish_flight(request, data if stored else None)
+        if etag_matches(request.headers.get('If-None-Match'), etag):
+            CACHE_NOT_MODIFIED.inc()
+            return _not_modified_web_response(data)
+        return response
+
+
+class AsyncAuthMiddleware:
+    def __init__(self, config: Dict[str, Any], token_cache: Optional[VerifiedTokenCache] = None):
+        self.jwt_secret = os.getenv('JWT_SECRET_KEY') or config.get('JWT_SECRET_KEY')
+        if not self.jwt_secret:
+            logger.error("JWT_SECRET_KEY is not set. Authentication will not work.")
+        self.token_cache = token_cache
+
+    def _verify(self, token: str) -> Dict[str, Any]:
+        return verify_token(token, self.jwt_secret, self.token_cache)
+
+    async def process_request(self, request: web.Request) -> Optional[web.StreamResponse]:
+        if request['route'].auth_exempt:
+            return None
+
+        auth_header = request.headers.get('Authorization')
+        if not auth_header:
+            logger.warning("Authorization header missing for protected route.")
+            return _message_response("Authorization header missing", HTTPStatus.UNAUTHORIZED.value)
+
+        try:
+            token_type, token = auth_header.split(' ', 1)
+            if token_type.lower() != 'bearer':
+                logger.warning("Invalid token type. Expected Bearer.")
+                return _message_response("Invalid token type", HTTPStatus.UNAUTHORIZED.value)
+
+            if not self.jwt_secret:
+                raise ValueError("JWT_SECRET_KEY is not configured.")
+
+            payload = self._verify(token)
+            request['user'] = payload
+            return None
+        except jwt.ExpiredSignatureError:
+            logger.warning("JWT token has expired.")
+            return _message_response("Token has expired", HTTPStatus.UNAUTHORIZED.value)
+        except jwt.InvalidTokenError as e:
+            logger.warning(f"Invalid JWT token: {e}")
+            return _message_response(f"Invalid token: {e}", HTTPStatus.UNAUTHORIZED.value)
+        except ValueError as e:
+            logger.error(f"AsyncAuthMiddleware configuration error: {e}")
+            return _message_response("Server authentication configuration error", HTTPStatus.INTERNAL_SERVER_ERROR.value)
+        except Exception as e:
+            logger.exception(f"An unexpected error occurred during authentication: {e}")
+            return _message_response("An unexpected authentication error occurred", HTTPStatus.INTERNAL_SERVER_ERROR.value)
+
+    async def process_response(self, request: web.Request, response: web.StreamResponse) -> web.StreamResponse:
+        return response
+
+
+class AsyncRateLimiterMiddleware(_AsyncRedisMixin):
+    """Asyncio port of RateLimiterMiddleware."""
+    def __init__(self, config: Dict[str, Any]):
+        self.config = config
+        self.settings = config.get('RATE_LIMIT_SETTINGS', {})
+        self.rules = build_rate_limit_rules(config)
+        self.trusted_proxies = parse_trusted_proxies(self.settings.get('TRUSTED_PROXIES', []))
+        self.api_keys = parse_api_keys(self.settings.get('API_KEYS', []))
+        self.local_limiter = SlidingWindowRateLimiter(self.settings.get('LOCAL_MAX_CLIENTS', 100000))
+        self.REDIS_SOCKET_TIMEOUT = self.settings.get('REDIS_TIMEOUT_SECONDS', 0.1)
+        self.REDIS_RECONNECT_INTERVAL_SECONDS = self.settings.get('REDIS_RETRY_INTERVAL_SECONDS', 5)
+        self._gcra = None
+
+    async def _on_redis_connected(self, client):
+        self._gcra = client.register_script(GCRA_SCRIPT)
+
+    async def _decide(self, key: str, rule: Dict[str, Any], current_time: float) -> Tuple[int, RateLimitDecision]:
+        if self.settings.get('BACKEND', 'redis') == 'redis' and await self._init_redis_client():
+            try:
+                decision = parse_gcra_result(await self._gcra(keys=[key], args=gcra_args(current_time, rule)))
+                RATE_LIMIT_DECISIONS.labels('redis', 'allowed' if decision[0] else 'limited').inc()
+                return rule['burst'], decision
+            except aioredis.RedisError as e:
+                logger.error(f"Rate limiter lost Redis: {e}. Limiting per process until it is reachable.")
+                self.redis_client = None
+                self._next_connect_attempt = time.monotonic() + self.REDIS_RECONNECT_INTERVAL_SECONDS
+
+        decision = self.local_limiter.hit(key, rule['limit'], rule['window_seconds'], current_time)
+        RATE_LIMIT_DECISIONS.labels('local', 'allowed' if decision[0] else 'limited').inc()
+        return rule['limit'], decision
+
+    async def process_request(self, request: web.Request) -> Optional[web.StreamResponse]:
+        ip = client_ip(request.remote, request.headers.get('X-Forwarded-For'), self.trusted_proxies)
+        identity_kind, identity = request_identity(
+            request.headers.get(self.settings.get('API_KEY_HEADER', 'X-API-Key')), request.get('user'), ip, self.api_keys
+        )
+        rule = self.rules.resolve(request.path, request.method, identity_kind)
+        current_time = time.time()
+        limit, decision = await self._decide(build_rate_limit_key(rule['name'], identity_kind, identity), rule, current_time)
+        request['rate_limit_headers'] = rate_limit_headers(limit, decision, current_time)
+
+        if not decision[0]:
+            logger.warning(f"Rate limit '{rule['name']}' exceeded for {identity_kind} {identity}")
+            return _message_response("Too many requests. Please try again later.", HTTPStatus.TOO_MANY_REQUESTS.value)
+        return None
+
+    async def process_response(self, request: web.Request, response: web.StreamResponse) -> web.StreamResponse:
+        response.headers.update(request.get('rate_limit_headers', {}))
+        return response
@@ -0,0 +1,253 @@
+import asyncio
+import logging
+import time
+import weakref
+from functools import partial
+from http import HTTPStatus
+from typing import Callable, Dict, List, Optional
+
+import aiohttp
+from aiohttp import web
+
+from ..metrics import UPSTREAM_DISCOVERY_LATENCY, UPSTREAM_CONNECT_LATENCY, UPSTREAM_TTFB, UPSTREAM_BODY_TRANSFER, UPSTREAM_RESPONSES
+from ..utils.concurrency import ConcurrencySlot
+from ..utils.errors import ServiceUnavailableError, APIError, upstream_error
+from ..utils.upstream import EXCLUDED_REQUEST_HEADERS, EXCLUDED_RESPONSE_HEADERS, get_stream_threshold, instance_label, status_class
+
+logger = logging.getLogger(__name__)
+
+UPSTREAM_TIMEOUT = aiohttp.ClientTimeout(total=None, connect=10, sock_read=10)
+
+
+def _phase_trace_config(service_name: str) -> aiohttp.TraceConfig:
+    """
+    Times the new connections a service's session opens and the time to first byte, like the
+    Flask engine's pool connections. TTFB starts once the request is written, so it excludes connect time.
+    """
+    async def on_request_start(session, ctx, params):
+        ctx.instance = instance_label(str(params.url))
+
+    async def on_connection_create_start(session, ctx, params):
+        ctx.connect_started = time.perf_counter()
+
+    async def on_connection_create_end(session, ctx, params):
+        UPSTREAM_CONNECT_LATENCY.labels(service_name, ctx.instance).observe(time.perf_counter() - ctx.connect_started)
+
+    async def on_request_sent(session, ctx, params):
+        # Moved on by every body chunk, so the upload is not counted either.
+        ctx.request_sent = time.perf_counter()
+
+    async def on_request_end(session, ctx, params):
+        # Fires once the response headers have been read.
+        UPSTREAM_TTFB.labels(service_name, ctx.instance).observe(time.perf_counter() - ctx.request_sent)
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_connection_create_start.append(on_connection_create_start)
+    trace_config.on_connection_create_end.append(on_connection_create_end)
+    trace_config.on_request_headers_sent.append(on_request_sent)
+    trace_config.on_request_chunk_sent.append(on_request_sent)
+    trace_config.on_request_end.append(on_request_end)
+    return trace_config
+
+
+class AsyncUpstreamSessionPool:
+    """
+    Keeps one aiohttp.ClientSession per upstream service. Its connector keeps
+    keep-alive connections per instance, so concurrent requests only cost a socket each.
+    """
+    def __init__(self, settings: Dict):
+        self.pool_maxsize = settings.get('POOL_MAXSIZE', 20)
+        self.pool_block = settings.get('POOL_BLOCK', False)
+        self.idle_timeout = settings.get('IDLE_TIMEOUT_SECONDS', 30)
+        self._sessions: Dict[str, aiohttp.ClientSession] = {}
+
+    def get_session(self, service_name: str) -> aiohttp.ClientSession:
+        """Returns the session for a service. Must be called from the running event loop."""
+        session = self._sessions.get(service_name)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=0,
+                limit_per_host=self.pool_maxsize if self.pool_block else 0,
+                keepalive_timeout=self.idle_timeout,
+            )
+            session = aiohttp.ClientSession(connector=connector, trace_configs=[_phase_trace_config(service_name)])
+            self._sessions[service_name] = session
+            logger.info(f"Created async upstream session for service '{service_name}'.")
+        return session
+
+    async def close(self, app=None):
+        for service_name, session in self._sessions.items():
+            await session.close()
+            logger.info(f"Closed async upstream session for service '{service_name}'.")
+        self._sessions = {}
+
+
+def call_on_close(response: web.StreamResponse, callback: Callable[[], None]):
+    """
+    Asyncio counterpart of Flask's Response.call_on_close: runs `callback` once a streamed
+    proxy body has been relayed or abandoned, and right away for bodies already in memory.
+    """
+    close_callbacks = response.get('close_callbacks')
+    if close_callbacks is None:
+        callback()
+    else:
+        close_callbacks.append(callback)
+
+
+def _run_close_callbacks(close_callbacks: List[Callable[[], None]]):
+    # Drained, so each callback runs once whether the body finished or the response was dropped unsent.
+    while close_callbacks:
+        close_callbacks.pop(0)()
+
+
+async def _iter_upstream_body(resp: aiohttp.ClientResponse, service_name: str, chunk_size: int,
+                              close_callbacks: List[Callable[[], None]]):
+    """Relays the upstream body in bounded chunks, then releases the connection and runs `close_callbacks`."""
+    started = time.perf_counter()
+    try:
+        async for chunk in resp.content.iter_chunked(chunk_size):
+            yield chunk
+    except aiohttp.ClientError as e:
+        logger.error(f"Upstream stream from service '{service_name}' was interrupted: {e}")
+        raise
+    finally:
+        UPSTREAM_BODY_TRANSFER.labels(service_name, instance_label(str(resp.url))).observe(time.perf_counter() - started)
+        resp.release()
+        _run_close_callbacks(close_callbacks)
+
+
+async def _choose_instance(request: web.Request, service_name: str) -> Optional[str]:
+    """
+    Asyncio port of ConsulServiceDiscovery.get_service_address, skipping instances whose
+    circuit breaker rejects the request.
+    """
+    service_discovery_client = request.app['service_discovery_client']
+    if service_discovery_client.is_watched(service_name):
+        instances = service_discovery_client.get_service_addresses(service_name)
+    else:
+        instances = await asyncio.get_running_loop().run_in_executor(
+            None, service_discovery_client.get_service_addresses, service_name
+        )
+    if not instances:
+        logger.warning(f"No healthy instances found for service: {service_name}")
+        return None
+
+    circuit_breaker = request.app.get('circuit_breaker')
+    while instances:
+        service_url = service_discovery_client.load_balancer.choose(service_name, instances)
+        if circuit_breaker is None or await circuit_breaker.allow_instance(service_name, service_url):
+            return service_url
+        instances = [url for url in instances if url != service_url]
+
+    logger.warning(f"All instances of service '{service_name}' were rejected by their circuit breakers.")
+    return None
+
+
+async def proxy_handler(request: web.Request) -> web.StreamResponse:
+    """Asyncio port of routes._proxy_request for /proxy/<service_name>/<path>."""
+    service_name = request.match_info['service_name']
+    concurrency_limiter = request.app['concurrency_limiter']
+    if not concurrency_limiter.is_enabled(service_name):
+        return await _forward_request(request, service_name)
+
+    if not concurrency_limiter.acquire(service_name):
+        raise ServiceUnavailableError(f"Service '{service_name}' is overloaded.",
+                                      headers={'Retry-After': str(concurrency_limiter.retry_after_seconds)})
+    slot = ConcurrencySlot(concurrency_limiter, service_name)
+    try:
+        response = await _forward_request(request, service_name)
+    except BaseException:
+        slot.release(request.get('upstream_attempts'))
+        raise
+    # The call lasts until a streamed body has been relayed.
+    call_on_close(response, partial(slot.release, request.get('upstream_attempts')))
+    return response
+
+
+async def _forward_request(request: web.Request, service_name: str) -> web.StreamResponse:
+    path = request.match_info['path']
+    config = request.app['config']
+
+    service_discovery_client = request.app['service_discovery_client']
+    discovery_start = time.perf_counter()
+    service_url = await _choose_instance(request, service_name)
+    UPSTREAM_DISCOVERY_LATENCY.labels(service_name).observe(time.perf_counter() - discovery_start)
+    if not service_url:
+        raise ServiceUnavailableError(f"Service '{service_name}' not found or no healthy instances available.")
+
+    target_url = f"{service_url}/{path}"
+    headers = {k: v for k, v in request.headers.items() if k.lower() not in EXCLUDED_REQUEST_HEADERS}
+
+    streaming_settings = config.get('PROXY_STREAMING_SETTINGS', {})
+    stream_threshold = get_stream_threshold(streaming_settings, service_name, path)
+    chunk_size = streaming_settings.get('CHUNK_SIZE_BYTES', 64 * 1024)
+
+    if request.body_exists and (request.content_length is None or request.content_length > stream_threshold):
+        data = request.content.iter_chunked(chunk_size)
+    else:
+        data = await request.read()
+
+    session = request.app['upstream_session_pool'].get_session(service_name)
+    load_balancer = service_discovery_client.load_balancer
+    load_balancer.on_request_start(service_url)
+    upstream_start = time.time()
+    upstream_failed = True
+    resp = None
+    status = None
+    instance = instance_label(service_url)
+    try:
+        # Returns as soon as the response headers are in; the body is read below.
+        resp = await session.request(
+            request.method,
+            target_url,
+            headers=headers,
+            data=data,
+            params=request.rel_url.query,
+            allow_redirects=False,
+            timeout=UPSTREAM_TIMEOUT,
+        )
+        status = resp.status
+
+        response_headers = [(name, value) for name, value in resp.headers.items() if name.lower() not in EXCLUDED_RESPONSE_HEADERS]
+        upstream_failed = resp.status >= 500
+
+        if resp.status >= 400:
+            raise upstream_error(resp.status, await resp.text())
+
+        # Background cache revalidations always buffer, since the body is stored rather than relayed.
+        if request.get('cache_revalidating') or (resp.content_length is not None and resp.content_length <= stream_threshold):
+            body_start = time.perf_counter()
+            body = await resp.read()
+            UPSTREAM_BODY_TRANSFER.labels(service_name, instance).observe(time.perf_counter() - body_start)
+            return web.Response(body=body, status=resp.status, headers=response_headers)
+
+        logger.debug(f"Streaming response from '{service_name}' for {path} (Content-Length: {resp.content_length}).")
+        streamed_resp, resp = resp, None
+        close_callbacks = []
+        response = web.Response(body=_iter_upstream_body(streamed_resp, service_name, chunk_size, close_callbacks),
+                                status=streamed_resp.status, headers=response_headers)
+        response['close_callbacks'] = close_callbacks
+        # A body that is never relayed (the client left before the headers went out) never runs its finally.
+        weakref.finalize(response, _run_close_callbacks, close_callbacks)
+        return response
+
+    except APIError:
+        raise
+    except asyncio.TimeoutError:
+        logger.error(f"Service '{service_name}' at {service_url} timed out.")
+        raise ServiceUnavailableError(f"Service '{service_name}' timed out.")
+    except aiohttp.ClientConnectionError:
+        logger.error(f"Service '{service_name}' at {service_url} is unavailable (Connection Error).")
+        raise ServiceUnavailableError(f"Service '{service_name}' is unavailable.")
+    except Exception as e:
+        logger.exception(f"An unexpected error occurred during proxying request to {service_name}: {e}")
+        raise APIError(message=f"An internal error occurred: {str(e)}", code=HTTPStatus.INTERNAL_SERVER_ERROR.value)
+    finally:
+        latency = time.time() - upstream_start
+        load_balancer.on_request_end(service_url, latency, upstream_failed)
+        # Outcome of the upstream attempt, recorded by the circuit breaker middleware.
+        request.setdefault('upstream_attempts', []).append((service_url, latency, upstream_failed))
+        UPSTREAM_RESPONSES.labels(service_name, instance, status_class(status)).inc()
+        if resp is not None:
+            resp.release()
@@ -5,24 +5,195 @@ class Config:
     SECRET_KEY = os.getenv('FLASK_SECRET_KEY', 'a_very_secret_key_for_flask')
     JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY')
     CIRCUIT_BREAKER_SETTINGS = {
-        'FAILURE_THRESHOLD': int(os.getenv('CB_FAILURE_THRESHOLD', 5)),
+        # Sliding window of outcomes, kept per service and per upstream instance
+        'WINDOW_SECONDS': int(os.getenv('CB_WINDOW_SECONDS', 10)),
+        'WINDOW_BUCKETS': int(os.getenv('CB_WINDOW_BUCKETS', 10)),
+        'MINIMUM_CALLS': int(os.getenv('CB_MINIMUM_CALLS', 10)),
+        'FAILURE_RATE_THRESHOLD': float(os.getenv('CB_FAILURE_RATE_THRESHOLD', 50)),
+        'SLOW_CALL_RATE_THRESHOLD': float(os.getenv('CB_SLOW_CALL_RATE_THRESHOLD', 80)),
+        'SLOW_CALL_DURATION_SECONDS': float(os.getenv('CB_SLOW_CALL_DURATION_SECONDS', 5)),
+        'INSTANCE_BREAKERS_ENABLED': os.getenv('CB_INSTANCE_BREAKERS_ENABLED', 'True').lower() == 'true',
         'RECOVERY_TIMEOUT_SECONDS': int(os.getenv('CB_RECOVERY_TIMEOUT_SECONDS', 30)),
-        'HALF_OPEN_TIMEOUT_SECONDS': int(os.getenv('CB_HALF_OPEN_TIMEOUT_SECONDS', 5))
+        # Trial requests let through while HALF-OPEN; permits not reported back in time are handed out again
+        'HALF_OPEN_MAX_CALLS': int(os.getenv('CB_HALF_OPEN_MAX_CALLS', 3)),
+        'HALF_OPEN_TIMEOUT_SECONDS': int(os.getenv('CB_HALF_OPEN_TIMEOUT_SECONDS', 5)),
+        # Per-process copy of breaker states; transitions are also pushed through Redis pub/sub
+        'LOCAL_STATE_TTL_SECONDS': float(os.getenv('CB_LOCAL_STATE_TTL_SECONDS', 1))
     }
     CIRCUIT_BREAKER_FALLBACK_MESSAGE = "Service is currently unavailable. Circuit breaker is open."
     CONSUL_HOST = os.getenv('CONSUL_HOST', 'consul') 
     CONSUL_PORT = int(os.getenv('CONSUL_PORT', 8500))
     DISCOVERABLE_SERVICES = ['users_service', 'products_service']
+    SERVICE_DISCOVERY_SETTINGS = {
+        'WATCH_WAIT': os.getenv('CONSUL_WATCH_WAIT', '55s'),
+        'STALE_AFTER_SECONDS': int(os.getenv('CONSUL_STALE_AFTER_SECONDS', 120)),
+        # Last known instances older than this are dropped instead of served; 0 keeps them while Consul is down
+        'EXPIRE_AFTER_SECONDS': float(os.getenv('CONSUL_EXPIRE_AFTER_SECONDS', 0)),
+        'MAX_RETRY_BACKOFF_SECONDS': int(os.getenv('CONSUL_MAX_RETRY_BACKOFF_SECONDS', 30))
+    }
+    LOAD_BALANCER_SETTINGS = {
+        # One of: random, round_robin, least_outstanding, p2c_ewma
+        'DEFAULT_STRATEGY': os.getenv('LOAD_BALANCER_DEFAULT_STRATEGY', 'random'),
+        # '<service_name>': strategy, e.g. 'products_service': 'p2c_ewma'
+        'SERVICE_STRATEGIES': {},
+        'EWMA_DECAY_SECONDS': float(os.getenv('LOAD_BALANCER_EWMA_DECAY_SECONDS', 10)),
+        'FAILURE_PENALTY_SECONDS': float(os.getenv('LOAD_BALANCER_FAILURE_PENALTY_SECONDS', 2))
+    }
+    ADAPTIVE_CONCURRENCY_SETTINGS = {
+        'ENABLED': os.getenv('ADAPTIVE_CONCURRENCY_ENABLED', 'False').lower() == 'true',
+        # Services whose requests are limited; empty means every service
+        'SERVICES': [],
+        'INITIAL_LIMIT': int(os.getenv('ADAPTIVE_CONCURRENCY_INITIAL_LIMIT', 20)),
+        'MIN_LIMIT': int(os.getenv('ADAPTIVE_CONCURRENCY_MIN_LIMIT', 2)),
+        'MAX_LIMIT': int(os.getenv('ADAPTIVE_CONCURRENCY_MAX_LIMIT', 200)),
+        # Latency may rise this much over the long-term average before the limit shrinks
+        'RTT_TOLERANCE': float(os.getenv('ADAPTIVE_CONCURRENCY_RTT_TOLERANCE', 1.5)),
+        'SHORT_WINDOW': int(os.getenv('ADAPTIVE_CONCURRENCY_SHORT_WINDOW', 10)),
+        'LONG_WINDOW': int(os.getenv('ADAPTIVE_CONCURRENCY_LONG_WINDOW', 600)),
+        'SMOOTHING': float(os.getenv('ADAPTIVE_CONCURRENCY_SMOOTHING', 0.2)),
+        # Multiplier applied to the limit on every failed or timed out call
+        'BACKOFF_RATIO': float(os.getenv('ADAPTIVE_CONCURRENCY_BACKOFF_RATIO', 0.9)),
+        'RETRY_AFTER_SECONDS': int(os.getenv('ADAPTIVE_CONCURRENCY_RETRY_AFTER_SECONDS', 1))
+    }
+    ADMISSION_CONTROL_SETTINGS = {
+        'ENABLED': os.getenv('ADMISSION_CONTROL_ENABLED', 'False').lower() == 'true',
+        # Requests each gateway process works on at once; the rest queue by priority class
+        'MAX_CONCURRENT': int(os.getenv('ADMISSION_MAX_CONCURRENT', 64)),
+        'RETRY_AFTER_SECONDS': int(os.getenv('ADMISSION_RETRY_AFTER_SECONDS', 1)),
+        # Most important first; each class queues at most max_queue requests for max_queue_time_seconds
+        'CLASSES': [
+            {'name': 'critical', 'max_queue': 100, 'max_queue_time_seconds': 2.0},
+            {'name': 'high', 'max_queue': 200, 'max_queue_time_seconds': 1.0},
+            {'name': 'normal', 'max_queue': 200, 'max_queue_time_seconds': 0.5},
+            {'name': 'low', 'max_queue': 50, 'max_queue_time_seconds': 0.2}
+        ],
+        # First match wins, on any of 'route' (path prefix), 'methods' and 'header' (with an optional 'value')
+        'RULES': [
+            {'class': 'critical', 'route': '/gateway/health'},
+            {'class': 'critical', 'route': '/metrics'},
+            {'class': 'low', 'header': 'X-Request-Priority', 'value': 'low'},
+            {'class': 'high', 'methods': ['POST', 'PUT', 'PATCH', 'DELETE']}
+        ],
+        'DEFAULT_CLASS': 'normal'
+    }
+    HEDGING_SETTINGS = {
+        'ENABLED': os.getenv('HEDGING_ENABLED', 'False').lower() == 'true',
+        # Services whose GETs may be hedged; empty means every service
+        'SERVICES': [],
+        'DELAY_PERCENTILE': float(os.getenv('HEDGING_DELAY_PERCENTILE', 95)),
+        'MIN_DELAY_SECONDS': float(os.getenv('HEDGING_MIN_DELAY_SECONDS', 0.005)),
+        'MIN_SAMPLES': int(os.getenv('HEDGING_MIN_SAMPLES', 50)),
+        'WINDOW_SIZE': int(os.getenv('HEDGING_WINDOW_SIZE', 1000)),
+        # Hedges may add at most BUDGET_RATIO extra upstream requests per primary request
+        'BUDGET_RATIO': float(os.getenv('HEDGING_BUDGET_RATIO', 0.05)),
+        'BUDGET_BURST': float(os.getenv('HEDGING_BUDGET_BURST', 10)),
+        # Threads sending backup attempts; primary attempts do not use them
+        'MAX_WORKERS': int(os.getenv('HEDGING_MAX_WORKERS', 64)),
+        # Threads running hedgeable primary attempts; requests arriving while all are busy are not hedged
+        'PRIMARY_MAX_WORKERS': int(os.getenv('HEDGING_PRIMARY_MAX_WORKERS', 64))
+    }
+    UPSTREAM_POOL_SETTINGS = {
+        'POOL_CONNECTIONS': int(os.getenv('UPSTREAM_POOL_CONNECTIONS', 10)),
+        'POOL_MAXSIZE': int(os.getenv('UPSTREAM_POOL_MAXSIZE', 20)),
+        'POOL_BLOCK': os.getenv('UPSTREAM_POOL_BLOCK', 'False').lower() == 'true',
+        'IDLE_TIMEOUT_SECONDS': float(os.getenv('UPSTREAM_POOL_IDLE_TIMEOUT_SECONDS', 30)),
+        'MAX_LIFETIME_SECONDS': float(os.getenv('UPSTREAM_POOL_MAX_LIFETIME_SECONDS', 300))
+    }
+    PROXY_STREAMING_SETTINGS = {
+        'THRESHOLD_BYTES': int(os.getenv('PROXY_STREAM_THRESHOLD_BYTES', 1024 * 1024)),
+        'CHUNK_SIZE_BYTES': int(os.getenv('PROXY_STREAM_CHUNK_SIZE_BYTES', 64 * 1024)),
+        # '<service_name>/<path prefix>': threshold in bytes, e.g. 'products_service/exports': 0
+        'ROUTE_THRESHOLDS': {}
+    }
     RATE_LIMIT_MAX_REQUESTS = int(os.getenv('RATE_LIMIT_MAX_REQUESTS', 100))
     RATE_LIMIT_WINDOW_SECONDS = int(os.getenv('RATE_LIMIT_WINDOW_SECONDS', 60))
+    RATE_LIMIT_SETTINGS = {
+        # 'redis' shares each client's allowance across workers and replicas; 'local' keeps it per
+        # process, without a Redis round trip per request.
+        'BACKEND': os.getenv('RATE_LIMIT_BACKEND', 'redis'),
+        # Requests a client may send at once with the redis backend; defaults to RATE_LIMIT_MAX_REQUESTS.
+        'BURST': int(os.getenv('RATE_LIMIT_BURST', 0)),
+        # Clients tracked by the in-process limiter before the least recently seen are evicted.
+        'LOCAL_MAX_CLIENTS': int(os.getenv('RATE_LIMIT_LOCAL_MAX_CLIENTS', 100000)),
+        # Clients presenting one of API_KEYS in this header are limited per API key; unknown keys
+        # are ignored, and the request is limited by its user or IP.
+        'API_KEY_HEADER': os.getenv('RATE_LIMIT_API_KEY_HEADER', 'X-API-Key'),
+        'API_KEYS': [k for k in os.getenv('RATE_LIMIT_API_KEYS', '').split(',') if k],
+        # Networks of the proxies in front of the gateway, whose X-Forwarded-For is believed.
+        'TRUSTED_PROXIES': [p for p in os.getenv('RATE_LIMIT_TRUSTED_PROXIES', '').split(',') if p],
+        'REDIS_TIMEOUT_SECONDS': float(os.getenv('RATE_LIMIT_REDIS_TIMEOUT_SECONDS', 0.1)),
+        # While Redis is unreachable each process limits on its own, reconnecting at most this often.
+        'REDIS_RETRY_INTERVAL_SECONDS': float(os.getenv('RATE_LIMIT_REDIS_RETRY_INTERVAL_SECONDS', 5))
+    }
+    # Tiered limits; the most specific rule matching a request's route, method and identity kind
+    # ('api_key', 'user' or 'ip') applies, else RATE_LIMIT_MAX_REQUESTS per RATE_LIMIT_WINDOW_SECONDS, e.g.
+    # {'name': 'product-writes', 'service': 'products_service', 'methods': ['POST', 'PUT'], 'identities': ['user'],
+    #  'limit': 20, 'window_seconds': 60}
+    # {'name': 'login', 'route': '/proxy/users_service/login', 'identities': ['ip'], 'limit': 5, 'window_seconds': 60}
+    RATE_LIMIT_RULES = []
     REDIS_HOST = os.getenv('REDIS_HOST', 'redis_cache') 
     REDIS_PORT = int(os.getenv('REDIS_PORT', 6379))
     REDIS_DB = int(os.getenv('REDIS_DB', 0))
     REDIS_PASSWORD = os.getenv('REDIS_PASSWORD', None)
+
+    RABBITMQ_HOST = os.getenv('RABBITMQ_HOST', 'rabbitmq')
+    RABBITMQ_PORT = int(os.getenv('RABBITMQ_PORT', 5672))
+    RABBITMQ_USERNAME = os.getenv('RABBITMQ_USERNAME', 'guest')
+    RABBITMQ_PASSWORD = os.getenv('RABBITMQ_PASSWORD', 'guest')
     DEFAULT_CACHE_TTL_SECONDS = int(os.getenv('DEFAULT_CACHE_TTL_SECONDS', 300))
+    CACHE_STALE_WHILE_REVALIDATE_SECONDS = int(os.getenv('CACHE_STALE_WHILE_REVALIDATE_SECONDS', 30))
+    CACHE_STALE_IF_ERROR_SECONDS = int(os.getenv('CACHE_STALE_IF_ERROR_SECONDS', 300))
+    # '<path prefix>': overrides of TTL_SECONDS, STALE_WHILE_REVALIDATE_SECONDS and STALE_IF_ERROR_SECONDS,
+    # e.g. '/proxy/products_service/products': {'TTL_SECONDS': 10, 'STALE_WHILE_REVALIDATE_SECONDS': 60}
+    CACHE_ROUTE_POLICIES = {}
 
+    # The gateway's own endpoints; they skip caching, the circuit breaker, auth and rate limiting
+    INTERNAL_PATHS = ['/gateway/health', '/metrics']
+    # Exact paths, or '<prefix>/<path:path>' for a prefix and everything below it
     CACHE_EXCLUDED_PATHS = ['/gateway/health', '/openapi.json', '/docs/', '/docs/<path:path>', '/metrics']
     CACHE_METHODS = ['GET']
+    CACHE_L1_SETTINGS = {
+        'ENABLED': os.getenv('CACHE_L1_ENABLED', 'True').lower() == 'true',
+        'MAX_BYTES': int(os.getenv('CACHE_L1_MAX_BYTES', 32 * 1024 * 1024)),
+        'MAX_ITEM_BYTES': int(os.getenv('CACHE_L1_MAX_ITEM_BYTES', 1024 * 1024)),
+        # Kept short: other workers' writes only reach this tier through Redis
+        'TTL_SECONDS': float(os.getenv('CACHE_L1_TTL_SECONDS', 5))
+    }
+    CACHE_COALESCING_SETTINGS = {
+        'ENABLED': os.getenv('CACHE_COALESCING_ENABLED', 'True').lower() == 'true',
+        # How long followers in this process wait for the leader's response
+        'WAIT_TIMEOUT_SECONDS': float(os.getenv('CACHE_COALESCING_WAIT_TIMEOUT_SECONDS', 5)),
+        # Redis fill lock shared by all gateway workers
+        'LOCK_TTL_MS': int(os.getenv('CACHE_COALESCING_LOCK_TTL_MS', 5000)),
+        'LOCK_WAIT_SECONDS': float(os.getenv('CACHE_COALESCING_LOCK_WAIT_SECONDS', 2)),
+        'POLL_INTERVAL_SECONDS': float(os.getenv('CACHE_COALESCING_POLL_INTERVAL_SECONDS', 0.05))
+    }
+    CACHE_COMPRESSION_SETTINGS = {
+        # 'zstd' falls back to 'gzip' when zstandard is not installed; 'none' disables compression
+        'CODEC': os.getenv('CACHE_COMPRESSION_CODEC', 'zstd'),
+        'MIN_SIZE_BYTES': int(os.getenv('CACHE_COMPRESSION_MIN_SIZE_BYTES', 1024)),
+        'LEVEL': int(os.getenv('CACHE_COMPRESSION_LEVEL', 3))
+    }
+    CACHE_KEY_SETTINGS = {
+        'IGNORED_QUERY_PARAMS': [p for p in os.getenv('CACHE_KEY_IGNORED_QUERY_PARAMS', 'gclid,fbclid,msclkid,_').split(',') if p],
+        'IGNORED_QUERY_PREFIXES': [p for p in os.getenv('CACHE_KEY_IGNORED_QUERY_PREFIXES', 'utm_').split(',') if p],
+        # Header names, or 'user' for the user_id of a verified JWT
+        'VARY': [v for v in os.getenv('CACHE_KEY_VARY', 'user').split(',') if v],
+        'MAX_KEY_LENGTH': int(os.getenv('CACHE_KEY_MAX_LENGTH', 256))
+    }
+    CACHE_INVALIDATION_SETTINGS = {
+        # Tag entries by service and resource path and purge them when a mutation succeeds through the proxy
+        'ENABLED': os.getenv('CACHE_INVALIDATION_ENABLED', 'True').lower() == 'true',
+        # Also purge on the services' RabbitMQ events
+        'EVENTS_ENABLED': os.getenv('CACHE_INVALIDATION_EVENTS_ENABLED', 'False').lower() == 'true',
+        'EVENT_EXCHANGES': ['user_events_exchange', 'product_events_exchange'],
+        # Routing key -> '<service_name>:<resource path>' entries it changes
+        'EVENT_RESOURCES': {
+            'user.created': ['users_service:/users'],
+            'product.created': ['products_service:/products']
+        },
+        'RECONNECT_DELAY_SECONDS': float(os.getenv('CACHE_INVALIDATION_RECONNECT_DELAY_SECONDS', 5))
+    }
 
     LOGGING_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
 
@@ -64,6 +235,8 @@ class Config:
         }
     }
 
+    AUTH_ENABLED = os.getenv('AUTH_ENABLED', 'False').lower() == 'true'
+    # Exact paths, or '<prefix>/<path:path>' for a prefix and everything below it
     AUTH_EXCLUDED_PATHS = [
         '/proxy/users_service/login',
         '/proxy/users_service/users',
@@ -73,3 +246,9 @@ class Config:
         '/docs/<path:path>',
         '/metrics'
     ]
+    AUTH_TOKEN_CACHE_SETTINGS = {
+        # Verified token claims are reused until the token's exp, or MAX_TTL_SECONDS if sooner
+        'ENABLED': os.getenv('AUTH_TOKEN_CACHE_ENABLED', 'True').lower() == 'true',
+        'MAX_ENTRIES': int(os.getenv('AUTH_TOKEN_CACHE_MAX_ENTRIES', 10000)),
+        'MAX_TTL_SECONDS': float(os.getenv('AUTH_TOKEN_CACHE_MAX_TTL_SECONDS', 300))
+    }
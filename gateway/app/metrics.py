@@ -22,6 +22,235 @@ IN_PROGRESS_REQUESTS = Gauge(
     ['method', 'endpoint']
 )
 
+MIDDLEWARE_LATENCY = Histogram(
+    'gateway_middleware_duration_seconds',
+    'Time spent in each middleware by phase (request, response)',
+    ['middleware', 'phase'],
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+
+MIDDLEWARE_SHORT_CIRCUITS = Counter(
+    'gateway_middleware_short_circuits_total',
+    'Total requests answered by a middleware before reaching the view',
+    ['middleware']
+)
+
+UPSTREAM_POOL_CHECKED_OUT = Gauge(
+    'gateway_upstream_pool_checked_out_connections',
+    'Number of upstream connections currently checked out of the pool',
+    ['service_name', 'instance']
+)
+
+UPSTREAM_POOL_IDLE = Gauge(
+    'gateway_upstream_pool_idle_connections',
+    'Number of open keep-alive upstream connections idle in the pool',
+    ['service_name', 'instance']
+)
+
+UPSTREAM_POOL_CONNECTIONS_CREATED = Counter(
+    'gateway_upstream_pool_connections_created_total',
+    'Total upstream TCP connections opened by the pool',
+    ['service_name', 'instance']
+)
+
+UPSTREAM_POOL_CONNECTIONS_CLOSED = Counter(
+    'gateway_upstream_pool_connections_closed_total',
+    'Total upstream TCP connections closed by the pool',
+    ['service_name', 'instance']
+)
+
+UPSTREAM_DISCOVERY_LATENCY = Histogram(
+    'gateway_upstream_discovery_duration_seconds',
+    'Time spent choosing an upstream instance through service discovery',
+    ['service_name'],
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+
+UPSTREAM_CONNECT_LATENCY = Histogram(
+    'gateway_upstream_connect_duration_seconds',
+    'Time spent opening new upstream connections (TCP, and TLS for https instances)',
+    ['service_name', 'instance'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+)
+
+UPSTREAM_TTFB = Histogram(
+    'gateway_upstream_time_to_first_byte_seconds',
+    'Time from writing an upstream request until its response headers arrive (excludes connect time)',
+    ['service_name', 'instance']
+)
+
+UPSTREAM_BODY_TRANSFER = Histogram(
+    'gateway_upstream_body_transfer_duration_seconds',
+    'Time spent reading upstream response bodies, buffered or relayed as a stream',
+    ['service_name', 'instance']
+)
+
+UPSTREAM_RESPONSES = Counter(
+    'gateway_upstream_responses_total',
+    'Total upstream attempts by status class (2xx..5xx, or error if no response arrived)',
+    ['service_name', 'instance', 'status_class']
+)
+
+SERVICE_DISCOVERY_INSTANCES = Gauge(
+    'gateway_service_discovery_healthy_instances',
+    'Number of healthy instances in the service discovery cache',
+    ['service_name']
+)
+
+SERVICE_DISCOVERY_CACHE_AGE = Gauge(
+    'gateway_service_discovery_cache_age_seconds',
+    'Seconds since the service discovery cache was last confirmed by Consul',
+    ['service_name']
+)
+
+SERVICE_DISCOVERY_STALE = Gauge(
+    'gateway_service_discovery_cache_stale',
+    'Whether the service discovery cache is older than the staleness threshold (1) or not (0)',
+    ['service_name']
+)
+
+SERVICE_DISCOVERY_REFRESH_ERRORS = Counter(
+    'gateway_service_discovery_refresh_errors_total',
+    'Total failed Consul queries while refreshing the service discovery cache',
+    ['service_name']
+)
+
+HEDGED_REQUESTS = Counter(
+    'gateway_hedged_requests_total',
+    'Total backup attempts sent for slow idempotent upstream requests',
+    ['service_name']
+)
+
+HEDGE_WINS = Counter(
+    'gateway_hedge_wins_total',
+    'Total hedged requests answered first by the backup attempt',
+    ['service_name']
+)
+
+HEDGE_BUDGET_EXHAUSTED = Counter(
+    'gateway_hedge_budget_exhausted_total',
+    'Total hedges skipped because the hedging budget was spent',
+    ['service_name']
+)
+
+CACHE_COALESCED_REQUESTS = Counter(
+    'gateway_cache_coalesced_requests_total',
+    'Total cache misses answered by a concurrent request\'s origin fetch instead of calling the upstream',
+    ['scope']
+)
+
+CACHE_LOOKUPS = Counter(
+    'gateway_cache_lookups_total',
+    'Total response cache lookups by tier (l1 = in-process, l2 = Redis) and result',
+    ['tier', 'result']
+)
+
+CACHE_STALE_SERVED = Counter(
+    'gateway_cache_stale_served_total',
+    'Total stale cache entries served, while revalidating or because the upstream failed',
+    ['reason']
+)
+
+CACHE_NOT_MODIFIED = Counter(
+    'gateway_cache_not_modified_total',
+    'Total conditional GETs answered with 304 Not Modified by the gateway'
+)
+
+CACHE_L1_SIZE_BYTES = Gauge(
+    'gateway_cache_l1_size_bytes',
+    'Bytes currently held by the in-process response cache'
+)
+
+CACHE_L1_EVICTIONS = Counter(
+    'gateway_cache_l1_evictions_total',
+    'Total entries evicted from the in-process response cache to stay within its size limit'
+)
+
+AUTH_TOKEN_CACHE_LOOKUPS = Counter(
+    'gateway_auth_token_cache_lookups_total',
+    'Total lookups of bearer tokens in the verified JWT cache by result (hit, miss)',
+    ['result']
+)
+
+AUTH_TOKEN_CACHE_ENTRIES = Gauge(
+    'gateway_auth_token_cache_entries',
+    'Number of verified JWTs held in the in-process cache'
+)
+
+CACHE_INVALIDATIONS = Counter(
+    'gateway_cache_invalidations_total',
+    'Total cache purges, triggered by proxied mutations (request) or service events (event)',
+    ['source']
+)
+
+CACHE_INVALIDATED_ENTRIES = Counter(
+    'gateway_cache_invalidated_entries_total',
+    'Total cache entries removed by tag purges'
+)
+
+CONCURRENCY_LIMIT = Gauge(
+    'gateway_concurrency_limit',
+    'Current adaptive limit on requests in flight to the upstream service',
+    ['service_name']
+)
+
+CONCURRENCY_IN_FLIGHT = Gauge(
+    'gateway_concurrency_in_flight',
+    'Number of requests in flight to the upstream service under the adaptive concurrency limit',
+    ['service_name']
+)
+
+CONCURRENCY_SHED = Counter(
+    'gateway_concurrency_shed_total',
+    'Total requests rejected because the upstream service was at its adaptive concurrency limit',
+    ['service_name']
+)
+
+ADMISSION_REQUESTS = Counter(
+    'gateway_admission_requests_total',
+    'Total admission decisions by priority class and result (admitted, queue_full, queue_timeout)',
+    ['priority_class', 'result']
+)
+
+ADMISSION_QUEUED = Gauge(
+    'gateway_admission_queued_requests',
+    'Number of requests waiting for admission by priority class',
+    ['priority_class']
+)
+
+ADMISSION_QUEUE_TIME = Histogram(
+    'gateway_admission_queue_seconds',
+    'Time requests waited for admission by priority class',
+    ['priority_class'],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+
+ADMISSION_IN_FLIGHT = Gauge(
+    'gateway_admission_in_flight_requests',
+    'Number of requests holding an admission slot'
+)
+
+RATE_LIMIT_DECISIONS = Counter(
+    'gateway_rate_limit_decisions_total',
+    'Total rate limit decisions by backend (redis, or local while Redis is unreachable) and result',
+    ['backend', 'result']
+)
+
+RATE_LIMIT_LOCAL_CLIENTS = Gauge(
+    'gateway_rate_limit_local_clients',
+    'Number of clients tracked by the in-process rate limiter'
+)
+
+RATE_LIMIT_LOCAL_MEMORY_BYTES = Gauge(
+    'gateway_rate_limit_local_memory_bytes',
+    'Approximate bytes held by the in-process rate limiter\'s client counters'
+)
+
+RATE_LIMIT_LOCAL_EVICTIONS = Counter(
+    'gateway_rate_limit_local_evictions_total',
+    'Total active clients evicted from the in-process rate limiter to stay within its client cap'
+)
+
 metrics_bp = Blueprint('metrics', __name__)
 
 @metrics_bp.route('/metrics')
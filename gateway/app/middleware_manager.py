@@ -1,7 +1,10 @@
 import logging
-from typing import Optional, List, Protocol, runtime_checkable
+import time
+from typing import Any, Dict, FrozenSet, Iterable, Optional, List, Protocol, Tuple, runtime_checkable
 from flask import Response, Request
 from http import HTTPStatus
+from .metrics import MIDDLEWARE_LATENCY, MIDDLEWARE_SHORT_CIRCUITS
+from .utils.route_classifier import ROUTE_CLASSES, ROUTE_PROXY
 
 logger = logging.getLogger(__name__)
 
@@ -25,17 +28,43 @@ class Middleware(Protocol):
         """
         pass
 
+# (name, middleware, request timer, response timer, short-circuit counter); the metrics are
+# bound to the middleware's labels when the chain is compiled.
+PipelineStage = Tuple[str, Any, Any, Any, Any]
+
+
+def compile_pipelines(middlewares: List[Any], middleware_route_classes: List[FrozenSet[str]],
+                      route_classes: Iterable[str]) -> Dict[str, Tuple[PipelineStage, ...]]:
+    """The chain of each route class, in the order the middlewares were added."""
+    stages = []
+    for middleware in middlewares:
+        name = type(middleware).__name__
+        stages.append((name, middleware, MIDDLEWARE_LATENCY.labels(name, 'request'),
+                       MIDDLEWARE_LATENCY.labels(name, 'response'), MIDDLEWARE_SHORT_CIRCUITS.labels(name)))
+    return {
+        route_class: tuple(stage for stage, classes in zip(stages, middleware_route_classes) if route_class in classes)
+        for route_class in route_classes
+    }
+
 class MiddlewareManager:
     """
     Manages a list of middleware instances and applies them to requests and responses.
     Middlewares are processed in the order they are added for process_request
     and in reverse order for process_response.
+
+    Each middleware may be limited to some route classes. The chain of every route class is
+    compiled once, so a request only pays for the middlewares that apply to its route.
+    The time spent in each middleware and the requests it short-circuits are recorded.
     """
-    def __init__(self):
+    def __init__(self, route_classes: Iterable[str] = ROUTE_CLASSES):
         self.middlewares: List[Middleware] = []
+        self.route_classes = tuple(route_classes)
+        self._middleware_route_classes: List[FrozenSet[str]] = []
+        self.pipelines: Dict[str, Tuple[PipelineStage, ...]] = {}
         logger.info("MiddlewareManager initialized.")
 
-    def add_middleware(self, middleware: Middleware):
+    def add_middleware(self, middleware: Middleware, route_classes: Optional[Iterable[str]] = None):
+        """Adds a middleware for the given route classes, or for all of them."""
         middleware_name = getattr(middleware, '__class__', type(middleware)).__name__
         logger.debug(f"Attempting to add middleware: {middleware_name}")
 
@@ -44,26 +73,37 @@ class MiddlewareManager:
             raise TypeError("Middleware object must implement the Middleware Protocol (have callable 'process_request' and 'process_response' methods).")
 
         self.middlewares.append(middleware)
+        self._middleware_route_classes.append(frozenset(self.route_classes if route_classes is None else route_classes))
+        self.compile()
         logger.info(f"Middleware added successfully: {middleware_name}. Total middlewares: {len(self.middlewares)}")
 
-    def process_request(self, request: Request) -> Optional[Response]:
+    def compile(self):
+        """Builds the chain of every route class from the middlewares added so far."""
+        self.pipelines = compile_pipelines(self.middlewares, self._middleware_route_classes, self.route_classes)
+
+    def process_request(self, request: Request, route_class: str = ROUTE_PROXY) -> Optional[Response]:
         """
-        Applies the process_request method of each middleware in the order they were added.
+        Applies the process_request method of each middleware of the route class's chain in the order they were added.
         Stops the chain and returns a Flask Response object if any middleware returns one.
         Exceptions raised by middlewares are caught and result in a 500 Internal Server Error response.
         """
-        logger.debug(f"MiddlewareManager: Starting request middleware chain for {request.method} {request.path}.")
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            logger.debug(f"MiddlewareManager: Starting {route_class} request middleware chain for {request.method} {request.path}.")
 
         final_response = None
 
-        for middleware in self.middlewares:
-            middleware_name = getattr(middleware, '__class__', type(middleware)).__name__
-            logger.debug(f"MiddlewareManager: Processing request with {middleware_name}")
+        for middleware_name, middleware, request_timer, _, short_circuits in self.pipelines[route_class]:
+            if debug:
+                logger.debug(f"MiddlewareManager: Processing request with {middleware_name}")
 
+            started = time.perf_counter()
             try:
                 response = middleware.process_request(request)
+                request_timer.observe(time.perf_counter() - started)
 
                 if response is not None:
+                    short_circuits.inc()
                     logger.info(f"Request short-circuited by middleware: {middleware_name} (Status: {getattr(response, 'status_code', 'N/A')})")
                     if not isinstance(response, Response):
                         logger.error(f"Middleware {middleware_name} returned unexpected type {type(response)} in process_request for {request.method} {request.path}. Expected Flask Response. Returning 500.")
@@ -73,32 +113,38 @@ class MiddlewareManager:
                     break
 
             except Exception as e:
+                request_timer.observe(time.perf_counter() - started)
+                short_circuits.inc()
                 logger.exception(f"Error in process_request of {middleware_name} for {request.method} {request.path}: {e}")
                 final_response = Response("Internal Server Error: Middleware processing failed.", status=HTTPStatus.INTERNAL_SERVER_ERROR.value, mimetype='text/plain')
                 break
 
-        if final_response is None:
+        if final_response is None and debug:
             logger.debug("MiddlewareManager: Request passed through all request middlewares without short-circuit. Proceeding to view.")
 
         return final_response
 
-    def process_response(self, request: Request, response: Response) -> Response:
+    def process_response(self, request: Request, response: Response, route_class: str = ROUTE_PROXY) -> Response:
         """
-        Applies the process_response method of each middleware in reverse order of addition.
+        Applies the process_response method of each middleware of the route class's chain in reverse order of addition.
         Starts with the response generated by the view or a short-circuiting middleware.
         Each middleware receives the output of the previous one.
         Exceptions raised by middlewares are caught and logged, but the response chain attempts to continue.
         """
-        logger.debug(f"MiddlewareManager: Starting response middleware chain for {request.method} {request.path}.")
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            logger.debug(f"MiddlewareManager: Starting {route_class} response middleware chain for {request.method} {request.path}.")
 
         processed_response = response
 
-        for middleware in reversed(self.middlewares):
-            middleware_name = getattr(middleware, '__class__', type(middleware)).__name__
-            logger.debug(f"MiddlewareManager: Processing response with {middleware_name}")
+        for middleware_name, middleware, _, response_timer, _ in reversed(self.pipelines[route_class]):
+            if debug:
+                logger.debug(f"MiddlewareManager: Processing response with {middleware_name}")
 
+            started = time.perf_counter()
             try:
                 middleware_response = middleware.process_response(request, processed_response)
+                response_timer.observe(time.perf_counter() - started)
 
                 if not isinstance(middleware_response, Response):
                     logger.error(f"Response Middleware {middleware_name} returned unexpected type {type(middleware_response)} in process_response for {request.method} {request.path}. Expected Flask Response. Attempting to continue with previous response.")
@@ -106,8 +152,9 @@ class MiddlewareManager:
                     processed_response = middleware_response
 
             except Exception as e:
+                response_timer.observe(time.perf_counter() - started)
                 logger.exception(f"Error in process_response of {middleware_name} for {request.method} {request.path}: {e}")
 
-        logger.debug(f"MiddlewareManager: Response passed through all response middlewares. Finalizing response for {request.method} {request.path}.")
+        if debug:
+            logger.debug(f"MiddlewareManager: Response passed through all response middlewares. Finalizing response for {request.method} {request.path}.")
         return processed_response
-
@@ -0,0 +1,50 @@
+from flask import request, jsonify, current_app, Response, g
+from typing import Optional, Any
+from http import HTTPStatus
+from ..middleware_manager import Middleware
+from ..utils.admission import AdmissionController, AdmissionSlot, ADMITTED
+
+
+class AdmissionControlMiddleware(Middleware):
+    """
+    Runs first in the chain and holds every request until AdmissionController admits it, so
+    that under overload health checks, scrapes and writes keep their latency while bulk
+    reads queue or are shed with 503.
+
+    A request keeps its slot until its response is closed, so streamed bodies count until they
+    have been sent. teardown_request gives back the slots of requests whose response was never
+    processed, e.g. after an unhandled exception.
+    """
+    def __init__(self):
+        self.controller = None
+
+    def _init_controller(self):
+        if self.controller is None and current_app:
+            self.controller = AdmissionController(current_app.config.get('ADMISSION_CONTROL_SETTINGS', {}))
+
+    def process_request(self, request: Any) -> Optional[Response]:
+        self._init_controller()
+
+        priority_class = self.controller.classify(request.path, request.method, request.headers)
+        result = self.controller.admit(priority_class)
+        if result != ADMITTED:
+            current_app.logger.warning(f"Request {request.method} {request.path} shed by admission control as {priority_class} ({result}).")
+            response = Response(response=jsonify({"message": "Gateway is overloaded. Please try again later."}).data,
+                                status=HTTPStatus.SERVICE_UNAVAILABLE.value,
+                                mimetype='application/json')
+            response.headers['Retry-After'] = str(self.controller.retry_after_seconds)
+            return response
+
+        g.admission_slot = AdmissionSlot(self.controller)
+        return None
+
+    def process_response(self, request: Any, response: Response) -> Response:
+        slot = g.pop('admission_slot', None)
+        if slot is not None:
+            response.call_on_close(slot.release)
+        return response
+
+    def teardown_request(self, exc: Optional[BaseException]):
+        slot = g.pop('admission_slot', None)
+        if slot is not None:
+            slot.release()
@@ -1,43 +1,29 @@
 import jwt
 import os
 from typing import Optional, Any
-from flask import request, jsonify, Response, current_app
+from flask import request, jsonify, Response, current_app, g
 from http import HTTPStatus
 from ..middleware_manager import Middleware
+from ..utils.token_cache import VerifiedTokenCache, verify_token
 import logging
 
 logger = logging.getLogger(__name__)
 
 class AuthMiddleware(Middleware):
-    def __init__(self):
+    def __init__(self, token_cache: Optional[VerifiedTokenCache] = None):
         self.jwt_secret = os.getenv('JWT_SECRET_KEY')
         if not self.jwt_secret:
             logger.error("JWT_SECRET_KEY is not set. Authentication will not work.")
-        self.excluded_paths = []
+        # Shared with the cache key builder, so each token's signature is checked once.
+        self.token_cache = token_cache
 
-    def set_excluded_paths(self, paths: list):
-        self.excluded_paths = paths
-        logger.info(f"AuthMiddleware excluded paths set to: {self.excluded_paths}")
+    def _verify(self, token: str) -> dict:
+        return verify_token(token, self.jwt_secret, self.token_cache)
 
     def process_request(self, request: Any) -> Optional[Response]:
-        if not self.excluded_paths and current_app:
-            self.set_excluded_paths(current_app.config.get('AUTH_EXCLUDED_PATHS', []))
-
-        for excluded_path in self.excluded_paths:
-
-            if excluded_path.endswith('/<path:path>'):
-                base_path = excluded_path.replace('/<path:path>', '')
-                if request.path.startswith(base_path):
-                    logger.debug(f"Path {request.path} excluded from auth by {excluded_path}")
-                    return None 
-            elif request.path == excluded_path:
-                logger.debug(f"Path {request.path} excluded from auth by exact match")
-                return None 
-
-        if request.path == '/':
-            logger.debug(f"Root path {request.path} excluded from auth.")
+        if g.route.auth_exempt:
             return None
-        
+
         auth_header = request.headers.get('Authorization')
         if not auth_header:
             logger.warning("Authorization header missing for protected route.")
@@ -56,7 +42,7 @@ class AuthMiddleware(Middleware):
             if not self.jwt_secret:
                 raise ValueError("JWT_SECRET_KEY is not configured.")
 
-            payload = jwt.decode(token, self.jwt_secret, algorithms=['HS256'])
+            payload = self._verify(token)
             request.user = payload
             logger.debug(f"JWT authenticated for user: {payload.get('user_id')}")
             return None
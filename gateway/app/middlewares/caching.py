@@ -1,17 +1,332 @@
 import redis
+import gzip
+import hashlib
 import json
-from flask import request, Response, current_app
-from typing import Any, Optional
+import struct
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from flask import request, Response, current_app, g
+from typing import Any, Optional, Dict, List, Tuple
 from ..middleware_manager import Middleware
+from .rate_limiter import RATE_LIMIT_HEADERS
+from ..metrics import (
+    CACHE_COALESCED_REQUESTS,
+    CACHE_LOOKUPS,
+    CACHE_STALE_SERVED,
+    CACHE_NOT_MODIFIED,
+    CACHE_INVALIDATIONS,
+    CACHE_INVALIDATED_ENTRIES,
+)
+from ..utils.cache_keys import CacheKeyBuilder
+from ..utils.local_cache import LocalLRUCache
+from ..utils.single_flight import SingleFlight
+from ..utils.token_cache import VerifiedTokenCache
 import logging
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 logger = logging.getLogger(__name__)
 
+
+def build_fill_lock_key(cache_key: str) -> str:
+    return f"lock:{cache_key}"
+
+
+def build_revalidate_lock_key(cache_key: str) -> str:
+    return f"revalidate:{cache_key}"
+
+
+def build_etag_key(cache_key: str) -> str:
+    return f"etag:{cache_key}"
+
+
+def build_tag_key(tag: str) -> str:
+    return f"tag:{tag}"
+
+
+def build_tag_version_key(tag: str) -> str:
+    return f"tagv:{tag}"
+
+
+def _resource_ancestors(resource_path: str) -> List[str]:
+    """'/products/5/' -> ['/', '/products', '/products/5']"""
+    parts = [part for part in resource_path.split('/') if part]
+    return ['/' + '/'.join(parts[:depth]) for depth in range(len(parts) + 1)]
+
+
+def cache_entry_tags(service_name: str, resource_path: str) -> List[str]:
+    """
+    Tags an entry with its own resource path ('path:') and with every ancestor of it ('tree:'),
+    so a purge can target one resource or a whole subtree. 'tree:<service>:/' covers the service.
+    """
+    ancestors = _resource_ancestors(resource_path)
+    return [f"path:{service_name}:{ancestors[-1]}"] + [f"tree:{service_name}:{ancestor}" for ancestor in ancestors]
+
+
+def invalidation_tags(service_name: str, resource_path: str, recursive: bool = True) -> List[str]:
+    """
+    A change to a resource invalidates it and the listings above it, and with `recursive`
+    everything below it too. Creating a resource in a collection (POST) is not recursive.
+    """
+    ancestors = _resource_ancestors(resource_path)
+    kind = 'tree' if recursive else 'path'
+    return [f"{kind}:{service_name}:{ancestors[-1]}"] + [f"path:{service_name}:{ancestor}" for ancestor in ancestors[:-1]]
+
+
+# Deletes the fill lock only if it is still held by the caller's token.
+RELEASE_FILL_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Deletes every entry (and its etag record) in the given tag sets, then the sets, and bumps the version
+# of each tag so fills that started before the purge are not stored. KEYS are the tag sets followed by
+# their version keys; ARGV[1] is the version key TTL. Returns the purged keys.
+# The entry keys are read from the sets, so they cannot be declared up front: tag purges need a
+# single-node Redis (or a primary with replicas), not Redis Cluster.
+PURGE_TAGS_SCRIPT = """
+local purged = {}
+local tag_count = #KEYS / 2
+for i = 1, tag_count do
+    local tag_key = KEYS[i]
+    for _, cache_key in ipairs(redis.call('SMEMBERS', tag_key)) do
+        redis.call('DEL', cache_key, 'etag:' .. cache_key)
+        table.insert(purged, cache_key)
+    end
+    redis.call('DEL', tag_key)
+    redis.call('INCR', KEYS[tag_count + i])
+    redis.call('EXPIRE', KEYS[tag_count + i], ARGV[1])
+end
+return purged
+"""
+
+# Stores an entry, its etag record and its tag memberships, unless one of its tags was purged since
+# the fill started. KEYS: entry, etag record, the tag sets, then their version keys. ARGV: storage TTL,
+# entry, etag record, tag set TTL, then the tag versions read when the fill started. Returns 1 if stored.
+STORE_ENTRY_SCRIPT = """
+local tag_count = (#KEYS - 2) / 2
+for i = 1, tag_count do
+    if (redis.call('GET', KEYS[2 + tag_count + i]) or '0') ~= ARGV[4 + i] then
+        return 0
+    end
+end
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[1])
+redis.call('SET', KEYS[2], ARGV[3], 'EX', ARGV[1])
+for i = 1, tag_count do
+    redis.call('SADD', KEYS[2 + i], KEYS[1])
+    redis.call('EXPIRE', KEYS[2 + i], ARGV[4])
+end
+return 1
+"""
+
+
+def purge_tags_args(tags: List[str], tag_ttl: int) -> List[Any]:
+    """Key count and arguments for PURGE_TAGS_SCRIPT."""
+    keys = [build_tag_key(tag) for tag in tags] + [build_tag_version_key(tag) for tag in tags]
+    return [len(keys), *keys, tag_ttl]
+
+
+def store_entry_args(cache_key: str, cache_entry: bytes, etag_entry: str, storage_ttl: int, tags: List[str],
+                     tag_versions: List[Optional[bytes]], tag_ttl: int) -> List[Any]:
+    """Key count and arguments for STORE_ENTRY_SCRIPT. A tag never purged has no version key (version 0)."""
+    keys = [cache_key, build_etag_key(cache_key)] + [build_tag_key(tag) for tag in tags] + \
+        [build_tag_version_key(tag) for tag in tags]
+    return [len(keys), *keys, storage_ttl, cache_entry, etag_entry, tag_ttl,
+            *[version if version is not None else b'0' for version in tag_versions]]
+
+
+# Binary cache entry: fixed header, then the response header block, then the (possibly compressed) body.
+CACHE_ENTRY_MAGIC = b'GWC1'
+CACHE_ENTRY_HEADER = struct.Struct('>4sBHdI')  # magic, codec, status code, stored_at, header block length
+CODEC_NONE, CODEC_GZIP, CODEC_ZSTD = 0, 1, 2
+
+
+def _compress_body(body: bytes, compression: Dict[str, Any]) -> Tuple[int, bytes]:
+    """Compresses bodies above the configured size; zstd falls back to gzip when it is not installed."""
+    codec_name = compression.get('CODEC', 'none')
+    if codec_name == 'none' or len(body) < compression.get('MIN_SIZE_BYTES', 1024):
+        return CODEC_NONE, body
+
+    if codec_name == 'zstd' and zstandard is not None:
+        codec, compressed = CODEC_ZSTD, zstandard.ZstdCompressor(level=compression.get('LEVEL', 3)).compress(body)
+    else:
+        codec, compressed = CODEC_GZIP, gzip.compress(body, compresslevel=compression.get('LEVEL', 3))
+    if len(compressed) >= len(body):
+        return CODEC_NONE, body
+    return codec, compressed
+
+
+def _decompress_body(codec: int, body: bytes) -> bytes:
+    if codec == CODEC_NONE:
+        return body
+    if codec == CODEC_GZIP:
+        return gzip.decompress(body)
+    if codec == CODEC_ZSTD and zstandard is not None:
+        return zstandard.ZstdDecompressor().decompress(body)
+    raise ValueError(f"Unsupported cache entry codec {codec}.")
+
+
+def serialize_cache_entry(body: bytes, status_code: int, headers: List[Tuple[str, str]], stored_at: Optional[float] = None,
+                          compression: Optional[Dict[str, Any]] = None) -> bytes:
+    header_block = b'\r\n'.join(f"{name}: {value}".encode('utf-8') for name, value in headers)
+    codec, body = _compress_body(body, compression or {})
+    stored_at = time.time() if stored_at is None else stored_at
+    return CACHE_ENTRY_HEADER.pack(CACHE_ENTRY_MAGIC, codec, status_code, stored_at, len(header_block)) + header_block + body
+
+
+def serialize_etag_entry(etag: str, stored_at: float) -> str:
+    """The small validator record kept next to an entry, so conditional GETs skip the body."""
+    return json.dumps({"etag": etag, "stored_at": stored_at})
+
+
+def deserialize_cache_entry(cached_response: bytes) -> Dict[str, Any]:
+    """Decodes a cache entry; raises ValueError for corrupt or unknown entries."""
+    try:
+        magic, codec, status_code, stored_at, header_length = CACHE_ENTRY_HEADER.unpack_from(cached_response)
+    except struct.error as e:
+        raise ValueError(f"Truncated cache entry: {e}")
+    if magic != CACHE_ENTRY_MAGIC:
+        raise ValueError("Not a cache entry.")
+
+    offset = CACHE_ENTRY_HEADER.size
+    header_block = cached_response[offset:offset + header_length].decode('utf-8')
+    headers = [tuple(line.split(': ', 1)) for line in header_block.split('\r\n')] if header_block else []
+    try:
+        body = _decompress_body(codec, cached_response[offset + header_length:])
+    except ValueError:
+        raise
+    except Exception as e:
+        raise ValueError(f"Corrupt cache entry body: {e}")
+
+    etag = next((value for name, value in headers if name.lower() == 'etag'), None)
+    return {"body": body, "status_code": status_code, "headers": headers, "stored_at": stored_at, "etag": etag}
+
+
+def cache_entry_size(data: Dict[str, Any]) -> int:
+    """Approximate in-memory size of a decoded entry, used to bound the L1 cache."""
+    return len(data['body']) + sum(len(name) + len(value) for name, value in data['headers'])
+
+
+def cache_entry_age(data: Dict[str, Any]) -> float:
+    """Seconds since the entry was stored. Entries written before stored_at existed count as fresh."""
+    return max(time.time() - data.get('stored_at', time.time()), 0)
+
+
+def build_default_cache_policy(config: Any) -> Dict[str, float]:
+    return {
+        'TTL_SECONDS': config.get('DEFAULT_CACHE_TTL_SECONDS', 300),
+        'STALE_WHILE_REVALIDATE_SECONDS': config.get('CACHE_STALE_WHILE_REVALIDATE_SECONDS', 0),
+        'STALE_IF_ERROR_SECONDS': config.get('CACHE_STALE_IF_ERROR_SECONDS', 0),
+    }
+
+
+def resolve_cache_policy(path: str, default_policy: Dict[str, float], route_policies: Dict[str, Dict[str, float]]) -> Dict[str, float]:
+    """Returns the freshness windows for a path; the longest matching route prefix wins."""
+    best_prefix = None
+    for prefix in route_policies:
+        if path.startswith(prefix) and (best_prefix is None or len(prefix) > len(best_prefix)):
+            best_prefix = prefix
+    if best_prefix is None:
+        return default_policy
+    return {**default_policy, **route_policies[best_prefix]}
+
+
+def build_cache_policies(default_policy: Dict[str, float], route_policies: Dict[str, Dict[str, float]]) -> Dict[Optional[str], Dict[str, float]]:
+    """The policy of every CACHE_ROUTE_POLICIES prefix merged over the default, which is keyed by None."""
+    policies = {prefix: {**default_policy, **overrides} for prefix, overrides in route_policies.items()}
+    policies[None] = default_policy
+    return policies
+
+
+def cache_storage_ttl(policy: Dict[str, float]) -> int:
+    """How long Redis keeps an entry: its fresh window plus the longer of its stale windows."""
+    return int(policy['TTL_SECONDS'] + max(policy['STALE_WHILE_REVALIDATE_SECONDS'], policy['STALE_IF_ERROR_SECONDS']))
+
+
+def max_storage_ttl(default_policy: Dict[str, float], route_policies: Dict[str, Dict[str, float]]) -> int:
+    """The longest any entry is kept; tag sets live this long so they never expire before their entries."""
+    return max(cache_storage_ttl(resolve_cache_policy(prefix, default_policy, route_policies)) for prefix in ['', *route_policies])
+
+
+def compute_etag(body: bytes) -> str:
+    """Strong ETag for a response body."""
+    return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: Optional[str]) -> bool:
+    """Weak comparison of an If-None-Match header against an ETag, as RFC 9110 requires for GET."""
+    if not if_none_match or not etag:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    opaque_tag = etag[2:] if etag.startswith('W/') else etag
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == opaque_tag:
+            return True
+    return False
+
+
+def build_not_modified_response(data: Dict[str, Any]) -> Response:
+    return Response(status=304, headers={'ETag': data['etag'], 'Age': str(int(cache_entry_age(data)))})
+
+
+# Response headers that belong to the request that filled an entry rather than to the resource.
+PER_REQUEST_HEADERS = frozenset(name.lower() for name in RATE_LIMIT_HEADERS)
+
+
+def cacheable_headers(headers: Any) -> List[Tuple[str, str]]:
+    return [(name, value) for name, value in headers if name.lower() not in PER_REQUEST_HEADERS]
+
+
+def build_cached_response(data: Dict[str, Any]) -> Response:
+    headers = [(name, value) for name, value in data['headers'] if name.lower() != 'age']
+    headers.append(('Age', str(int(cache_entry_age(data)))))
+    return Response(response=data['body'], status=data['status_code'], headers=headers)
+
+
+def build_local_cache(settings: Dict[str, Any]) -> Optional[LocalLRUCache]:
+    """Creates the in-process (L1) cache that sits in front of Redis, or None if disabled."""
+    if not settings.get('ENABLED'):
+        return None
+    return LocalLRUCache(
+        max_bytes=settings.get('MAX_BYTES', 32 * 1024 * 1024),
+        ttl_seconds=settings.get('TTL_SECONDS', 5),
+        max_item_bytes=settings.get('MAX_ITEM_BYTES', 1024 * 1024),
+    )
+
+
+# Methods whose success through the proxy purges the cached representations they affect.
+INVALIDATING_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+
 class CachingMiddleware(Middleware):
-    def __init__(self):
+    def __init__(self, circuit_breaker: Optional[Any] = None, token_cache: Optional[VerifiedTokenCache] = None):
+        # Stale entries of services whose circuit is open are not revalidated.
+        self.circuit_breaker = circuit_breaker
+        self.token_cache = token_cache
         self.redis_client = None
-        self.cache_ttl = None
-        self.excluded_paths = []
+        self.coalescing = {}
+        self.single_flight = SingleFlight(abandon_after=5)
+        self.local_cache = None
+        self.default_policy = {}
+        self.route_policies = {}
+        self.compression = {}
+        self.invalidation = {}
+        self.tag_ttl = 0
+        self.key_builder = CacheKeyBuilder({})
+        self._revalidating = set()
+        self._revalidating_lock = threading.Lock()
+        self._revalidation_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='cache-revalidate')
 
     def _init_redis_client(self):
         """Initializes Redis client only when app context is available."""
@@ -22,56 +337,311 @@ class CachingMiddleware(Middleware):
                 redis_db = current_app.config.get('REDIS_DB')
                 redis_password = current_app.config.get('REDIS_PASSWORD')
                 
-                self.redis_client = redis.StrictRedis(
+                redis_client = redis.StrictRedis(
                     host=redis_host,
                     port=redis_port,
                     db=redis_db,
                     password=redis_password,
-                    decode_responses=True
+                    decode_responses=False
                 )
-                self.redis_client.ping()
-                self.cache_ttl = current_app.config.get('DEFAULT_CACHE_TTL_SECONDS')
-                self.excluded_paths = current_app.config.get('CACHE_EXCLUDED_PATHS', [])
+                redis_client.ping()
+                self.default_policy = build_default_cache_policy(current_app.config)
+                self.route_policies = current_app.config.get('CACHE_ROUTE_POLICIES', {})
+                self.compression = current_app.config.get('CACHE_COMPRESSION_SETTINGS', {})
+                self.invalidation = current_app.config.get('CACHE_INVALIDATION_SETTINGS', {})
+                self.policies = build_cache_policies(self.default_policy, self.route_policies)
+                self.tag_ttl = max_storage_ttl(self.default_policy, self.route_policies)
+                self.key_builder = CacheKeyBuilder(current_app.config.get('CACHE_KEY_SETTINGS', {}),
+                                                   current_app.config.get('JWT_SECRET_KEY'), self.token_cache)
+                self.coalescing = current_app.config.get('CACHE_COALESCING_SETTINGS', {})
+                self.single_flight.abandon_after = self.coalescing.get('WAIT_TIMEOUT_SECONDS', 5)
+                self.local_cache = build_local_cache(current_app.config.get('CACHE_L1_SETTINGS', {}))
+                # Published last so concurrent requests never see a half-configured middleware.
+                self.redis_client = redis_client
                 logger.info("Redis client initialized successfully for CachingMiddleware.")
             except Exception as e:
                 logger.error(f"An unexpected error occurred during Redis client initialization: {e}. Caching will be disabled.", exc_info=True)
                 self.redis_client = None
 
+    def _cache_key(self, request: Any) -> str:
+        """Builds the request's cache key once and keeps it on `g` for process_response."""
+        if 'cache_key' not in g:
+            g.cache_key = self.key_builder.build(request.path, request.query_string, request.headers)
+        return g.cache_key
+
     def process_request(self, request: Any) -> Optional[Response]:
         self._init_redis_client()
 
         if self.redis_client is None:
             return None
 
-        if request.method != 'GET':
+        if request.method != 'GET' or not g.route.cacheable:
+            return None
+
+        # Background revalidations must reach the origin.
+        if g.get('cache_revalidating'):
+            self._record_tag_versions()
+            return None
+
+        cache_key = self._cache_key(request)
+        policy = self.policies[g.route.cache_route]
+
+        if request.headers.get('If-None-Match'):
+            not_modified = self._check_not_modified(request, cache_key, policy)
+            if not_modified is not None:
+                return not_modified
+
+        data = self._lookup(cache_key, policy)
+
+        if data is not None:
+            age = cache_entry_age(data)
+            if age <= policy['TTL_SECONDS']:
+                logger.info(f"Serving from cache: {request.full_path}")
+                return self._serve_cached(request, data)
+            if age <= policy['TTL_SECONDS'] + policy['STALE_WHILE_REVALIDATE_SECONDS']:
+                self._schedule_revalidation(request, cache_key)
+                CACHE_STALE_SERVED.labels('revalidate').inc()
+                logger.info(f"Serving stale response while revalidating: {request.full_path}")
+                return self._serve_cached(request, data)
+            # Kept in case the origin fails and the entry is still within its stale-if-error window.
+            g.stale_cache_entry = data
+
+        self._record_tag_versions()
+        if self.coalescing.get('ENABLED'):
+            return self._coalesce_miss(request, cache_key, policy)
+        return None
+
+    def _entry_tags(self) -> List[str]:
+        route = g.route
+        if route.service_name is None or not self.invalidation.get('ENABLED', True):
+            return []
+        return cache_entry_tags(route.service_name, route.resource_path)
+
+    def _record_tag_versions(self):
+        """
+        Reads the versions of the entry's tags before the request goes to the origin. The response
+        is only stored if none of them changed meanwhile, so a purge racing the fill is not undone.
+        """
+        tags = self._entry_tags()
+        if not tags:
+            g.cache_tag_versions = []
+            return
+        try:
+            g.cache_tag_versions = self.redis_client.mget([build_tag_version_key(tag) for tag in tags])
+        except Exception as e:
+            logger.warning(f"Failed to read cache tag versions for {request.full_path}: {e}")
+
+    def _coalesce_miss(self, request: Any, cache_key: str, policy: Dict[str, float]) -> Optional[Response]:
+        """
+        Lets only one request per cache key go to the origin. Followers in this process wait
+        for the leader's response; a leader that finds another worker holding the Redis fill
+        lock polls the cache briefly instead of calling the origin too.
+        """
+        flight, is_leader = self.single_flight.join(cache_key)
+        if not is_leader:
+            if flight.event.wait(self.coalescing.get('WAIT_TIMEOUT_SECONDS', 5)) and flight.result is not None:
+                CACHE_COALESCED_REQUESTS.labels('process').inc()
+                logger.debug(f"Serving coalesced response for: {request.full_path}")
+                return self._serve_cached(request, flight.result)
             return None
 
-        for excluded_path in self.excluded_paths:
-            if excluded_path.endswith('/<path:path>'):
-                base_path = excluded_path.replace('/<path:path>', '')
-                if request.path.startswith(base_path):
-                    logger.debug(f"Path {request.path} excluded from cache by {excluded_path}")
-                    return None
-            elif request.path == excluded_path:
-                logger.debug(f"Path {request.path} excluded from cache by exact match")
+        lock_key = build_fill_lock_key(cache_key)
+        lock_token = uuid.uuid4().hex
+        g.cache_flight = (cache_key, flight, None)
+        try:
+            if self.redis_client.set(lock_key, lock_token, nx=True, px=self.coalescing.get('LOCK_TTL_MS', 5000)):
+                g.cache_flight = (cache_key, flight, lock_token)
                 return None
 
-        cache_key = f"cache:{request.full_path}"
-        cached_response = self.redis_client.get(cache_key)
+            deadline = time.monotonic() + self.coalescing.get('LOCK_WAIT_SECONDS', 2)
+            while time.monotonic() < deadline:
+                time.sleep(self.coalescing.get('POLL_INTERVAL_SECONDS', 0.05))
+                cached_response, lock_holder = self.redis_client.mget(cache_key, lock_key)
+                if cached_response:
+                    data = deserialize_cache_entry(cached_response)
+                    self._store_local(cache_key, data, policy)
+                    del g.cache_flight
+                    self.single_flight.complete(cache_key, flight, data)
+                    CACHE_COALESCED_REQUESTS.labels('cluster').inc()
+                    logger.debug(f"Serving response cached by another worker for: {request.full_path}")
+                    return self._serve_cached(request, data)
+                if lock_holder is None:
+                    break
+        except Exception as e:
+            logger.error(f"Cache fill coordination failed for {request.full_path}: {e}. Fetching from origin.")
+        return None
+
+    def _serve_cached(self, request: Any, data: Dict[str, Any]) -> Response:
+        # Marks the response so process_response does not store it again as a new entry.
+        g.served_from_cache = True
+        if etag_matches(request.headers.get('If-None-Match'), data.get('etag')):
+            CACHE_NOT_MODIFIED.inc()
+            return build_not_modified_response(data)
+        return build_cached_response(data)
 
-        if cached_response:
+    def _check_not_modified(self, request: Any, cache_key: str, policy: Dict[str, float]) -> Optional[Response]:
+        """
+        Answers a conditional GET with 304 from the entry's validator alone, without reading
+        the cached body from Redis. Stale validators are honoured within the revalidate window.
+        """
+        validator = self.local_cache.get(cache_key) if self.local_cache is not None else None
+        # An L1 entry decoded from headers without an ETag has no etag, but its Redis etag record may.
+        if validator is None or not validator.get('etag'):
+            etag_entry = self.redis_client.get(build_etag_key(cache_key))
+            if not etag_entry:
+                return None
             try:
-                data = json.loads(cached_response)
-                logger.info(f"Serving from cache: {request.full_path}")
-                return Response(response=data['content'], status=data['status_code'], headers=data['headers'])
+                validator = json.loads(etag_entry)
             except json.JSONDecodeError:
-                logger.warning(f"Failed to decode cached response for {request.full_path}. Fetching from origin.")
-                self.redis_client.delete(cache_key)
+                return None
+
+        if not etag_matches(request.headers.get('If-None-Match'), validator.get('etag')):
+            return None
+
+        age = cache_entry_age(validator)
+        if age > policy['TTL_SECONDS']:
+            if age > policy['TTL_SECONDS'] + policy['STALE_WHILE_REVALIDATE_SECONDS']:
+                return None
+            self._schedule_revalidation(request, cache_key)
+
+        logger.debug(f"Not modified: {request.full_path}")
+        g.served_from_cache = True
+        CACHE_NOT_MODIFIED.inc()
+        return build_not_modified_response(validator)
+
+    def _lookup(self, cache_key: str, policy: Dict[str, float]) -> Optional[Dict[str, Any]]:
+        """Returns the entry for a key, fresh or stale. L1 only answers while the entry is fresh."""
+        if self.local_cache is not None:
+            data = self.local_cache.get(cache_key)
+            if data is not None and cache_entry_age(data) <= policy['TTL_SECONDS']:
+                CACHE_LOOKUPS.labels('l1', 'hit').inc()
+                return data
+            CACHE_LOOKUPS.labels('l1', 'miss').inc()
+
+        cached_response = self.redis_client.get(cache_key)
+        CACHE_LOOKUPS.labels('l2', 'hit' if cached_response else 'miss').inc()
+        if not cached_response:
+            return None
+
+        try:
+            data = deserialize_cache_entry(cached_response)
+        except ValueError:
+            logger.warning(f"Failed to decode cached response for {cache_key}. Fetching from origin.")
+            self.redis_client.delete(cache_key)
+            return None
+        except Exception as e:
+            logger.error(f"Error processing cached response for {cache_key}: {e}", exc_info=True)
+            self.redis_client.delete(cache_key)
+            return None
+
+        self._store_local(cache_key, data, policy)
+        return data
+
+    def _store_local(self, cache_key: str, data: Dict[str, Any], policy: Dict[str, float]):
+        if self.local_cache is not None:
+            self.local_cache.set(cache_key, data, cache_entry_size(data), ttl_seconds=cache_storage_ttl(policy))
+
+    def _schedule_revalidation(self, request: Any, cache_key: str):
+        """
+        Refreshes a stale entry in the background by dispatching the same request through the app.
+        At most one revalidation per key runs in this process, and a short Redis lock keeps other
+        workers from refreshing the same key at the same time. Nothing is sent while the circuit of
+        the service is open.
+        """
+        breaker_name = g.route.breaker_name
+        if breaker_name is not None and self.circuit_breaker is not None and self.circuit_breaker.service_is_open(breaker_name):
+            logger.debug(f"Not revalidating {cache_key}: the circuit for '{breaker_name}' is open.")
+            return
+
+        with self._revalidating_lock:
+            if cache_key in self._revalidating:
+                return
+            self._revalidating.add(cache_key)
+
+        try:
+            claimed = self.redis_client.set(build_revalidate_lock_key(cache_key), 1, nx=True,
+                                            px=self.coalescing.get('LOCK_TTL_MS', 5000))
+        except Exception as e:
+            logger.warning(f"Failed to claim revalidation of {cache_key}: {e}")
+            claimed = False
+
+        if not claimed:
+            with self._revalidating_lock:
+                self._revalidating.discard(cache_key)
+            return
+
+        self._revalidation_executor.submit(
+            self._revalidate, current_app._get_current_object(), request.path, request.query_string,
+            {k: v for k, v in request.headers if k.lower() != 'if-none-match'}, cache_key
+        )
+
+    def _revalidate(self, app: Any, path: str, query_string: bytes, headers: Dict[str, str], cache_key: str):
+        try:
+            with app.test_request_context(path, method='GET', query_string=query_string, headers=headers):
+                g.cache_revalidating = True
+                response = app.full_dispatch_request()
+                response.close()
+                logger.debug(f"Revalidated {cache_key} (status {response.status_code}).")
+        except Exception as e:
+            logger.error(f"Background revalidation of {cache_key} failed: {e}", exc_info=True)
+        finally:
+            with self._revalidating_lock:
+                self._revalidating.discard(cache_key)
+
+    def _serve_stale_if_error(self, request: Any, response: Response) -> Optional[Response]:
+        """Returns a stale copy for a failed GET if one is still within its stale-if-error window."""
+        if not g.route.cacheable:
+            return None
+
+        policy = self.policies[g.route.cache_route]
+        data = g.pop('stale_cache_entry', None)
+        if data is None:
+            # The request may have been rejected (e.g. by the circuit breaker) before the cache was consulted.
+            try:
+                data = self._lookup(self._cache_key(request), policy)
             except Exception as e:
-                logger.error(f"Error processing cached response for {request.full_path}: {e}", exc_info=True)
-                self.redis_client.delete(cache_key)
+                logger.error(f"Failed to look up stale response for {request.full_path}: {e}")
+                return None
 
-        return None
+        if data is None or cache_entry_age(data) > policy['TTL_SECONDS'] + policy['STALE_IF_ERROR_SECONDS']:
+            return None
+
+        # Lets the circuit breaker record the origin's failure rather than the stale success.
+        g.origin_status_code = response.status_code
+        CACHE_STALE_SERVED.labels('error').inc()
+        logger.warning(f"Serving stale response for {request.full_path} after upstream error {response.status_code}.")
+        return build_cached_response(data)
+
+    def _finish_flight(self, data: Optional[Dict[str, Any]]):
+        """Hands the leader's cacheable response (or None) to waiting followers and frees the fill lock."""
+        cache_flight = g.pop('cache_flight', None)
+        if cache_flight is None:
+            return
+        cache_key, flight, lock_token = cache_flight
+        self.single_flight.complete(cache_key, flight, data)
+        if lock_token is not None:
+            try:
+                self.redis_client.eval(RELEASE_FILL_LOCK_SCRIPT, 1, build_fill_lock_key(cache_key), lock_token)
+            except Exception as e:
+                logger.warning(f"Failed to release cache fill lock for {cache_key}: {e}")
+
+    def invalidate(self, service_name: str, resource_path: str, source: str, recursive: bool = True) -> int:
+        """Purges the entries affected by a change to `resource_path` of `service_name`. Returns how many."""
+        self._init_redis_client()
+        if self.redis_client is None:
+            return 0
+
+        tags = invalidation_tags(service_name, resource_path, recursive)
+        purged = {cache_key.decode('utf-8') for cache_key in
+                  self.redis_client.eval(PURGE_TAGS_SCRIPT, *purge_tags_args(tags, self.tag_ttl))}
+        if self.local_cache is not None:
+            for cache_key in purged:
+                self.local_cache.delete(cache_key)
+
+        CACHE_INVALIDATIONS.labels(source).inc()
+        CACHE_INVALIDATED_ENTRIES.inc(len(purged))
+        logger.info(f"Invalidated {len(purged)} cache entries for {service_name}{resource_path} ({source}).")
+        return len(purged)
 
     def process_response(self, request: Any, response: Response) -> Response:
         self._init_redis_client()
@@ -79,25 +649,67 @@ class CachingMiddleware(Middleware):
         if self.redis_client is None:
             return response
 
+        if request.method in INVALIDATING_METHODS:
+            route = g.route
+            if route.service_name is not None and response.status_code < 400 and self.invalidation.get('ENABLED', True):
+                try:
+                    self.invalidate(route.service_name, route.resource_path, source='request',
+                                    recursive=request.method != 'POST')
+                except Exception as e:
+                    logger.error(f"Failed to invalidate cache after {request.method} {request.path}: {e}")
+            return response
+
+        if request.method == 'GET' and response.status_code >= 500 and not g.get('cache_revalidating'):
+            stale_response = self._serve_stale_if_error(request, response)
+            if stale_response is not None:
+                self._finish_flight(None)
+                return stale_response
+
+        if response.is_streamed:
+            logger.debug(f"Skipping cache for streamed response: {request.full_path}")
+            self._finish_flight(None)
+            return response
+
+        if g.get('served_from_cache'):
+            return response
+
+        data = None
+        stored = False
         if request.method == 'GET' and response.status_code == 200:
-            for excluded_path in self.excluded_paths:
-                if excluded_path.endswith('/<path:path>'):
-                    base_path = excluded_path.replace('/<path:path>', '')
-                    if request.path.startswith(base_path):
-                        return response
-                elif request.path == excluded_path:
-                    return response
-
-            cache_key = f"cache:{request.full_path}"
-            response_data = {
-                "content": response.get_data(as_text=True),
-                "status_code": response.status_code,
-                "headers": dict(response.headers)
-            }
-            try:
-                self.redis_client.setex(cache_key, self.cache_ttl, json.dumps(response_data))
-                logger.info(f"Cached response for: {request.full_path}")
-            except Exception as e:
-                logger.error(f"Failed to cache response for {request.full_path}: {e}", exc_info=True)
+            if not g.route.cacheable:
+                return response
+
+            cache_key = self._cache_key(request)
+            policy = self.policies[g.route.cache_route]
+            stored_at = time.time()
+            body = response.get_data()
+            etag = response.headers.get('ETag') or compute_etag(body)
+            response.headers['ETag'] = etag
+            data = {"body": body, "status_code": response.status_code, "headers": cacheable_headers(response.headers.items()),
+                    "stored_at": stored_at, "etag": etag}
+            cache_entry = serialize_cache_entry(body, data['status_code'], data['headers'], stored_at, self.compression)
+            tag_versions = g.get('cache_tag_versions')
+            if tag_versions is None:
+                # The tag versions could not be read, so a purge during the fill would go unnoticed.
+                logger.debug(f"Not caching {request.full_path}: its tag versions are unknown.")
+            else:
+                try:
+                    stored = self.redis_client.eval(STORE_ENTRY_SCRIPT, *store_entry_args(
+                        cache_key, cache_entry, serialize_etag_entry(etag, stored_at), cache_storage_ttl(policy),
+                        self._entry_tags(), tag_versions, self.tag_ttl))
+                    if stored:
+                        logger.info(f"Cached response for: {request.full_path}")
+                    else:
+                        logger.info(f"Not caching {request.full_path}: it was purged while being fetched.")
+                except Exception as e:
+                    logger.error(f"Failed to cache response for {request.full_path}: {e}", exc_info=True)
+                    # Redis is failing, not purging: the entry can still be served from this process.
+                    stored = True
+                if stored:
+                    self._store_local(cache_key, data, policy)
 
+        self._finish_flight(data if stored else None)
+        if data is not None and etag_matches(request.headers.get('If-None-Match'), data['etag']):
+            CACHE_NOT_MODIFIED.inc()
+            return build_not_modified_response(data)
         return response
@@ -1,10 +1,10 @@
 import redis
 import time
-from flask import request, jsonify, Response, current_app
-from typing import Any, Optional, Dict
+from flask import request, jsonify, Response, current_app, g
+from typing import Any, Optional, Dict, List, Tuple
 from ..middleware_manager import Middleware
+from ..utils.paths import split_proxy_path
 import logging
-import json
 from http import HTTPStatus
 logger = logging.getLogger(__name__)
 
@@ -16,10 +16,325 @@ CIRCUIT_HALF_OPEN = "HALF_OPEN"
 
 service_breakers: Dict[str, Any] = {}
 
+
+def get_breaker_service_name(path: str) -> Optional[str]:
+    """Returns the service a request path is guarded by, or None if the path is not guarded."""
+    proxy_target = split_proxy_path(path)
+    if proxy_target is None:
+        return None
+    return proxy_target[0]
+
+
+def build_instance_breaker_name(service_name: str, instance_url: str) -> str:
+    return f"{service_name}@{instance_url}"
+
+
+def build_breaker_key(breaker_name: str) -> str:
+    return f"cb:state:{breaker_name}"
+
+
+# Pub/sub channel on which the scripts announce transitions as "<breaker> <state> <since>".
+BREAKER_EVENTS_CHANNEL = "cb:events"
+
+# A breaker is a Redis hash: s = state, t = time of the last transition, p = half-open trial
+# permits handed out, k = successful trials, l = when the current permits were handed out.
+# Outcomes go into a time-based ring of buckets: e<i> = bucket epoch, c<i> = calls,
+# f<i> = failures, w<i> = slow calls.
+
+# KEYS[1] = breaker hash; ARGV = now, recovery timeout, half-open max calls, half-open timeout, events channel, name.
+# Returns {allowed, state, since, changed}.
+ACQUIRE_PERMISSION_SCRIPT = """
+local state = redis.call('HGET', KEYS[1], 's') or 'CLOSED'
+local since = redis.call('HGET', KEYS[1], 't') or '0'
+local now = tonumber(ARGV[1])
+local changed = 0
+if state == 'OPEN' and now - tonumber(since) > tonumber(ARGV[2]) then
+    state = 'HALF_OPEN'
+    since = ARGV[1]
+    redis.call('HSET', KEYS[1], 's', state, 't', since, 'p', 0, 'k', 0, 'l', since)
+    redis.call('PUBLISH', ARGV[5], ARGV[6] .. ' ' .. state .. ' ' .. since)
+    changed = 1
+end
+if state == 'CLOSED' then
+    return {1, state, since, changed}
+end
+if state == 'HALF_OPEN' then
+    -- Trial permits that have not reported back within the half-open timeout are handed out again.
+    if now - tonumber(redis.call('HGET', KEYS[1], 'l') or since) > tonumber(ARGV[4]) then
+        redis.call('HSET', KEYS[1], 'p', redis.call('HGET', KEYS[1], 'k') or 0, 'l', ARGV[1])
+    end
+    -- Rejections leave the count alone, so permits handed back stay usable.
+    local permits = tonumber(redis.call('HGET', KEYS[1], 'p') or 0)
+    if permits < tonumber(ARGV[3]) then
+        redis.call('HSET', KEYS[1], 'p', permits + 1)
+        return {1, state, since, changed}
+    end
+end
+return {0, state, since, changed}
+"""
+
+# KEYS[1] = breaker hash. Hands back a half-open trial permit whose request never reached the upstream.
+RELEASE_PERMISSION_SCRIPT = """
+if redis.call('HGET', KEYS[1], 's') == 'HALF_OPEN' and
+        tonumber(redis.call('HGET', KEYS[1], 'p') or 0) > tonumber(redis.call('HGET', KEYS[1], 'k') or 0) then
+    redis.call('HINCRBY', KEYS[1], 'p', -1)
+end
+return 0
+"""
+
+# KEYS = breaker hashes; ARGV = now, window seconds, window buckets, minimum calls, failure rate %,
+# slow call rate %, half-open max calls, key TTL, events channel, then (name, failed, slow) per key.
+# Returns {state, since, changed, calls, failures, slow calls} per key.
+RECORD_OUTCOMES_SCRIPT = """
+local now = tonumber(ARGV[1])
+local buckets = tonumber(ARGV[3])
+local epoch = math.floor(now / (tonumber(ARGV[2]) / buckets))
+local bucket = epoch % buckets
+local results = {}
+
+local function transition(key, name, state)
+    redis.call('HSET', key, 's', state, 't', ARGV[1], 'p', 0, 'k', 0)
+    redis.call('PUBLISH', ARGV[9], name .. ' ' .. state .. ' ' .. ARGV[1])
+end
+
+for i, key in ipairs(KEYS) do
+    local name = ARGV[7 + 3 * i]
+    local failed = ARGV[8 + 3 * i] == '1'
+    local slow = ARGV[9 + 3 * i] == '1'
+    local state = redis.call('HGET', key, 's') or 'CLOSED'
+    local changed = 0
+    local calls, failures, slow_calls = 0, 0, 0
+
+    if state == 'HALF_OPEN' then
+        if failed or slow then
+            state = 'OPEN'
+        elseif redis.call('HINCRBY', key, 'k', 1) >= tonumber(ARGV[7]) then
+            state = 'CLOSED'
+        end
+        if state ~= 'HALF_OPEN' then
+            transition(key, name, state)
+            changed = 1
+        end
+    elseif state == 'CLOSED' then
+        if redis.call('HGET', key, 'e' .. bucket) ~= tostring(epoch) then
+            redis.call('HSET', key, 'e' .. bucket, epoch, 'c' .. bucket, 0, 'f' .. bucket, 0, 'w' .. bucket, 0)
+        end
+        redis.call('HINCRBY', key, 'c' .. bucket, 1)
+        if failed then redis.call('HINCRBY', key, 'f' .. bucket, 1) end
+        if slow then redis.call('HINCRBY', key, 'w' .. bucket, 1) end
+
+        for b = 0, buckets - 1 do
+            local fields = redis.call('HMGET', key, 'e' .. b, 'c' .. b, 'f' .. b, 'w' .. b)
+            if fields[1] and epoch - tonumber(fields[1]) < buckets then
+                calls = calls + tonumber(fields[2])
+                failures = failures + tonumber(fields[3])
+                slow_calls = slow_calls + tonumber(fields[4])
+            end
+        end
+
+        if calls >= tonumber(ARGV[4]) and (failures * 100 >= tonumber(ARGV[5]) * calls or slow_calls * 100 >= tonumber(ARGV[6]) * calls) then
+            state = 'OPEN'
+            for b = 0, buckets - 1 do
+                redis.call('HDEL', key, 'e' .. b, 'c' .. b, 'f' .. b, 'w' .. b)
+            end
+            transition(key, name, state)
+            changed = 1
+        end
+    end
+    -- Calls admitted before the circuit opened are not recorded.
+
+    redis.call('EXPIRE', key, ARGV[8])
+    table.insert(results, {state, redis.call('HGET', key, 't') or '0', changed, calls, failures, slow_calls})
+end
+return results
+"""
+
+
+def parse_breaker_event(message: str) -> Tuple[str, str, float]:
+    breaker_name, state, since = message.split(' ')
+    return breaker_name, state, float(since)
+
+
+def local_breaker_decision(state: str, since: float, current_time: float, config: Dict[str, Any]) -> Optional[bool]:
+    """
+    Decides from a locally cached state whether a request may pass the breaker, or returns
+    None if only Redis can decide (half-open trial permits, or an OPEN circuit whose recovery
+    timeout has elapsed).
+    """
+    if state == CIRCUIT_CLOSED:
+        return True
+    if state == CIRCUIT_OPEN and current_time - since <= config.get('RECOVERY_TIMEOUT_SECONDS', 30):
+        return False
+    return None
+
+
+def acquire_permission_args(breaker_name: str, current_time: float, config: Dict[str, Any]) -> List[Any]:
+    return [
+        current_time,
+        config.get('RECOVERY_TIMEOUT_SECONDS', 30),
+        config.get('HALF_OPEN_MAX_CALLS', 3),
+        config.get('HALF_OPEN_TIMEOUT_SECONDS', 5),
+        BREAKER_EVENTS_CHANNEL,
+        breaker_name,
+    ]
+
+
+def record_outcomes_args(outcomes: List[Tuple[str, bool, bool]], current_time: float, config: Dict[str, Any]) -> List[Any]:
+    window_seconds = config.get('WINDOW_SECONDS', 10)
+    args = [
+        current_time,
+        window_seconds,
+        config.get('WINDOW_BUCKETS', 10),
+        config.get('MINIMUM_CALLS', 10),
+        config.get('FAILURE_RATE_THRESHOLD', 50),
+        config.get('SLOW_CALL_RATE_THRESHOLD', 80),
+        config.get('HALF_OPEN_MAX_CALLS', 3),
+        # Long enough to outlive the window and an open circuit.
+        int(10 * max(window_seconds, config.get('RECOVERY_TIMEOUT_SECONDS', 30))),
+        BREAKER_EVENTS_CHANNEL,
+    ]
+    for breaker_name, failed, slow in outcomes:
+        args.extend([breaker_name, int(failed), int(slow)])
+    return args
+
+
+def log_transition(breaker_name: str, state: str, calls: int = 0, failures: int = 0, slow_calls: int = 0):
+    if state == CIRCUIT_HALF_OPEN:
+        logger.info(f"Circuit '{breaker_name}' transitioned to HALF-OPEN.")
+    elif state == CIRCUIT_CLOSED:
+        logger.info(f"Circuit '{breaker_name}' transitioned to CLOSED after successful trial requests in HALF-OPEN state.")
+    elif calls:
+        logger.error(f"Circuit '{breaker_name}' transitioned to OPEN: {failures} failed and {slow_calls} slow of {calls} calls in the window.")
+    else:
+        logger.error(f"Circuit '{breaker_name}' transitioned back to OPEN due to a failed trial request in HALF-OPEN state.")
+
+
+class BreakerStateCache:
+    """
+    Per-process copy of breaker states, kept current by the scripts' results and the
+    transitions published on BREAKER_EVENTS_CHANNEL. Entries expire after `ttl_seconds`
+    so a missed pub/sub message is corrected by the next Redis round trip.
+    """
+    def __init__(self, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self._states: Dict[str, Tuple[str, float, float]] = {}
+
+    def get(self, breaker_name: str) -> Optional[Tuple[str, float]]:
+        entry = self._states.get(breaker_name)
+        if entry is None or entry[2] <= time.monotonic():
+            return None
+        return entry[0], entry[1]
+
+    def update(self, breaker_name: str, state: str, since: float):
+        self._states[breaker_name] = (state, since, time.monotonic() + self.ttl_seconds)
+
+    def on_event(self, message: str):
+        try:
+            self.update(*parse_breaker_event(message))
+        except ValueError:
+            logger.warning(f"Ignoring malformed circuit breaker event: {message}")
+
+    def is_open(self, breaker_name: str, current_time: float, config: Dict[str, Any]) -> bool:
+        """True if the local copy alone says requests are rejected."""
+        cached_state = self.get(breaker_name)
+        return cached_state is not None and local_breaker_decision(*cached_state, current_time, config) is False
+
+
+class CircuitBreakers:
+    """
+    Sliding-window circuit breakers for services and upstream instances. A circuit opens once
+    at least MINIMUM_CALLS calls in the last WINDOW_SECONDS include FAILURE_RATE_THRESHOLD %
+    failures or SLOW_CALL_RATE_THRESHOLD % slow calls. After RECOVERY_TIMEOUT_SECONDS it lets
+    HALF_OPEN_MAX_CALLS trial requests through; permits that are not reported back within
+    HALF_OPEN_TIMEOUT_SECONDS are handed out again.
+    """
+    def __init__(self, redis_client: redis.StrictRedis, config: Dict[str, Any]):
+        self.config = config
+        self.local_states = BreakerStateCache(ttl_seconds=config.get('LOCAL_STATE_TTL_SECONDS', 1))
+        self._redis_client = redis_client
+        self._acquire_permission = redis_client.register_script(ACQUIRE_PERMISSION_SCRIPT)
+        self._record_outcomes = redis_client.register_script(RECORD_OUTCOMES_SCRIPT)
+        self._release_permission = redis_client.register_script(RELEASE_PERMISSION_SCRIPT)
+        self._pubsub_thread = None
+        self.subscribe()
+
+    def subscribe(self):
+        """Keeps local_states current with the transitions made by other workers."""
+        if self._pubsub_thread is not None:
+            return
+        pubsub = self._redis_client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{BREAKER_EVENTS_CHANNEL: lambda message: self.local_states.on_event(message['data'])})
+        self._pubsub_thread = pubsub.run_in_thread(sleep_time=1, daemon=True, exception_handler=self._on_pubsub_error)
+
+    def _on_pubsub_error(self, e, pubsub, thread):
+        # Local states fall back to expiring after LOCAL_STATE_TTL_SECONDS until the next subscription.
+        logger.warning(f"Circuit breaker event subscription failed: {e}. Resubscribing on the next request.")
+        thread.stop()
+        pubsub.close()
+        self._pubsub_thread = None
+
+    def is_open(self, breaker_name: str) -> bool:
+        return self.local_states.is_open(breaker_name, time.time(), self.config)
+
+    def acquire(self, breaker_name: str) -> Tuple[bool, bool]:
+        """
+        Admits a request, with at most one Redis round trip. Returns (allowed, trial), where
+        trial is True if the request holds one of the half-open trial permits.
+        """
+        self.subscribe()
+        current_time = time.time()
+        cached_state = self.local_states.get(breaker_name)
+        allowed = None if cached_state is None else local_breaker_decision(*cached_state, current_time, self.config)
+        if allowed is not None:
+            return allowed, False
+
+        allowed, state, since, changed = self._acquire_permission(
+            keys=[build_breaker_key(breaker_name)],
+            args=acquire_permission_args(breaker_name, current_time, self.config)
+        )
+        self.local_states.update(breaker_name, state, float(since))
+        if changed:
+            log_transition(breaker_name, state)
+        return bool(allowed), bool(allowed) and state == CIRCUIT_HALF_OPEN
+
+    def allow(self, breaker_name: str) -> bool:
+        return self.acquire(breaker_name)[0]
+
+    def release(self, breaker_name: str):
+        """Returns a trial permit taken by a request that never reached the upstream."""
+        self._release_permission(keys=[build_breaker_key(breaker_name)])
+
+    def record(self, outcomes: List[Tuple[str, bool, bool]]):
+        """Records (breaker name, failed, slow) outcomes in one Redis round trip."""
+        results = self._record_outcomes(
+            keys=[build_breaker_key(breaker_name) for breaker_name, _, _ in outcomes],
+            args=record_outcomes_args(outcomes, time.time(), self.config)
+        )
+        for (breaker_name, _, _), (state, since, changed, calls, failures, slow_calls) in zip(outcomes, results):
+            self.local_states.update(breaker_name, state, float(since))
+            if changed:
+                log_transition(breaker_name, state, calls, failures, slow_calls)
+
+
+def build_breaker_outcomes(service_name: str, status_code: int, duration: float, attempts: List[Tuple[str, float, bool]],
+                           config: Dict[str, Any]) -> List[Tuple[str, bool, bool]]:
+    """
+    Outcomes to record for a proxied request: one for the service and, if enabled, one for
+    each upstream instance attempted, as (breaker name, failed, slow).
+    """
+    slow_call_duration = config.get('SLOW_CALL_DURATION_SECONDS', 5)
+    outcomes = [(service_name, status_code >= 500, duration >= slow_call_duration)]
+    if config.get('INSTANCE_BREAKERS_ENABLED', True):
+        for instance_url, latency, failed in attempts:
+            outcomes.append((build_instance_breaker_name(service_name, instance_url), failed, latency >= slow_call_duration))
+    return outcomes
+
+
 class CircuitBreakerMiddleware(Middleware):
     def __init__(self):
         self.redis_client = None
         self.config = {}
+        self.breakers: Optional[CircuitBreakers] = None
 
     def _init_redis_client_and_config(self):
         """Initializes Redis client and loads config only when app context is available."""
@@ -30,63 +345,69 @@ class CircuitBreakerMiddleware(Middleware):
                 redis_db = current_app.config.get('REDIS_DB')
                 redis_password = current_app.config.get('REDIS_PASSWORD')
 
-                self.redis_client = redis.StrictRedis(
+                redis_client = redis.StrictRedis(
                     host=redis_host,
                     port=redis_port,
                     db=redis_db,
                     password=redis_password,
                     decode_responses=True
                 )
-                self.redis_client.ping()
+                redis_client.ping()
                 self.config = current_app.config.get('CIRCUIT_BREAKER_SETTINGS', {})
+                self.breakers = CircuitBreakers(redis_client, self.config)
+                # Published last so concurrent requests never see a half-configured middleware.
+                self.redis_client = redis_client
                 logger.info("Redis client initialized successfully for CircuitBreakerMiddleware.")
             except Exception as e:
                 logger.error(f"An unexpected error occurred during Redis client initialization for Circuit Breaker: {e}. Circuit Breaker will be disabled.", exc_info=True)
                 self.redis_client = None
 
-    def _get_breaker_state(self, service_name: str) -> Dict[str, Any]:
-        """Retrieves circuit breaker state from Redis."""
-        if not self.redis_client:
-            return {"state": CIRCUIT_CLOSED, "failures": 0, "last_failure_time": 0, "half_open_attempts": 0}
+    def allow_instance(self, service_name: str, instance_url: str) -> bool:
+        """Admission check for one upstream instance, used by the proxy when picking an instance."""
+        if self.redis_client is None or not self.config.get('INSTANCE_BREAKERS_ENABLED', True):
+            return True
+        try:
+            return self.breakers.allow(build_instance_breaker_name(service_name, instance_url))
+        except Exception as e:
+            logger.error(f"Circuit breaker check for {service_name} instance {instance_url} failed: {e}. Allowing request.")
+            return True
 
-        state_str = self.redis_client.get(f"cb:{service_name}")
-        if state_str:
-            return json.loads(state_str)
-        return {"state": CIRCUIT_CLOSED, "failures": 0, "last_failure_time": 0, "half_open_attempts": 0}
+    def instance_is_open(self, service_name: str, instance_url: str) -> bool:
+        """Like allow_instance, but decided locally and without taking a half-open trial permit."""
+        if self.redis_client is None or not self.config.get('INSTANCE_BREAKERS_ENABLED', True):
+            return False
+        return self.breakers.is_open(build_instance_breaker_name(service_name, instance_url))
 
-    def _set_breaker_state(self, service_name: str, state: Dict[str, Any]):
-        """Sets circuit breaker state in Redis."""
-        if self.redis_client:
-            self.redis_client.set(f"cb:{service_name}", json.dumps(state))
+    def service_is_open(self, service_name: str) -> bool:
+        """Whether the service's circuit rejects requests, decided locally and without taking a trial permit."""
+        if self.redis_client is None:
+            return False
+        return self.breakers.is_open(service_name)
 
     def process_request(self, request: Any) -> Optional[Response]:
         self._init_redis_client_and_config()
 
         if self.redis_client is None:
-            return None 
+            return None
 
-        path_parts = request.path.split('/')
-        if len(path_parts) < 3 or path_parts[1] != 'api':
-            return None 
+        service_name = g.route.breaker_name
+        if service_name is None:
+            return None
 
-        service_name = path_parts[2]
+        g.breaker_started = time.time()
+        try:
+            allowed, g.breaker_trial = self.breakers.acquire(service_name)
+        except Exception as e:
+            logger.error(f"Circuit breaker check for service '{service_name}' failed: {e}. Allowing request.")
+            allowed = True
 
-        state = self._get_breaker_state(service_name)
-        current_time = time.time()
+        if not allowed:
+            logger.warning(f"Circuit for service '{service_name}' is OPEN. Request rejected.")
+            fallback_message = current_app.config.get('CIRCUIT_BREAKER_FALLBACK_MESSAGE', "Service is currently unavailable.")
+            return Response(response=jsonify({"message": fallback_message}).data,
+                            status=HTTPStatus.SERVICE_UNAVAILABLE.value,
+                            mimetype='application/json')
 
-        if state["state"] == CIRCUIT_OPEN:
-            if current_time - state["last_failure_time"] > self.config.get('RECOVERY_TIMEOUT_SECONDS', 30):
-                state["state"] = CIRCUIT_HALF_OPEN
-                state["half_open_attempts"] = 0
-                self._set_breaker_state(service_name, state)
-                logger.info(f"Circuit for service '{service_name}' transitioned to HALF-OPEN.")
-            else:
-                logger.warning(f"Circuit for service '{service_name}' is OPEN. Request rejected.")
-                fallback_message = current_app.config.get('CIRCUIT_BREAKER_FALLBACK_MESSAGE', "Service is currently unavailable.")
-                return Response(response=jsonify({"message": fallback_message}).data,
-                                status=HTTPStatus.SERVICE_UNAVAILABLE.value,
-                                mimetype='application/json')
-        
         return None
 
     def process_response(self, request: Any, response: Response) -> Response:
@@ -95,36 +416,22 @@ class CircuitBreakerMiddleware(Middleware):
         if self.redis_client is None:
             return response
 
-        path_parts = request.path.split('/')
-        if len(path_parts) < 3 or path_parts[1] != 'api':
+        service_name = g.route.breaker_name
+        if service_name is None:
             return response
 
-        service_name = path_parts[2]
-        state = self._get_breaker_state(service_name)
-        
-        if response.status_code >= 500:
-            state["failures"] += 1
-            state["last_failure_time"] = time.time()
-            logger.warning(f"Service '{service_name}' recorded a failure. Total failures: {state['failures']}")
-
-            if state["state"] == CIRCUIT_HALF_OPEN:
-                state["state"] = CIRCUIT_OPEN
-                logger.error(f"Circuit for service '{service_name}' transitioned back to OPEN due to failure in HALF-OPEN state.")
-            elif state["state"] == CIRCUIT_CLOSED and state["failures"] >= self.config.get('FAILURE_THRESHOLD', 5):
-                state["state"] = CIRCUIT_OPEN
-                logger.error(f"Circuit for service '{service_name}' transitioned to OPEN after {state['failures']} failures.")
-            
-            self._set_breaker_state(service_name, state)
-
-        elif response.status_code < 500:
-            if state["state"] == CIRCUIT_HALF_OPEN:
-                state["state"] = CIRCUIT_CLOSED
-                state["failures"] = 0
-                state["half_open_attempts"] = 0
-                logger.info(f"Circuit for service '{service_name}' transitioned to CLOSED after successful request in HALF-OPEN state.")
-                self._set_breaker_state(service_name, state)
-            elif state["state"] == CIRCUIT_CLOSED:
-                state["failures"] = 0
-                self._set_breaker_state(service_name, state)
+        # Only requests that reached an upstream say anything about its health; this leaves out the
+        # breaker's own rejections, cache hits and requests refused by other middlewares.
+        attempts = g.get('upstream_attempts')
+        try:
+            if attempts:
+                # A stale cached copy may have replaced a failed response; record what the origin returned.
+                status_code = g.get('origin_status_code', response.status_code)
+                duration = time.time() - g.get('breaker_started', time.time())
+                self.breakers.record(build_breaker_outcomes(service_name, status_code, duration, attempts, self.config))
+            elif g.get('breaker_trial'):
+                self.breakers.release(service_name)
+        except Exception as e:
+            logger.error(f"Failed to record circuit breaker outcome for service '{service_name}': {e}")
 
         return response
@@ -1,41 +1,164 @@
-from flask import request, jsonify, current_app, Response
-from typing import Optional, Any
+from flask import request, jsonify, current_app, Response, g
+from typing import Optional, Any, Dict, List, Tuple
 from http import HTTPStatus
-from ..middleware_manager import Middleware 
+from ..middleware_manager import Middleware
+from ..metrics import RATE_LIMIT_DECISIONS
+from ..utils.rate_limits import (
+    RateLimitDecision, RateLimitRules, SlidingWindowRateLimiter, client_ip, parse_api_keys, parse_trusted_proxies,
+    request_identity,
+)
+import math
+import redis
 import time
 
-request_counts = {}
-last_reset_time = time.time()
+
+def build_rate_limit_key(rule_name: str, identity_kind: str, identity: str) -> str:
+    return f"rl:{rule_name}:{identity_kind}:{identity}"
+
+
+# GCRA over a client's theoretical arrival time (TAT), kept in a plain key that expires once
+# the client's allowance is full again. Times are in milliseconds.
+# KEYS[1] = client key; ARGV = now, emission interval, burst.
+# Returns {allowed, remaining, retry after, reset after}.
+GCRA_SCRIPT = """
+local now = tonumber(ARGV[1])
+local interval = tonumber(ARGV[2])
+local tat = tonumber(redis.call('GET', KEYS[1]) or ARGV[1])
+if tat < now then tat = now end
+local new_tat = tat + interval
+local allow_at = new_tat - interval * tonumber(ARGV[3])
+if now < allow_at then
+    return {0, 0, math.ceil(allow_at - now), math.ceil(tat - now)}
+end
+redis.call('SET', KEYS[1], string.format('%.3f', new_tat), 'PX', math.ceil(new_tat - now))
+return {1, math.floor((now - allow_at + 0.001) / interval), 0, math.ceil(new_tat - now)}
+"""
+
+
+def build_rate_limit_rules(config: Dict[str, Any]) -> RateLimitRules:
+    """Compiles RATE_LIMIT_RULES, with RATE_LIMIT_MAX_REQUESTS per RATE_LIMIT_WINDOW_SECONDS as the default."""
+    default = {
+        'limit': config.get('RATE_LIMIT_MAX_REQUESTS'),
+        'window_seconds': config.get('RATE_LIMIT_WINDOW_SECONDS'),
+        'burst': config.get('RATE_LIMIT_SETTINGS', {}).get('BURST'),
+    }
+    return RateLimitRules(config.get('RATE_LIMIT_RULES', []), default)
+
+
+def gcra_args(current_time: float, rule: Dict[str, Any]) -> List[Any]:
+    return [round(current_time * 1000, 3), rule['emission_interval'] * 1000, rule['burst']]
+
+
+def parse_gcra_result(result: List[int]) -> RateLimitDecision:
+    allowed, remaining, retry_after_ms, reset_after_ms = result
+    return bool(allowed), int(remaining), retry_after_ms / 1000, reset_after_ms / 1000
+
+
+# Describe one client's allowance, so they must never be cached and replayed to other clients.
+RATE_LIMIT_HEADERS = ('X-RateLimit-Limit', 'X-RateLimit-Remaining', 'X-RateLimit-Reset', 'Retry-After')
+
+
+def rate_limit_headers(limit: int, decision: RateLimitDecision, current_time: float) -> Dict[str, str]:
+    allowed, remaining, retry_after, reset_after = decision
+    headers = {
+        'X-RateLimit-Limit': str(limit),
+        'X-RateLimit-Remaining': str(remaining),
+        'X-RateLimit-Reset': str(int(math.ceil(current_time + reset_after))),
+    }
+    if not allowed:
+        headers['Retry-After'] = str(max(1, int(math.ceil(retry_after))))
+    return headers
+
 
 class RateLimiterMiddleware(Middleware):
-    def process_request(self, request: Any) -> Optional[Response]:
-        global request_counts, last_reset_time
+    """
+    Limits each client by the RATE_LIMIT_RULES rule its route, method and identity resolve to
+    (RATE_LIMIT_MAX_REQUESTS per RATE_LIMIT_WINDOW_SECONDS by default). Clients are identified
+    by a known API key, else by the JWT subject AuthMiddleware verified, else by IP.
+    With the redis backend the allowance is a GCRA bucket shared by all workers and replicas
+    and decided in one script call. With the local backend, and while Redis is unreachable,
+    each process limits on its own with a sliding window counter.
+    """
+    def __init__(self):
+        self.redis_client = None
+        self.settings = None
+        self.local_limiter = None
+        self._gcra = None
+        self._next_connect_attempt = 0.0
 
-        max_requests = current_app.config.get('RATE_LIMIT_MAX_REQUESTS')
-        window_seconds = current_app.config.get('RATE_LIMIT_WINDOW_SECONDS')
+    def _init_config(self):
+        if self.settings is None and current_app:
+            settings = current_app.config.get('RATE_LIMIT_SETTINGS', {})
+            self.rules = build_rate_limit_rules(current_app.config)
+            self.trusted_proxies = parse_trusted_proxies(settings.get('TRUSTED_PROXIES', []))
+            self.api_keys = parse_api_keys(settings.get('API_KEYS', []))
+            self.local_limiter = SlidingWindowRateLimiter(settings.get('LOCAL_MAX_CLIENTS', 100000))
+            self.settings = settings
 
-        if time.time() - last_reset_time > window_seconds:
-            request_counts = {}
-            last_reset_time = time.time()
-            current_app.logger.debug("Rate limiter counts reset.")
+    def _init_redis_client(self):
+        """Connects lazily, retrying at most every REDIS_RETRY_INTERVAL_SECONDS while Redis is unreachable."""
+        if self.redis_client is not None or self.settings.get('BACKEND', 'redis') != 'redis':
+            return
+        if time.monotonic() < self._next_connect_attempt:
+            return
+        self._next_connect_attempt = time.monotonic() + self.settings.get('REDIS_RETRY_INTERVAL_SECONDS', 5)
+        try:
+            timeout = self.settings.get('REDIS_TIMEOUT_SECONDS', 0.1)
+            redis_client = redis.StrictRedis(
+                host=current_app.config.get('REDIS_HOST'),
+                port=current_app.config.get('REDIS_PORT'),
+                db=current_app.config.get('REDIS_DB'),
+                password=current_app.config.get('REDIS_PASSWORD'),
+                socket_timeout=timeout,
+                socket_connect_timeout=timeout
+            )
+            redis_client.ping()
+            self._gcra = redis_client.register_script(GCRA_SCRIPT)
+            self.redis_client = redis_client
+            current_app.logger.info("Redis client initialized successfully for RateLimiterMiddleware.")
+        except Exception as e:
+            current_app.logger.error(f"Rate limiter could not connect to Redis: {e}. Limiting per process until it is reachable.")
 
-        client_ip = request.remote_addr
+    def _decide(self, key: str, rule: Dict[str, Any], current_time: float) -> Tuple[int, RateLimitDecision]:
+        """Returns the decision and the limit it was made against: GCRA admits up to the burst."""
+        self._init_redis_client()
+        if self.redis_client is not None:
+            try:
+                decision = parse_gcra_result(self._gcra(keys=[key], args=gcra_args(current_time, rule)))
+                RATE_LIMIT_DECISIONS.labels('redis', 'allowed' if decision[0] else 'limited').inc()
+                return rule['burst'], decision
+            except redis.RedisError as e:
+                current_app.logger.error(f"Rate limiter lost Redis: {e}. Limiting per process until it is reachable.")
+                self.redis_client = None
+                self._next_connect_attempt = time.monotonic() + self.settings.get('REDIS_RETRY_INTERVAL_SECONDS', 5)
 
-        request_counts[client_ip] = request_counts.get(client_ip, 0) + 1
+        decision = self.local_limiter.hit(key, rule['limit'], rule['window_seconds'], current_time)
+        RATE_LIMIT_DECISIONS.labels('local', 'allowed' if decision[0] else 'limited').inc()
+        return rule['limit'], decision
 
-        if request_counts[client_ip] > max_requests:
-            current_app.logger.warning(f"Rate limit exceeded for IP: {client_ip}")
+    def process_request(self, request: Any) -> Optional[Response]:
+        self._init_config()
+
+        ip = client_ip(request.remote_addr, request.headers.get('X-Forwarded-For'), self.trusted_proxies)
+        identity_kind, identity = request_identity(
+            request.headers.get(self.settings.get('API_KEY_HEADER', 'X-API-Key')), getattr(request, 'user', None), ip,
+            self.api_keys
+        )
+        rule = self.rules.resolve(request.path, request.method, identity_kind)
+        current_time = time.time()
+        limit, decision = self._decide(build_rate_limit_key(rule['name'], identity_kind, identity), rule, current_time)
+        g.rate_limit_headers = rate_limit_headers(limit, decision, current_time)
+
+        if not decision[0]:
+            current_app.logger.warning(f"Rate limit '{rule['name']}' exceeded for {identity_kind} {identity}")
             return Response(response=jsonify({"message": "Too many requests. Please try again later."}).data,
                             status=HTTPStatus.TOO_MANY_REQUESTS.value,
-                            mimetype='application/json',
-                            headers={'Retry-After': str(window_seconds)})
+                            mimetype='application/json')
 
-        current_app.logger.debug(f"IP {client_ip} has made {request_counts[client_ip]} requests.")
+        current_app.logger.debug(f"{identity_kind} {identity} has {decision[1]} requests left under '{rule['name']}'.")
         return None
 
     def process_response(self, request: Any, response: Response) -> Response:
-        response.headers['X-RateLimit-Limit'] = str(current_app.config.get('RATE_LIMIT_MAX_REQUESTS'))
-        response.headers['X-RateLimit-Remaining'] = str(current_app.config.get('RATE_LIMIT_MAX_REQUESTS') - request_counts.get(request.remote_addr, 0))
-        response.headers['X-RateLimit-Reset'] = str(int(last_reset_time + current_app.config.get('RATE_LIMIT_WINDOW_SECONDS')))
+        # Requests rejected before reaching the limiter carry no rate limit headers.
+        response.headers.update(g.get('rate_limit_headers', {}))
         return response
-
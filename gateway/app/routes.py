@@ -1,22 +1,21 @@
-from flask import request, jsonify, current_app, Response
+from flask import request, jsonify, current_app, Response, g
 from flask_restx import Namespace, Resource, fields
 import requests
-import json
 import logging
+import time
+from functools import partial
 from http import HTTPStatus
 
 from .utils.errors import (
     ServiceUnavailableError,
-    NotFoundError,
-    BadRequestError,
     APIError,
-    TooManyRequestsError,
-    UnauthorizedError,
-    ForbiddenError,
-    ConflictError,
+    upstream_error,
 )
+from .utils.concurrency import ConcurrencySlot
+from .utils.upstream import EXCLUDED_REQUEST_HEADERS, EXCLUDED_RESPONSE_HEADERS, get_stream_threshold, instance_label, status_class
 
 from .middlewares.circuit_breaker import service_breakers 
+from .metrics import UPSTREAM_DISCOVERY_LATENCY, UPSTREAM_BODY_TRANSFER, UPSTREAM_RESPONSES
 
 logger = logging.getLogger(__name__)
 
@@ -29,6 +28,10 @@ health_status_model = gateway_ns.model('HealthStatus', {
 proxy_ns = Namespace('proxy', description='Proxy requests to microservices')
 
 _service_discovery_client = None
+_upstream_session_pool = None
+_request_hedger = None
+_circuit_breaker = None
+_concurrency_limiter = None
 
 
 class GatewayRoot(Resource):
@@ -46,9 +49,14 @@ class GatewayRoot(Resource):
         }), 200
 
 
-def register_routes(app, api_instance, openapi_aggregator_instance, service_discovery_client_param):
-    global _service_discovery_client
+def register_routes(app, api_instance, openapi_aggregator_instance, service_discovery_client_param, upstream_session_pool_param,
+                    request_hedger_param=None, circuit_breaker_param=None, concurrency_limiter_param=None):
+    global _service_discovery_client, _upstream_session_pool, _request_hedger, _circuit_breaker, _concurrency_limiter
     _service_discovery_client = service_discovery_client_param
+    _upstream_session_pool = upstream_session_pool_param
+    _request_hedger = request_hedger_param
+    _circuit_breaker = circuit_breaker_param
+    _concurrency_limiter = concurrency_limiter_param
 
     api_instance.add_resource(GatewayRoot, '/')
 
@@ -158,33 +166,154 @@ def register_routes(app, api_instance, openapi_aggregator_instance, service_disc
             return _proxy_request(service_name, path, request.method)
 
 
+def _iter_request_body(chunk_size):
+    """Reads the client request body in bounded chunks so it is never held in memory whole."""
+    stream = request.stream
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+def _iter_upstream_body(resp, service_name, chunk_size):
+    """Relays the upstream body in bounded chunks and releases the pooled connection when done."""
+    started = time.perf_counter()
+    try:
+        for chunk in resp.iter_content(chunk_size=chunk_size):
+            if chunk:
+                yield chunk
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Upstream stream from service '{service_name}' was interrupted: {e}")
+        raise
+    finally:
+        UPSTREAM_BODY_TRANSFER.labels(service_name, instance_label(resp.url)).observe(time.perf_counter() - started)
+        resp.close()
+
+
+def _send_upstream(service_name, service_url, method, path, attempts, **kwargs):
+    """
+    Sends one upstream attempt, reports its outcome to the load balancer and appends
+    (instance, latency, failed) to `attempts` for the circuit breaker.
+    """
+    load_balancer = _service_discovery_client.load_balancer
+    load_balancer.on_request_start(service_url)
+    upstream_start = time.time()
+    upstream_failed = True
+    status = None
+    try:
+        # Sent with stream=True, so this returns as soon as the response headers are in.
+        resp = _upstream_session_pool.request(service_name, method=method, url=f"{service_url}/{path}", **kwargs)
+        status = resp.status_code
+        upstream_failed = status >= 500
+        return resp
+    finally:
+        latency = time.time() - upstream_start
+        load_balancer.on_request_end(service_url, latency, upstream_failed)
+        attempts.append((service_url, latency, upstream_failed))
+        UPSTREAM_RESPONSES.labels(service_name, instance_label(service_url), status_class(status)).inc()
+
+
+def _send_hedged_upstream(service_name, service_url, method, path, attempts, **kwargs):
+    """Sends an idempotent request, hedging it to a second instance if the first is slow."""
+    backup = None
+    other_instances = [
+        url for url in _service_discovery_client.get_service_addresses(service_name)
+        if url != service_url and not (_circuit_breaker is not None and _circuit_breaker.instance_is_open(service_name, url))
+    ]
+    if other_instances:
+        backup_url = _service_discovery_client.load_balancer.choose(service_name, other_instances)
+        backup = lambda: _send_upstream(service_name, backup_url, method, path, attempts, **kwargs)
+
+    return _request_hedger.execute(
+        service_name,
+        lambda: _send_upstream(service_name, service_url, method, path, attempts, **kwargs),
+        backup,
+        close=lambda resp: resp.close(),
+    )
+
+
 def _proxy_request(service_name, path, method):
-    service_url = _service_discovery_client.get_service_address(service_name)
+    if _concurrency_limiter is None or not _concurrency_limiter.is_enabled(service_name):
+        return _forward_request(service_name, path, method)
+
+    if not _concurrency_limiter.acquire(service_name):
+        raise ServiceUnavailableError(f"Service '{service_name}' is overloaded.",
+                                      headers={'Retry-After': str(_concurrency_limiter.retry_after_seconds)})
+    slot = ConcurrencySlot(_concurrency_limiter, service_name)
+    try:
+        response = _forward_request(service_name, path, method)
+    except BaseException:
+        slot.release(g.get('upstream_attempts'))
+        raise
+    if response.is_streamed:
+        # The call lasts until the body has been relayed.
+        response.call_on_close(partial(slot.release, g.get('upstream_attempts')))
+    else:
+        slot.release(g.get('upstream_attempts'))
+    return response
+
+
+def _forward_request(service_name, path, method):
+    admit = None
+    if _circuit_breaker is not None:
+        admit = lambda instance_url: _circuit_breaker.allow_instance(service_name, instance_url)
+    discovery_start = time.perf_counter()
+    service_url = _service_discovery_client.get_service_address(service_name, admit=admit)
+    UPSTREAM_DISCOVERY_LATENCY.labels(service_name).observe(time.perf_counter() - discovery_start)
     if not service_url:
         raise ServiceUnavailableError(f"Service '{service_name}' not found or no healthy instances available.")
 
-    target_url = f"{service_url}/{path}"
-    
-    headers = {k: v for k, v in request.headers if k.lower() not in ['host', 'content-length', 'transfer-encoding']}
-    data = request.get_data()
-    
+    headers = {k: v for k, v in request.headers if k.lower() not in EXCLUDED_REQUEST_HEADERS}
+
+    streaming_settings = current_app.config.get('PROXY_STREAMING_SETTINGS', {})
+    stream_threshold = get_stream_threshold(streaming_settings, service_name, path)
+    chunk_size = streaming_settings.get('CHUNK_SIZE_BYTES', 64 * 1024)
+
+    request_is_chunked = 'chunked' in request.headers.get('Transfer-Encoding', '').lower()
+    body_is_streamed = request_is_chunked or (request.content_length or 0) > stream_threshold
+    if body_is_streamed:
+        data = _iter_request_body(chunk_size)
+    else:
+        data = request.get_data()
+
+    # Only idempotent requests with a replayable body can be sent twice.
+    send = _send_upstream
+    if method == 'GET' and not body_is_streamed and _request_hedger is not None and _request_hedger.is_enabled(service_name):
+        send = _send_hedged_upstream
+
+    # Outcomes of the upstream attempts, recorded by the circuit breaker middleware.
+    g.upstream_attempts = []
     try:
-        resp = requests.request(
-            method=method,
-            url=target_url,
+        resp = send(
+            service_name,
+            service_url,
+            method,
+            path,
+            g.upstream_attempts,
             headers=headers,
             data=data,
             params=request.args,
             allow_redirects=False,
+            stream=True,
             timeout=10
         )
 
-        excluded_response_headers = ['content-encoding', 'content-length', 'transfer-encoding', 'connection']
-        response_headers = [(name, value) for name, value in resp.raw.headers.items() if name.lower() not in excluded_response_headers]
+        response_headers = [(name, value) for name, value in resp.raw.headers.items() if name.lower() not in EXCLUDED_RESPONSE_HEADERS]
 
         resp.raise_for_status() 
 
-        return Response(resp.content, resp.status_code, response_headers)
+        upstream_length = resp.headers.get('Content-Length')
+        if upstream_length is not None and upstream_length.isdigit() and int(upstream_length) <= stream_threshold:
+            body_start = time.perf_counter()
+            body = resp.content
+            UPSTREAM_BODY_TRANSFER.labels(service_name, instance_label(resp.url)).observe(time.perf_counter() - body_start)
+            return Response(body, resp.status_code, response_headers)
+
+        current_app.logger.debug(f"Streaming response from '{service_name}' for {path} (Content-Length: {upstream_length}).")
+        # Not direct_passthrough: werkzeug then hands the bare generator to the server, and callbacks
+        # registered with call_on_close (e.g. admission control's) would never run.
+        return Response(_iter_upstream_body(resp, service_name, chunk_size), resp.status_code, response_headers)
 
     except requests.exceptions.Timeout:
         current_app.logger.error(f"Service '{service_name}' at {service_url} timed out.")
@@ -193,29 +322,7 @@ def _proxy_request(service_name, path, method):
         current_app.logger.error(f"Service '{service_name}' at {service_url} is unavailable (Connection Error).")
         raise ServiceUnavailableError(f"Service '{service_name}' is unavailable.")
     except requests.exceptions.HTTPError as e:
-        status_code = e.response.status_code
-        message = e.response.text if e.response.text else f"Error from microservice: {status_code}"
-        
-        try:
-            error_details = e.response.json()
-            message = error_details.get("message", message)
-        except json.JSONDecodeError:
-            pass
-            
-        if status_code == HTTPStatus.NOT_FOUND.value:
-            raise NotFoundError(message)
-        elif status_code == HTTPStatus.BAD_REQUEST.value:
-            raise BadRequestError(message)
-        elif status_code == HTTPStatus.UNAUTHORIZED.value:
-            raise UnauthorizedError(message)
-        elif status_code == HTTPStatus.FORBIDDEN.value:
-            raise ForbiddenError(message)
-        elif status_code == HTTPStatus.CONFLICT.value:
-            raise ConflictError(message)
-        elif status_code == HTTPStatus.TOO_MANY_REQUESTS.value:
-            raise TooManyRequestsError(message)
-        else:
-            raise APIError(message, status_code)
+        raise upstream_error(e.response.status_code, e.response.text)
     except Exception as e:
         current_app.logger.exception(f"An unexpected error occurred during proxying request to {service_name}: {e}")
         raise APIError(message=f"An internal error occurred: {str(e)}", code=HTTPStatus.INTERNAL_SERVER_ERROR.value)
@@ -0,0 +1,190 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Mapping
+
+from ..metrics import ADMISSION_REQUESTS, ADMISSION_QUEUED, ADMISSION_QUEUE_TIME, ADMISSION_IN_FLIGHT
+
+ADMITTED = 'admitted'
+QUEUE_FULL = 'queue_full'
+QUEUE_TIMEOUT = 'queue_timeout'
+
+
+def _route_matches(path: str, route: str) -> bool:
+    route = route.rstrip('/')
+    return path == route or path.startswith(route + '/') or not route
+
+
+class PriorityClassifier:
+    """
+    Assigns requests a priority class with the first matching rule. A rule names its `class`
+    and any of `route` (a path prefix, matched on segment boundaries), `methods`, and `header`
+    with an optional `value` it must equal. Omitted matchers match anything.
+    """
+    def __init__(self, rules: List[Dict[str, Any]], default_class: str):
+        self.default_class = default_class
+        self.rules = [
+            (rule['class'], rule.get('route'), {m.upper() for m in rule.get('methods') or []},
+             rule.get('header'), rule.get('value'))
+            for rule in rules
+        ]
+
+    def classify(self, path: str, method: str, headers: Mapping[str, str]) -> str:
+        for priority_class, route, methods, header, value in self.rules:
+            if route is not None and not _route_matches(path, route):
+                continue
+            if methods and method not in methods:
+                continue
+            if header is not None:
+                header_value = headers.get(header)
+                if header_value is None or (value is not None and header_value != value):
+                    continue
+            return priority_class
+        return self.default_class
+
+
+class _Waiter:
+    __slots__ = ('priority_class', 'deadline', 'granted', 'wake')
+
+    def __init__(self, priority_class: str, deadline: float, wake: Callable[[], None]):
+        self.priority_class = priority_class
+        self.deadline = deadline
+        self.granted = False
+        self.wake = wake
+
+
+class AdmissionSlot:
+    """The slot of an admitted request. It goes back to the controller on the first release() only."""
+    __slots__ = ('_controller', '_released', '_lock')
+
+    def __init__(self, controller: 'AdmissionController'):
+        self._controller = controller
+        self._released = False
+        self._lock = threading.Lock()
+
+    def release(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self._controller.release()
+
+
+class AdmissionController:
+    """
+    Admits at most MAX_CONCURRENT requests into the gateway at once. Requests over it wait in
+    a bounded queue of their priority class for at most the class' queue time, and each freed
+    slot goes to the oldest waiter of the most important class. Under sustained overload the
+    least important classes therefore wait longest and are the first shed, either because
+    their queue is full or because their wait ran out.
+
+    `admit` blocks the calling thread; AsyncAdmissionController is the asyncio counterpart.
+    """
+    def __init__(self, settings: Dict[str, Any]):
+        self.max_concurrent = settings.get('MAX_CONCURRENT', 64)
+        self.retry_after_seconds = settings.get('RETRY_AFTER_SECONDS', 1)
+        # Most important class first.
+        self.classes = {c['name']: c for c in settings.get('CLASSES', [])}
+        self.classifier = PriorityClassifier(settings.get('RULES', []), settings.get('DEFAULT_CLASS', 'normal'))
+        if self.classifier.default_class not in self.classes:
+            self.classes[self.classifier.default_class] = {'name': self.classifier.default_class}
+        self._queues: Dict[str, Deque[_Waiter]] = {name: deque() for name in self.classes}
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def classify(self, path: str, method: str, headers: Mapping[str, str]) -> str:
+        priority_class = self.classifier.classify(path, method, headers)
+        return priority_class if priority_class in self.classes else self.classifier.default_class
+
+    def _enqueue(self, priority_class: str, wake: Callable[[], None]) -> Any:
+        """
+        Takes a slot at once (returns ADMITTED), queues a waiter (returns it) or sheds the
+        request (returns QUEUE_FULL). Callers hold the lock.
+        """
+        if self.in_flight < self.max_concurrent and not any(self._queues.values()):
+            self.in_flight += 1
+            ADMISSION_IN_FLIGHT.set(self.in_flight)
+            return ADMITTED
+        settings = self.classes[priority_class]
+        queue = self._queues[priority_class]
+        if len(queue) >= settings.get('max_queue', 100):
+            return QUEUE_FULL
+        waiter = _Waiter(priority_class, time.monotonic() + settings.get('max_queue_time_seconds', 1.0), wake)
+        queue.append(waiter)
+        ADMISSION_QUEUED.labels(priority_class).set(len(queue))
+        return waiter
+
+    def _withdraw(self, waiter: _Waiter) -> bool:
+        """Removes a waiter whose wait ran out; returns False if it was granted a slot meanwhile."""
+        with self._lock:
+            if waiter.granted:
+                return False
+            queue = self._queues[waiter.priority_class]
+            try:
+                queue.remove(waiter)
+            except ValueError:
+                # Already dropped by release() as expired.
+                pass
+            ADMISSION_QUEUED.labels(waiter.priority_class).set(len(queue))
+            return True
+
+    def release(self):
+        with self._lock:
+            now = time.monotonic()
+            for priority_class, queue in self._queues.items():
+                while queue:
+                    waiter = queue.popleft()
+                    ADMISSION_QUEUED.labels(priority_class).set(len(queue))
+                    if waiter.deadline <= now:
+                        # Its owner is about to give up anyway; the slot goes to someone still waiting.
+                        waiter.wake()
+                        continue
+                    # The slot passes straight to the waiter, so in_flight stays as it is.
+                    waiter.granted = True
+                    waiter.wake()
+                    return
+            self.in_flight -= 1
+            ADMISSION_IN_FLIGHT.set(self.in_flight)
+
+    def _record(self, priority_class: str, result: str, queued_for: float = 0.0):
+        ADMISSION_REQUESTS.labels(priority_class, result).inc()
+        if queued_for:
+            ADMISSION_QUEUE_TIME.labels(priority_class).observe(queued_for)
+
+    def admit(self, priority_class: str) -> str:
+        """Returns ADMITTED once the request holds a slot, else why it was shed."""
+        event = threading.Event()
+        with self._lock:
+            waiter = self._enqueue(priority_class, event.set)
+        if not isinstance(waiter, _Waiter):
+            self._record(priority_class, waiter)
+            return waiter
+
+        queued_at = time.monotonic()
+        event.wait(max(waiter.deadline - queued_at, 0))
+        result = QUEUE_TIMEOUT if self._withdraw(waiter) else ADMITTED
+        self._record(priority_class, result, time.monotonic() - queued_at)
+        return result
+
+
+class AsyncAdmissionController(AdmissionController):
+    """AdmissionController for the asyncio engine: waiters await a future instead of blocking."""
+    async def admit(self, priority_class: str) -> str:
+        future = asyncio.get_running_loop().create_future()
+
+        def wake():
+            if not future.done():
+                future.set_result(None)
+
+        with self._lock:
+            waiter = self._enqueue(priority_class, wake)
+        if not isinstance(waiter, _Waiter):
+            self._record(priority_class, waiter)
+            return waiter
+
+        queued_at = time.monotonic()
+        await asyncio.wait([future], timeout=max(waiter.deadline - queued_at, 0))
+        result = QUEUE_TIMEOUT if self._withdraw(waiter) else ADMITTED
+        self._record(priority_class, result, time.monotonic() - queued_at)
+        return result
@@ -0,0 +1,82 @@
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+try:
+    import pika
+except ImportError:
+    pika = None
+
+logger = logging.getLogger(__name__)
+
+
+class CacheInvalidationConsumer:
+    """
+    Consumes the services' domain events from RabbitMQ and invalidates the cached resources
+    each routing key is mapped to. Every gateway process binds its own exclusive queue, so
+    every process (and its in-process cache tier) sees every event.
+    """
+    def __init__(self, config: Dict[str, Any], invalidate: Callable[[str, str], None]):
+        settings = config.get('CACHE_INVALIDATION_SETTINGS', {})
+        self.host = config.get('RABBITMQ_HOST')
+        self.port = config.get('RABBITMQ_PORT')
+        self.username = config.get('RABBITMQ_USERNAME', 'guest')
+        self.password = config.get('RABBITMQ_PASSWORD', 'guest')
+        self.exchanges: List[str] = settings.get('EVENT_EXCHANGES', [])
+        self.event_resources: Dict[str, List[str]] = settings.get('EVENT_RESOURCES', {})
+        self.reconnect_delay = settings.get('RECONNECT_DELAY_SECONDS', 5)
+        self.invalidate = invalidate
+        self._stop_event = threading.Event()
+        self._connection: Optional["pika.BlockingConnection"] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> bool:
+        """Starts consuming in a daemon thread. Returns False if pika is not installed."""
+        if pika is None:
+            logger.error("pika is not installed; cache invalidation events will not be consumed.")
+            return False
+        self._thread = threading.Thread(target=self._run, name="cache-invalidation-consumer", daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        self._stop_event.set()
+        connection = self._connection
+        if connection is not None and connection.is_open:
+            connection.add_callback_threadsafe(connection.close)
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                self._consume()
+            except Exception as e:
+                if self._stop_event.is_set():
+                    break
+                logger.error(f"Cache invalidation consumer lost RabbitMQ at {self.host}:{self.port}: {e}. "
+                             f"Reconnecting in {self.reconnect_delay}s.")
+            finally:
+                self._connection = None
+            self._stop_event.wait(self.reconnect_delay)
+
+    def _consume(self):
+        credentials = pika.PlainCredentials(self.username, self.password)
+        self._connection = pika.BlockingConnection(pika.ConnectionParameters(self.host, self.port, '/', credentials))
+        channel = self._connection.channel()
+        queue_name = channel.queue_declare(queue='', exclusive=True, auto_delete=True).method.queue
+        for exchange_name in self.exchanges:
+            # Declared exactly as MessageQueueClient.publish_event does, so either side may come up first.
+            channel.exchange_declare(exchange=exchange_name, exchange_type='topic', durable=True)
+            for routing_key in self.event_resources:
+                channel.queue_bind(queue=queue_name, exchange=exchange_name, routing_key=routing_key)
+
+        channel.basic_consume(queue=queue_name, on_message_callback=self._on_message, auto_ack=True)
+        logger.info(f"Consuming cache invalidation events {list(self.event_resources)} from {self.exchanges}.")
+        channel.start_consuming()
+
+    def _on_message(self, channel, method, properties, body):
+        for resource in self.event_resources.get(method.routing_key, []):
+            service_name, _, resource_path = resource.partition(':')
+            try:
+                self.invalidate(service_name, resource_path)
+            except Exception as e:
+                logger.error(f"Failed to invalidate cache for {resource} on event '{method.routing_key}': {e}")
@@ -0,0 +1,70 @@
+import hashlib
+from typing import Any, Dict, List, Optional, Union
+from urllib.parse import parse_qsl, urlencode
+
+import jwt
+
+from .token_cache import VerifiedTokenCache, verify_token
+
+ANONYMOUS = '-'
+
+
+class CacheKeyBuilder:
+    """
+    Builds normalized cache keys: query parameters are sorted by name with tracking
+    parameters dropped, keys are partitioned by the configured Vary dimensions, and
+    keys longer than `MAX_KEY_LENGTH` are replaced by a fixed-width digest.
+
+    Vary dimensions are request header names, plus `user` for the `user_id` claim of a
+    verified JWT. Requests without a valid token share the anonymous partition. Tokens are
+    verified through `token_cache`, shared with the auth middleware, when one is given.
+    """
+    def __init__(self, settings: Dict[str, Any], jwt_secret: Optional[str] = None,
+                 token_cache: Optional[VerifiedTokenCache] = None):
+        self.ignored_params = {name.lower() for name in settings.get('IGNORED_QUERY_PARAMS', [])}
+        self.ignored_prefixes = tuple(prefix.lower() for prefix in settings.get('IGNORED_QUERY_PREFIXES', []))
+        self.vary: List[str] = list(settings.get('VARY', []))
+        self.max_key_length = settings.get('MAX_KEY_LENGTH', 256)
+        self.jwt_secret = jwt_secret
+        self.token_cache = token_cache
+
+    def _is_ignored(self, name: str) -> bool:
+        name = name.lower()
+        return name in self.ignored_params or name.startswith(self.ignored_prefixes)
+
+    def canonical_query(self, query_string: Union[str, bytes]) -> str:
+        """Sorts parameters by name (keeping the order of repeated ones) and drops ignored ones."""
+        if isinstance(query_string, bytes):
+            query_string = query_string.decode('latin-1')
+        params = [(name, value) for name, value in parse_qsl(query_string, keep_blank_values=True) if not self._is_ignored(name)]
+        params.sort(key=lambda param: param[0])
+        return urlencode(params)
+
+    def _user_id(self, headers) -> str:
+        auth_header = headers.get('Authorization', '')
+        token_type, _, token = auth_header.partition(' ')
+        if token_type.lower() != 'bearer' or not token or not self.jwt_secret:
+            return ANONYMOUS
+        try:
+            payload = verify_token(token, self.jwt_secret, self.token_cache)
+        except jwt.InvalidTokenError:
+            return ANONYMOUS
+        return str(payload.get('user_id', ANONYMOUS))
+
+    def vary_key(self, headers) -> str:
+        parts = []
+        for dimension in self.vary:
+            if dimension.lower() == 'user':
+                parts.append(f"user={self._user_id(headers)}")
+            else:
+                value = ' '.join(headers.get(dimension, '').lower().split())
+                parts.append(f"{dimension.lower()}={value}")
+        return '&'.join(parts)
+
+    def build(self, path: str, query_string: Union[str, bytes], headers) -> str:
+        key = f"cache:{path}?{self.canonical_query(query_string)}"
+        if self.vary:
+            key = f"{key}|{self.vary_key(headers)}"
+        if len(key) > self.max_key_length:
+            key = f"cache:h:{hashlib.blake2b(key.encode('utf-8'), digest_size=20).hexdigest()}"
+        return key
@@ -0,0 +1,130 @@
+import logging
+import math
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from ..metrics import CONCURRENCY_LIMIT, CONCURRENCY_IN_FLIGHT, CONCURRENCY_SHED
+
+logger = logging.getLogger(__name__)
+
+
+class GradientLimit:
+    """
+    Concurrency limit of one service, adapted to its latency with the gradient method: the
+    limit shrinks as a short-term average of latencies rises above the long-term one, and
+    grows by about its square root per sample while latency holds steady. Failed calls back
+    the limit off multiplicatively.
+    """
+    def __init__(self, settings: Dict):
+        self.min_limit = settings.get('MIN_LIMIT', 2)
+        self.max_limit = settings.get('MAX_LIMIT', 200)
+        self.smoothing = settings.get('SMOOTHING', 0.2)
+        self.tolerance = settings.get('RTT_TOLERANCE', 1.5)
+        self.backoff_ratio = settings.get('BACKOFF_RATIO', 0.9)
+        self._short_alpha = 2 / (settings.get('SHORT_WINDOW', 10) + 1)
+        self._long_alpha = 2 / (settings.get('LONG_WINDOW', 600) + 1)
+        self.limit = float(settings.get('INITIAL_LIMIT', 20))
+        self.in_flight = 0
+        self._short_rtt: Optional[float] = None
+        self._long_rtt: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def acquire(self) -> bool:
+        with self._lock:
+            if self.in_flight >= int(self.limit):
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self, latency: Optional[float], failed: bool):
+        """Ends a call that took `latency` seconds. Calls without a latency only free their slot."""
+        with self._lock:
+            in_flight = self.in_flight
+            self.in_flight -= 1
+            if failed:
+                self.limit = max(self.min_limit, self.limit * self.backoff_ratio)
+            elif latency is not None:
+                self._on_sample(latency, in_flight)
+
+    def _on_sample(self, latency: float, in_flight: int):
+        if self._short_rtt is None:
+            self._short_rtt = self._long_rtt = latency
+        else:
+            self._short_rtt += self._short_alpha * (latency - self._short_rtt)
+            self._long_rtt += self._long_alpha * (latency - self._long_rtt)
+            # Let the baseline follow a lasting improvement instead of waiting out the long window.
+            if self._long_rtt > 2 * self._short_rtt:
+                self._long_rtt *= 0.95
+
+        # An underused limit says nothing about how much more the service can take.
+        if in_flight < self.limit / 2:
+            return
+
+        gradient = max(0.5, min(1.0, self.tolerance * self._long_rtt / max(self._short_rtt, 1e-6)))
+        new_limit = self.limit * gradient + math.sqrt(self.limit)
+        new_limit = self.limit * (1 - self.smoothing) + new_limit * self.smoothing
+        self.limit = max(self.min_limit, min(self.max_limit, new_limit))
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Caps the requests in flight to each upstream service at a limit adapted to its latency.
+    Requests over the limit are rejected immediately rather than queued behind a slow service.
+    """
+    def __init__(self, settings: Optional[Dict] = None):
+        self.settings = settings or {}
+        self.enabled = self.settings.get('ENABLED', False)
+        self.services = self.settings.get('SERVICES', [])
+        self.retry_after_seconds = self.settings.get('RETRY_AFTER_SECONDS', 1)
+        self._limits: Dict[str, GradientLimit] = {}
+        self._lock = threading.Lock()
+
+    def is_enabled(self, service_name: str) -> bool:
+        return self.enabled and (not self.services or service_name in self.services)
+
+    def _get_limit(self, service_name: str) -> GradientLimit:
+        limit = self._limits.get(service_name)
+        if limit is None:
+            with self._lock:
+                limit = self._limits.setdefault(service_name, GradientLimit(self.settings))
+            CONCURRENCY_LIMIT.labels(service_name).set(int(limit.limit))
+        return limit
+
+    def acquire(self, service_name: str) -> bool:
+        """Takes a slot for a request to the service, or returns False if the request is shed."""
+        limit = self._get_limit(service_name)
+        if not limit.acquire():
+            CONCURRENCY_SHED.labels(service_name).inc()
+            logger.warning(f"Shedding request to '{service_name}': {limit.in_flight} in flight at limit {int(limit.limit)}.")
+            return False
+        CONCURRENCY_IN_FLIGHT.labels(service_name).set(limit.in_flight)
+        return True
+
+    def release(self, service_name: str, latency: Optional[float], failed: bool):
+        limit = self._get_limit(service_name)
+        limit.release(latency, failed)
+        CONCURRENCY_IN_FLIGHT.labels(service_name).set(limit.in_flight)
+        CONCURRENCY_LIMIT.labels(service_name).set(int(limit.limit))
+
+
+class ConcurrencySlot:
+    """
+    A request's slot under its service's limit. The first release() gives it back with the
+    call's latency and outcome, taken from the (instance, latency, failed) upstream attempts.
+    """
+    def __init__(self, limiter: AdaptiveConcurrencyLimiter, service_name: str):
+        self.limiter = limiter
+        self.service_name = service_name
+        self.started = time.time()
+        self._released = False
+        self._lock = threading.Lock()
+
+    def release(self, attempts: Optional[List[Tuple[str, float, bool]]]):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        # Requests that never reached the service only give their slot back.
+        latency = time.time() - self.started if attempts else None
+        self.limiter.release(self.service_name, latency, failed=bool(attempts) and attempts[-1][2])
@@ -1,6 +1,7 @@
 from flask import jsonify, current_app, request
 from werkzeug.exceptions import HTTPException 
 from http import HTTPStatus
+import json
 import traceback
 
 class APIError(HTTPException):
@@ -8,13 +9,18 @@ class APIError(HTTPException):
     code = HTTPStatus.INTERNAL_SERVER_ERROR.value
     message = "An unexpected error occurred."
     
-    def __init__(self, message=None, code=None, payload=None):
+    def __init__(self, message=None, code=None, payload=None, headers=None):
         super().__init__(description=message)
         if message:
             self.message = message
         if code:
             self.code = code
         self.payload = payload
+        self.headers = headers or {}
+
+    def get_headers(self, environ=None, scope=None):
+        # Used by Flask-RESTx when it renders errors raised by resources.
+        return super().get_headers(environ, scope) + list(self.headers.items())
 
     def to_dict(self):
         rv = dict(self.payload or ())
@@ -52,6 +58,36 @@ class TooManyRequestsError(APIError):
     message = "Too many requests. Please try again after some time."
 
 
+UPSTREAM_STATUS_ERRORS = {
+    HTTPStatus.NOT_FOUND.value: NotFoundError,
+    HTTPStatus.BAD_REQUEST.value: BadRequestError,
+    HTTPStatus.UNAUTHORIZED.value: UnauthorizedError,
+    HTTPStatus.FORBIDDEN.value: ForbiddenError,
+    HTTPStatus.CONFLICT.value: ConflictError,
+    HTTPStatus.TOO_MANY_REQUESTS.value: TooManyRequestsError,
+}
+
+
+def upstream_error(status_code, body_text):
+    """
+    Maps an error response from a microservice to the matching APIError.
+    Uses the 'message' field of a JSON error body when there is one.
+    """
+    message = body_text if body_text else f"Error from microservice: {status_code}"
+
+    try:
+        error_details = json.loads(body_text)
+        if isinstance(error_details, dict):
+            message = error_details.get("message", message)
+    except (TypeError, ValueError):
+        pass
+
+    error_class = UPSTREAM_STATUS_ERRORS.get(status_code)
+    if error_class:
+        return error_class(message)
+    return APIError(message, status_code)
+
+
 def handle_api_error(e):
     """
     Handles custom APIError exceptions and returns a JSON response.
@@ -61,6 +97,7 @@ def handle_api_error(e):
         current_app.logger.warning(f"API Error ({e.code}): {e.message} - Path: {request.path}")
         response = jsonify(e.to_dict())
         response.status_code = e.code
+        response.headers.extend(e.headers)
     elif isinstance(e, HTTPException):
         current_app.logger.warning(f"HTTP Exception ({e.code}): {e.description} - Path: {request.path}")
         response = jsonify({
@@ -0,0 +1,199 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Dict, Optional, TypeVar
+
+from ..metrics import HEDGED_REQUESTS, HEDGE_WINS, HEDGE_BUDGET_EXHAUSTED
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+
+class HedgeBudget:
+    """
+    Token bucket that caps hedges to a fraction of primary requests.
+    Every primary request deposits `ratio` tokens, every hedge spends one.
+    """
+    def __init__(self, ratio: float, burst: float):
+        self.ratio = ratio
+        self.burst = burst
+        self._tokens = 0.0
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._tokens = min(self._tokens + self.ratio, self.burst)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class _LatencyWindow:
+    """Recent upstream latencies of one service, with a periodically recomputed percentile."""
+    RECOMPUTE_EVERY = 16
+
+    def __init__(self, size: int, percentile: float, min_samples: int):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=size)
+        self._since_recompute = 0
+        self._value: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def record(self, latency: float):
+        with self._lock:
+            self._samples.append(latency)
+            self._since_recompute += 1
+            if self._since_recompute >= self.RECOMPUTE_EVERY and len(self._samples) >= self.min_samples:
+                ordered = sorted(self._samples)
+                self._value = ordered[min(int(len(ordered) * self.percentile / 100), len(ordered) - 1)]
+                self._since_recompute = 0
+
+    @property
+    def value(self) -> Optional[float]:
+        return self._value
+
+
+class RequestHedger:
+    """
+    Sends a backup attempt for idempotent requests whose primary attempt has not answered
+    within the service's latency percentile, and returns whichever attempt answers first.
+    The losing attempt is closed once it completes.
+
+    Hedged primary attempts run on a pool of PRIMARY_MAX_WORKERS threads and backups on a
+    separate pool of MAX_WORKERS, so a primary never waits behind backups. Requests that cannot
+    be hedged, or that find every primary thread busy, run unhedged on the calling thread.
+    """
+    def __init__(self, settings: Optional[Dict] = None):
+        settings = settings or {}
+        self.enabled = settings.get('ENABLED', False)
+        self.services = settings.get('SERVICES', [])
+        self.delay_percentile = settings.get('DELAY_PERCENTILE', 95)
+        self.min_delay_seconds = settings.get('MIN_DELAY_SECONDS', 0.005)
+        self.min_samples = settings.get('MIN_SAMPLES', 50)
+        self.window_size = settings.get('WINDOW_SIZE', 1000)
+        self.budget_ratio = settings.get('BUDGET_RATIO', 0.05)
+        self.budget_burst = settings.get('BUDGET_BURST', 10)
+
+        self._windows: Dict[str, _LatencyWindow] = {}
+        self._budgets: Dict[str, HedgeBudget] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=settings.get('MAX_WORKERS', 64),
+                                            thread_name_prefix='upstream-hedge') if self.enabled else None
+        primary_workers = settings.get('PRIMARY_MAX_WORKERS', 64)
+        # Held while a primary runs, so submitted primaries never queue behind busy threads.
+        self._primary_slots = threading.BoundedSemaphore(primary_workers)
+        self._primary_executor = ThreadPoolExecutor(max_workers=primary_workers,
+                                                    thread_name_prefix='upstream-hedge-primary') if self.enabled else None
+
+    def is_enabled(self, service_name: str) -> bool:
+        return self.enabled and (not self.services or service_name in self.services)
+
+    def _get_state(self, service_name: str):
+        window = self._windows.get(service_name)
+        if window is None:
+            with self._lock:
+                window = self._windows.get(service_name)
+                if window is None:
+                    self._budgets[service_name] = HedgeBudget(self.budget_ratio, self.budget_burst)
+                    window = _LatencyWindow(self.window_size, self.delay_percentile, self.min_samples)
+                    self._windows[service_name] = window
+        return window, self._budgets[service_name]
+
+    def hedge_delay(self, service_name: str) -> Optional[float]:
+        """Seconds to wait for the primary attempt, or None while there are too few samples."""
+        window, _ = self._get_state(service_name)
+        if window.value is None:
+            return None
+        return max(window.value, self.min_delay_seconds)
+
+    def _timed(self, service_name: str, attempt: Callable[[], T]) -> Callable[[], T]:
+        window, _ = self._get_state(service_name)
+
+        def run():
+            start = time.time()
+            result = attempt()
+            window.record(time.time() - start)
+            return result
+        return run
+
+    def _start_primary(self, attempt: Callable[[], T], started: threading.Event) -> "Optional[Future[T]]":
+        """
+        Runs a primary attempt on the primary pool, setting `started` once it is underway.
+        Returns None without running it if every primary thread is busy.
+        """
+        if not self._primary_slots.acquire(blocking=False):
+            return None
+
+        def run():
+            started.set()
+            try:
+                return attempt()
+            finally:
+                self._primary_slots.release()
+        return self._primary_executor.submit(run)
+
+    def execute(self, service_name: str, primary: Callable[[], T], backup: Optional[Callable[[], T]],
+                close: Callable[[T], None]) -> T:
+        """
+        Runs `primary`, hedging with `backup` if allowed. Attempts that raise are ignored
+        as long as the other one answers; `close` releases the result of the losing attempt.
+        """
+        _, budget = self._get_state(service_name)
+        budget.deposit()
+        delay = self.hedge_delay(service_name)
+        if backup is None or delay is None:
+            return self._timed(service_name, primary)()
+
+        started = threading.Event()
+        first = self._start_primary(self._timed(service_name, primary), started)
+        if first is None:
+            logger.debug(f"Not hedging request to '{service_name}': all primary threads are busy.")
+            return self._timed(service_name, primary)()
+        # The hedge delay counts from when the primary attempt got going, not from when it was queued.
+        started.wait()
+        done, _ = wait([first], timeout=delay)
+        if done:
+            return first.result()
+        if not budget.withdraw():
+            HEDGE_BUDGET_EXHAUSTED.labels(service_name).inc()
+            return first.result()
+
+        HEDGED_REQUESTS.labels(service_name).inc()
+        logger.debug(f"Hedging request to '{service_name}' after {delay:.3f}s.")
+        second = self._executor.submit(self._timed(service_name, backup))
+
+        winner = None
+        error = None
+        pending = {first, second}
+        while pending and winner is None:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = error or future.exception()
+                elif winner is None:
+                    winner = future
+                else:
+                    close(future.result())
+
+        for future in pending:
+            future.add_done_callback(lambda f: close(f.result()) if f.exception() is None else None)
+
+        if winner is None:
+            raise error
+        if winner is second:
+            HEDGE_WINS.labels(service_name).inc()
+        return winner.result()
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        if self._primary_executor is not None:
+            self._primary_executor.shutdown(wait=False)
@@ -0,0 +1,212 @@
+import logging
+import threading
+import time
+from functools import partial
+from typing import Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from ..metrics import (
+    UPSTREAM_POOL_CHECKED_OUT,
+    UPSTREAM_POOL_IDLE,
+    UPSTREAM_POOL_CONNECTIONS_CREATED,
+    UPSTREAM_POOL_CONNECTIONS_CLOSED,
+    UPSTREAM_CONNECT_LATENCY,
+    UPSTREAM_TTFB,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class _UpstreamConnectionMixin:
+    """
+    Tracks the age and idle time of a single keep-alive connection and
+    reports opens/closes to the pool metrics. Connect time and time to first
+    byte are timed separately: TTFB starts once the request has been written.
+    """
+    metric_labels = ('unknown', 'unknown')
+    created_at = 0.0
+    last_used = 0.0
+    request_sent_at = 0.0
+    idle = False
+    checked_out = False
+
+    def connect(self):
+        started = time.perf_counter()
+        super().connect()
+        UPSTREAM_CONNECT_LATENCY.labels(*self.metric_labels).observe(time.perf_counter() - started)
+        self.created_at = self.last_used = time.monotonic()
+        UPSTREAM_POOL_CONNECTIONS_CREATED.labels(*self.metric_labels).inc()
+
+    def request(self, *args, **kwargs):
+        super().request(*args, **kwargs)
+        self.request_sent_at = time.perf_counter()
+
+    def getresponse(self, *args, **kwargs):
+        # Returns once the response headers are in; the body is read later.
+        response = super().getresponse(*args, **kwargs)
+        UPSTREAM_TTFB.labels(*self.metric_labels).observe(time.perf_counter() - self.request_sent_at)
+        return response
+
+    def close(self):
+        if self.idle:
+            self.idle = False
+            UPSTREAM_POOL_IDLE.labels(*self.metric_labels).dec()
+        if self.checked_out:
+            # Discarded mid-request: urllib3 hands the pool None instead.
+            self.checked_out = False
+            UPSTREAM_POOL_CHECKED_OUT.labels(*self.metric_labels).dec()
+        if self.sock is not None:
+            UPSTREAM_POOL_CONNECTIONS_CLOSED.labels(*self.metric_labels).inc()
+        super().close()
+
+
+class UpstreamHTTPConnection(_UpstreamConnectionMixin, HTTPConnection):
+    pass
+
+
+class UpstreamHTTPSConnection(_UpstreamConnectionMixin, HTTPSConnection):
+    pass
+
+
+class _UpstreamConnectionPoolMixin:
+    """
+    urllib3 connection pool for a single upstream instance that closes
+    connections which outlived the idle timeout or the maximum lifetime
+    before handing them out again.
+    """
+    def __init__(self, *args, service_name: str = 'unknown', idle_timeout: Optional[float] = None,
+                 max_lifetime: Optional[float] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.service_name = service_name
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.metric_labels = (service_name, f"{self.host}:{self.port}")
+
+    def _new_conn(self):
+        conn = super()._new_conn()
+        conn.metric_labels = self.metric_labels
+        return conn
+
+    def _get_conn(self, timeout=None):
+        conn = super()._get_conn(timeout=timeout)
+
+        if conn.idle:
+            conn.idle = False
+            UPSTREAM_POOL_IDLE.labels(*self.metric_labels).dec()
+
+        if conn.sock is not None:
+            now = time.monotonic()
+            if self.max_lifetime and now - conn.created_at > self.max_lifetime:
+                logger.debug(f"Recycling upstream connection to {self.metric_labels[1]}: max lifetime exceeded.")
+                conn.close()
+            elif self.idle_timeout and now - conn.last_used > self.idle_timeout:
+                logger.debug(f"Recycling upstream connection to {self.metric_labels[1]}: idle timeout exceeded.")
+                conn.close()
+
+        conn.checked_out = True
+        UPSTREAM_POOL_CHECKED_OUT.labels(*self.metric_labels).inc()
+        return conn
+
+    def _put_conn(self, conn):
+        # urllib3 also calls this with None after a failed checkout, so only
+        # connections flagged by _get_conn are counted back in.
+        if conn is not None and conn.checked_out:
+            conn.checked_out = False
+            UPSTREAM_POOL_CHECKED_OUT.labels(*self.metric_labels).dec()
+        # A connection returned to a disposed pool is closed, not queued.
+        if conn is not None and conn.sock is not None and self.pool is not None:
+            conn.last_used = time.monotonic()
+            conn.idle = True
+            UPSTREAM_POOL_IDLE.labels(*self.metric_labels).inc()
+        super()._put_conn(conn)
+
+
+class UpstreamHTTPConnectionPool(_UpstreamConnectionPoolMixin, HTTPConnectionPool):
+    ConnectionCls = UpstreamHTTPConnection
+
+
+class UpstreamHTTPSConnectionPool(_UpstreamConnectionPoolMixin, HTTPSConnectionPool):
+    ConnectionCls = UpstreamHTTPSConnection
+
+
+class UpstreamHTTPAdapter(HTTPAdapter):
+    """
+    requests adapter that builds instrumented, lifetime-aware connection pools.
+    The pool manager keeps one connection pool per upstream instance (host:port).
+    """
+    def __init__(self, service_name: str, idle_timeout: Optional[float] = None,
+                 max_lifetime: Optional[float] = None, **kwargs):
+        self._pool_options = {
+            'service_name': service_name,
+            'idle_timeout': idle_timeout,
+            'max_lifetime': max_lifetime,
+        }
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': partial(UpstreamHTTPConnectionPool, **self._pool_options),
+            'https': partial(UpstreamHTTPSConnectionPool, **self._pool_options),
+        }
+        # urllib3 2.x no longer closes evicted pools; close them so idle sockets of
+        # instances that left the rotation are released.
+        self.poolmanager.pools.dispose_func = lambda pool: pool.close()
+
+
+class UpstreamSessionPool:
+    """
+    Keeps one keep-alive requests.Session per upstream service so proxied calls
+    reuse TCP connections instead of opening a new one per request.
+    """
+    def __init__(self, settings: Dict):
+        self.pool_connections = settings.get('POOL_CONNECTIONS', 10)
+        self.pool_maxsize = settings.get('POOL_MAXSIZE', 20)
+        self.pool_block = settings.get('POOL_BLOCK', False)
+        self.idle_timeout = settings.get('IDLE_TIMEOUT_SECONDS', 30)
+        self.max_lifetime = settings.get('MAX_LIFETIME_SECONDS', 300)
+        self._sessions: Dict[str, requests.Session] = {}
+        self._lock = threading.Lock()
+        logger.info(f"UpstreamSessionPool initialized (maxsize={self.pool_maxsize}, idle_timeout={self.idle_timeout}s, max_lifetime={self.max_lifetime}s).")
+
+    def _create_session(self, service_name: str) -> requests.Session:
+        adapter = UpstreamHTTPAdapter(
+            service_name,
+            idle_timeout=self.idle_timeout,
+            max_lifetime=self.max_lifetime,
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            pool_block=self.pool_block,
+        )
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def get_session(self, service_name: str) -> requests.Session:
+        """Returns the pooled session for a service, creating it on first use."""
+        session = self._sessions.get(service_name)
+        if session is None:
+            with self._lock:
+                session = self._sessions.get(service_name)
+                if session is None:
+                    session = self._create_session(service_name)
+                    self._sessions[service_name] = session
+                    logger.info(f"Created pooled upstream session for service '{service_name}'.")
+        return session
+
+    def request(self, service_name: str, method: str, url: str, **kwargs) -> requests.Response:
+        """Sends a request to an upstream service over its pooled session."""
+        return self.get_session(service_name).request(method=method, url=url, **kwargs)
+
+    def close(self):
+        """Closes every pooled session and their idle connections."""
+        with self._lock:
+            for service_name, session in self._sessions.items():
+                session.close()
+                logger.info(f"Closed pooled upstream session for service '{service_name}'.")
+            self._sessions = {}
@@ -0,0 +1,143 @@
+import itertools
+import logging
+import math
+import random
+import threading
+import time
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class InstanceStats:
+    """
+    Tracks in-flight requests and a time-decayed latency EWMA per upstream instance.
+    Fed by the proxy layer around every upstream call.
+    """
+    def __init__(self, decay_seconds: float = 10.0, failure_penalty_seconds: float = 2.0):
+        self.decay_seconds = decay_seconds
+        self.failure_penalty_seconds = failure_penalty_seconds
+        self._lock = threading.Lock()
+        self._in_flight: Dict[str, int] = {}
+        self._ewma: Dict[str, float] = {}
+        self._last_update: Dict[str, float] = {}
+
+    def on_request_start(self, instance: str):
+        with self._lock:
+            self._in_flight[instance] = self._in_flight.get(instance, 0) + 1
+
+    def on_request_end(self, instance: str, latency: float, failed: bool = False):
+        if failed:
+            latency = max(latency, self.failure_penalty_seconds)
+        now = time.monotonic()
+        with self._lock:
+            self._in_flight[instance] = max(self._in_flight.get(instance, 1) - 1, 0)
+            previous = self._ewma.get(instance)
+            if previous is None:
+                self._ewma[instance] = latency
+            else:
+                weight = math.exp(-(now - self._last_update[instance]) / self.decay_seconds)
+                self._ewma[instance] = previous * weight + latency * (1 - weight)
+            self._last_update[instance] = now
+
+    def in_flight(self, instance: str) -> int:
+        return self._in_flight.get(instance, 0)
+
+    def latency(self, instance: str) -> float:
+        """Latency EWMA in seconds; 0 for instances without samples so they get tried."""
+        return self._ewma.get(instance, 0.0)
+
+
+class RandomBalancer:
+    def __init__(self, stats: InstanceStats):
+        self.stats = stats
+
+    def choose(self, instances: List[str]) -> str:
+        return random.choice(instances)
+
+
+class RoundRobinBalancer:
+    def __init__(self, stats: InstanceStats):
+        self.stats = stats
+        self._counter = itertools.count()
+
+    def choose(self, instances: List[str]) -> str:
+        return instances[next(self._counter) % len(instances)]
+
+
+class LeastOutstandingBalancer:
+    """Picks the instance with the fewest in-flight requests, breaking ties randomly."""
+    def __init__(self, stats: InstanceStats):
+        self.stats = stats
+
+    def choose(self, instances: List[str]) -> str:
+        fewest = min(self.stats.in_flight(instance) for instance in instances)
+        return random.choice([instance for instance in instances if self.stats.in_flight(instance) == fewest])
+
+
+class PowerOfTwoEwmaBalancer:
+    """
+    Power of two choices: samples two instances and picks the one with the lower
+    latency EWMA weighted by its in-flight requests.
+    """
+    def __init__(self, stats: InstanceStats):
+        self.stats = stats
+
+    def _cost(self, instance: str) -> float:
+        return self.stats.latency(instance) * (self.stats.in_flight(instance) + 1)
+
+    def choose(self, instances: List[str]) -> str:
+        if len(instances) == 1:
+            return instances[0]
+        first, second = random.sample(instances, 2)
+        return first if self._cost(first) <= self._cost(second) else second
+
+
+BALANCER_STRATEGIES = {
+    'random': RandomBalancer,
+    'round_robin': RoundRobinBalancer,
+    'least_outstanding': LeastOutstandingBalancer,
+    'p2c_ewma': PowerOfTwoEwmaBalancer,
+}
+
+
+class ServiceLoadBalancer:
+    """
+    Chooses an upstream instance per service using the strategy configured for that service.
+    All strategies share one InstanceStats, which the proxy layer updates.
+    """
+    def __init__(self, settings: Optional[Dict] = None):
+        settings = settings or {}
+        self.default_strategy = settings.get('DEFAULT_STRATEGY', 'random')
+        self.service_strategies = settings.get('SERVICE_STRATEGIES', {})
+        self.stats = InstanceStats(
+            decay_seconds=settings.get('EWMA_DECAY_SECONDS', 10.0),
+            failure_penalty_seconds=settings.get('FAILURE_PENALTY_SECONDS', 2.0),
+        )
+        self._balancers: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+        for strategy in [self.default_strategy, *self.service_strategies.values()]:
+            if strategy not in BALANCER_STRATEGIES:
+                raise ValueError(f"Unknown load balancing strategy '{strategy}'. Expected one of: {', '.join(BALANCER_STRATEGIES)}.")
+
+    def _get_balancer(self, service_name: str):
+        balancer = self._balancers.get(service_name)
+        if balancer is None:
+            with self._lock:
+                balancer = self._balancers.get(service_name)
+                if balancer is None:
+                    strategy = self.service_strategies.get(service_name, self.default_strategy)
+                    balancer = BALANCER_STRATEGIES[strategy](self.stats)
+                    self._balancers[service_name] = balancer
+                    logger.info(f"Using '{strategy}' load balancing for service '{service_name}'.")
+        return balancer
+
+    def choose(self, service_name: str, instances: List[str]) -> str:
+        return self._get_balancer(service_name).choose(instances)
+
+    def on_request_start(self, instance: str):
+        self.stats.on_request_start(instance)
+
+    def on_request_end(self, instance: str, latency: float, failed: bool = False):
+        self.stats.on_request_end(instance, latency, failed)
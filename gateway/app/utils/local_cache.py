@@ -0,0 +1,70 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+from ..metrics import CACHE_L1_SIZE_BYTES, CACHE_L1_EVICTIONS
+
+
+class LocalLRUCache:
+    """
+    Thread-safe in-process LRU cache bounded by the total size of its entries.
+    Entries expire after `ttl_seconds`; the least recently used ones are evicted
+    once `max_bytes` is exceeded. Entries larger than `max_item_bytes` are not stored.
+    """
+    def __init__(self, max_bytes: int, ttl_seconds: float, max_item_bytes: Optional[int] = None):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.max_item_bytes = max_item_bytes or max_bytes
+        self._entries: "OrderedDict[str, Tuple[Any, int, float]]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def _remove(self, key: str):
+        _, size, _ = self._entries.pop(key)
+        self._size -= size
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, _, expires_at = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                CACHE_L1_SIZE_BYTES.set(self._size)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, size: int, ttl_seconds: Optional[float] = None) -> bool:
+        """Stores `value` as taking `size` bytes. Returns False if it is too large to keep."""
+        if size > self.max_item_bytes:
+            return False
+        ttl = self.ttl_seconds if ttl_seconds is None else min(ttl_seconds, self.ttl_seconds)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, time.monotonic() + ttl)
+            self._size += size
+            while self._size > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+                CACHE_L1_EVICTIONS.inc()
+            CACHE_L1_SIZE_BYTES.set(self._size)
+        return True
+
+    def delete(self, key: str):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+                CACHE_L1_SIZE_BYTES.set(self._size)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            CACHE_L1_SIZE_BYTES.set(0)
+
+    def __len__(self) -> int:
+        return len(self._entries)
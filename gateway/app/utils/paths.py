@@ -0,0 +1,9 @@
+from typing import Optional, Tuple
+
+
+def split_proxy_path(path: str) -> Optional[Tuple[str, str]]:
+    """Splits '/proxy/<service_name>/<path>' into the service name and '/<path>', or returns None."""
+    path_parts = path.split('/', 3)
+    if len(path_parts) < 3 or path_parts[1] != 'proxy' or not path_parts[2]:
+        return None
+    return path_parts[2], '/' + (path_parts[3] if len(path_parts) > 3 else '')
@@ -0,0 +1,203 @@
+import hashlib
+import ipaddress
+import math
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Container, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from ..metrics import RATE_LIMIT_LOCAL_CLIENTS, RATE_LIMIT_LOCAL_MEMORY_BYTES, RATE_LIMIT_LOCAL_EVICTIONS
+
+# (allowed, remaining, retry after seconds, seconds until the client's allowance is full again)
+RateLimitDecision = Tuple[bool, int, float, float]
+
+# Approximate footprint of one tracked client besides its key: the counters list, its float
+# and its OrderedDict slot and links.
+_CLIENT_ENTRY_BYTES = sys.getsizeof([0, 0, 0, 0.0]) + 24 + 104
+
+
+def sliding_window_decision(limit: int, window_seconds: float, elapsed: float,
+                            previous: int, current: int) -> RateLimitDecision:
+    """
+    Sliding window counter: the previous fixed window's count is weighted by how much of it
+    still overlaps the last `window_seconds`. `elapsed` is the time into the current window;
+    the counts do not include the request being decided.
+    """
+    estimate = previous * (1 - elapsed / window_seconds) + current
+    if estimate + 1 <= limit:
+        return True, int(math.floor(limit - estimate - 1)), 0.0, 2 * window_seconds - elapsed
+
+    if current + 1 <= limit:
+        # Allowed again once enough of the previous window has slid out.
+        retry_after = (1 - (limit - 1 - current) / previous) * window_seconds - elapsed
+    else:
+        # Allowed again once the current window has become the previous one and slid out far enough.
+        retry_after = window_seconds - elapsed + (1 - (limit - 1) / current) * window_seconds
+    reset_after = (2 if current else 1) * window_seconds - elapsed
+    return False, 0, max(retry_after, 0.0), reset_after
+
+
+class SlidingWindowRateLimiter:
+    """
+    In-process sliding window counter limiter, for the local backend and while Redis is
+    unreachable. Each request costs O(1) and each client key a fixed amount of memory; at
+    most `max_clients` are tracked, evicting the least recently seen. Limits are per
+    process, so N workers together admit up to N times the configured rate.
+    """
+    def __init__(self, max_clients: int):
+        self.max_clients = max_clients
+        # key -> [window index, previous window count, current window count, expiry], least recently seen first
+        self._clients: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+
+    def hit(self, key: str, limit: int, window_seconds: float, now: Optional[float] = None) -> RateLimitDecision:
+        now = time.time() if now is None else now
+        window = int(now // window_seconds)
+        elapsed = now - window * window_seconds
+        with self._lock:
+            counters = self._clients.get(key)
+            if counters is None:
+                counters = self._clients[key] = [window, 0, 0, 0.0]
+                self._memory_bytes += sys.getsizeof(key) + _CLIENT_ENTRY_BYTES
+            else:
+                self._clients.move_to_end(key)
+                if counters[0] != window:
+                    counters[1] = counters[2] if counters[0] == window - 1 else 0
+                    counters[0], counters[2] = window, 0
+
+            decision = sliding_window_decision(limit, window_seconds, elapsed, counters[1], counters[2])
+            if decision[0]:
+                counters[2] += 1
+            # Once two windows have passed the counters hold nothing worth keeping.
+            counters[3] = (window + 2) * window_seconds
+            self._trim(now)
+        return decision
+
+    def _trim(self, now: float):
+        # Idle clients sit at the front, so expired ones are dropped there without a sweep.
+        while self._clients:
+            key, counters = next(iter(self._clients.items()))
+            expired = counters[3] <= now
+            if not expired and len(self._clients) <= self.max_clients:
+                break
+            self._clients.popitem(last=False)
+            self._memory_bytes -= sys.getsizeof(key) + _CLIENT_ENTRY_BYTES
+            if not expired:
+                RATE_LIMIT_LOCAL_EVICTIONS.inc()
+        RATE_LIMIT_LOCAL_CLIENTS.set(len(self._clients))
+        RATE_LIMIT_LOCAL_MEMORY_BYTES.set(self._memory_bytes)
+
+
+ANY = '*'
+
+
+def compile_rate_limit_rule(rule: Dict[str, Any], name: str) -> Dict[str, Any]:
+    limit = rule['limit']
+    window_seconds = rule['window_seconds']
+    return {
+        'name': rule.get('name', name),
+        'limit': limit,
+        'window_seconds': window_seconds,
+        'burst': rule.get('burst') or limit,
+        'emission_interval': window_seconds / limit,
+    }
+
+
+def _route_depth(route: str) -> int:
+    return len([part for part in route.split('/') if part])
+
+
+class RateLimitRules:
+    """
+    Rate limit rules compiled into a table keyed by (route prefix, method, identity kind).
+    A request is resolved with a few lookups per path segment however many rules there are:
+    the longest matching route wins, then an exact method over any, then an exact identity
+    kind over any. Requests no rule matches get `default`.
+
+    A rule has `limit` and `window_seconds`, optionally `burst`, `name`, and any of `route`
+    (a path prefix, matched on segment boundaries) or `service` (all of /proxy/<service>),
+    `methods` and `identities` ('api_key', 'user' or 'ip'). Omitted matchers match anything.
+    """
+    def __init__(self, rules: Iterable[Dict[str, Any]], default: Dict[str, Any]):
+        self.default = compile_rate_limit_rule(default, 'default')
+        self._table: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+        depths = set()
+        for index, rule in enumerate(rules):
+            compiled = compile_rate_limit_rule(rule, f"rule{index}")
+            route = rule.get('route') or (f"/proxy/{rule['service']}" if rule.get('service') else ANY)
+            if route != ANY:
+                route = '/' + '/'.join(part for part in route.split('/') if part)
+                depths.add(_route_depth(route))
+            for method in rule.get('methods') or [ANY]:
+                for identity_kind in rule.get('identities') or [ANY]:
+                    # Earlier rules win over later ones with the same matchers.
+                    self._table.setdefault((route, method.upper(), identity_kind), compiled)
+        self._depths = sorted(depths, reverse=True)
+
+    def _candidate_routes(self, path: str) -> List[str]:
+        parts = [part for part in path.split('/') if part]
+        routes = ['/' + '/'.join(parts[:depth]) for depth in self._depths if depth <= len(parts)]
+        routes.append(ANY)
+        return routes
+
+    def resolve(self, path: str, method: str, identity_kind: str) -> Dict[str, Any]:
+        for route in self._candidate_routes(path):
+            for rule_method in (method, ANY):
+                for rule_identity in (identity_kind, ANY):
+                    rule = self._table.get((route, rule_method, rule_identity))
+                    if rule is not None:
+                        return rule
+        return self.default
+
+
+def parse_trusted_proxies(proxies: Iterable[str]) -> List[Any]:
+    return [ipaddress.ip_network(proxy.strip(), strict=False) for proxy in proxies if proxy.strip()]
+
+
+def _is_trusted(address: str, trusted_networks: List[Any]) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in trusted_networks)
+
+
+def client_ip(remote_addr: str, forwarded_for: Optional[str], trusted_networks: List[Any]) -> str:
+    """
+    The client address: X-Forwarded-For is only believed when the peer is a trusted proxy,
+    and then read right to left up to the first hop that is not a trusted proxy itself.
+    """
+    if not forwarded_for or not trusted_networks or not _is_trusted(remote_addr, trusted_networks):
+        return remote_addr
+    hops = [hop.strip() for hop in forwarded_for.split(',') if hop.strip()]
+    for hop in reversed(hops):
+        if not _is_trusted(hop, trusted_networks):
+            return hop
+    return hops[0] if hops else remote_addr
+
+
+def api_key_digest(api_key: str) -> str:
+    # Keys are credentials; only a digest is kept in memory and ends up in Redis.
+    return hashlib.blake2b(api_key.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def parse_api_keys(api_keys: Iterable[str]) -> FrozenSet[str]:
+    return frozenset(api_key_digest(key.strip()) for key in api_keys if key.strip())
+
+
+def request_identity(api_key: Optional[str], user: Optional[Dict[str, Any]], ip: str,
+                     known_api_keys: Container[str] = frozenset()) -> Tuple[str, str]:
+    """
+    Returns (identity kind, identity) for a request: its API key, else its JWT subject, else its IP.
+    Only keys whose digest is in `known_api_keys` count; anyone can make up a fresh unknown key
+    per request, so those are limited like requests without one.
+    """
+    if api_key:
+        digest = api_key_digest(api_key)
+        if digest in known_api_keys:
+            return 'api_key', digest
+    if user and user.get('user_id') is not None:
+        return 'user', str(user['user_id'])
+    return 'ip', ip
@@ -0,0 +1,114 @@
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
+
+from .paths import split_proxy_path
+
+PREFIX_SUFFIX = '/<path:path>'
+
+# Route classes, each with its own middleware pipeline: proxied requests, the gateway's own
+# health and metrics endpoints, and everything else (docs, the root listing).
+ROUTE_PROXY = 'proxy'
+ROUTE_INTERNAL = 'internal'
+ROUTE_OTHER = 'other'
+ROUTE_CLASSES = (ROUTE_PROXY, ROUTE_INTERNAL, ROUTE_OTHER)
+
+
+class RouteMatch(NamedTuple):
+    """What the middlewares need to know about a request path, worked out once per request."""
+    route_class: str
+    auth_exempt: bool
+    # False for paths in CACHE_EXCLUDED_PATHS; the method is checked by the caching middleware.
+    cacheable: bool
+    # The CACHE_ROUTE_POLICIES prefix that applies, or None for the default policy.
+    cache_route: Optional[str]
+    # For /proxy/<service_name>/<path>: the service, '/<path>' and the breaker guarding the service.
+    service_name: Optional[str]
+    resource_path: Optional[str]
+    breaker_name: Optional[str]
+
+
+class _Node:
+    __slots__ = ('children', 'auth_exempt', 'cache_excluded', 'cache_route')
+
+    def __init__(self):
+        self.children: Dict[str, '_Node'] = {}
+        self.auth_exempt = False
+        self.cache_excluded = False
+        self.cache_route: Optional[str] = None
+
+
+def _segments(path: str) -> List[str]:
+    return [part for part in path.split('/') if part]
+
+
+class RouteClassifier:
+    """
+    Classifies request paths into route classes and against the auth and cache exclusions and
+    the cache route policies, compiled at startup into a trie of path segments plus a table
+    of exact paths.
+
+    Exclusion patterns ending in '/<path:path>' cover their base path and everything below it
+    on segment boundaries; all other patterns must match exactly. Cache policy prefixes match
+    on segment boundaries too, the longest one winning.
+    """
+    def __init__(self, auth_exempt_paths: Iterable[str], cache_excluded_paths: Iterable[str],
+                 cache_route_prefixes: Iterable[str], internal_paths: Iterable[str] = ()):
+        self._root = _Node()
+        internal_paths = set(internal_paths)
+        auth_exact, cache_exact = set(), set()
+        for pattern in auth_exempt_paths:
+            if pattern.endswith(PREFIX_SUFFIX):
+                self._node(pattern[:-len(PREFIX_SUFFIX)]).auth_exempt = True
+            else:
+                auth_exact.add(pattern)
+        for pattern in cache_excluded_paths:
+            if pattern.endswith(PREFIX_SUFFIX):
+                self._node(pattern[:-len(PREFIX_SUFFIX)]).cache_excluded = True
+            else:
+                cache_exact.add(pattern)
+        for prefix in cache_route_prefixes:
+            self._node(prefix).cache_route = prefix
+
+        # Exact paths are classified here once and then served by a single lookup.
+        self._exact: Dict[str, RouteMatch] = {}
+        for path in auth_exact | cache_exact | internal_paths:
+            match = self._walk(path)
+            self._exact[path] = match._replace(route_class=ROUTE_INTERNAL if path in internal_paths else match.route_class,
+                                               auth_exempt=match.auth_exempt or path in auth_exact,
+                                               cacheable=match.cacheable and path not in cache_exact)
+
+    def _node(self, path: str) -> _Node:
+        node = self._root
+        for segment in _segments(path):
+            node = node.children.setdefault(segment, _Node())
+        return node
+
+    def _walk(self, path: str) -> RouteMatch:
+        node = self._root
+        auth_exempt, cache_excluded, cache_route = node.auth_exempt, node.cache_excluded, node.cache_route
+        for segment in _segments(path):
+            node = node.children.get(segment)
+            if node is None:
+                break
+            auth_exempt = auth_exempt or node.auth_exempt
+            cache_excluded = cache_excluded or node.cache_excluded
+            cache_route = node.cache_route or cache_route
+
+        proxy_target = split_proxy_path(path)
+        if proxy_target is None:
+            return RouteMatch(ROUTE_OTHER, auth_exempt, not cache_excluded, cache_route, None, None, None)
+        service_name, resource_path = proxy_target
+        return RouteMatch(ROUTE_PROXY, auth_exempt, not cache_excluded, cache_route, service_name, resource_path, service_name)
+
+    def classify(self, path: str) -> RouteMatch:
+        match = self._exact.get(path)
+        return match if match is not None else self._walk(path)
+
+
+def build_route_classifier(config: Any) -> RouteClassifier:
+    return RouteClassifier(
+        # The root lists the gateway's endpoints and is always public.
+        ['/', *config.get('AUTH_EXCLUDED_PATHS', [])],
+        config.get('CACHE_EXCLUDED_PATHS', []),
+        config.get('CACHE_ROUTE_POLICIES', {}),
+        config.get('INTERNAL_PATHS', []),
+    )
@@ -1,15 +1,43 @@
 import consul
 import logging
-import random
-from typing import Optional, List
+import threading
+import time
+from typing import Callable, Optional, List, Dict
+
+from .load_balancer import ServiceLoadBalancer
+from ..metrics import (
+    SERVICE_DISCOVERY_INSTANCES,
+    SERVICE_DISCOVERY_CACHE_AGE,
+    SERVICE_DISCOVERY_STALE,
+    SERVICE_DISCOVERY_REFRESH_ERRORS,
+)
 
 logger = logging.getLogger(__name__)
 
 class ConsulServiceDiscovery:
     """
     Client for interacting with Consul for service discovery.
+
+    Healthy instances of watched services are kept in an in-memory table. A background thread
+    per service keeps the table current with Consul blocking queries, so lookups never call
+    Consul. If Consul becomes unreachable, the last known good instances keep being served,
+    until they are older than `EXPIRE_AFTER_SECONDS` if that is set.
     """
-    def __init__(self, host: str, port: int):
+    def __init__(self, host: str, port: int, services: Optional[List[str]] = None, settings: Optional[Dict] = None,
+                 load_balancer: Optional[ServiceLoadBalancer] = None):
+        settings = settings or {}
+        self.load_balancer = load_balancer or ServiceLoadBalancer()
+        self.watch_wait = settings.get('WATCH_WAIT', '55s')
+        self.stale_after_seconds = settings.get('STALE_AFTER_SECONDS', 120)
+        self.expire_after_seconds = settings.get('EXPIRE_AFTER_SECONDS', 0)
+        self.max_retry_backoff_seconds = settings.get('MAX_RETRY_BACKOFF_SECONDS', 30)
+
+        self._instances: Dict[str, List[str]] = {}
+        self._last_refresh: Dict[str, float] = {}
+        self._watchers: Dict[str, threading.Thread] = {}
+        self._watch_lock = threading.Lock()
+        self._stop_event = threading.Event()
+
         try:
             self.consul_client = consul.Consul(host=host, port=port)
             self.consul_client.agent.self()
@@ -18,33 +46,120 @@ class ConsulServiceDiscovery:
             self.consul_client = None
             logger.error(f"Failed to connect to Consul at {host}:{port}: {e}", exc_info=True)
 
-    def get_service_address(self, service_name: str) -> Optional[str]:
+        for service_name in services or []:
+            self.watch_service(service_name)
+
+    def _store_instances(self, service_name: str, services: List[Dict]):
+        self._instances[service_name] = [
+            f"http://{instance['Service']['Address']}:{instance['Service']['Port']}" for instance in services
+        ]
+        self._last_refresh[service_name] = time.time()
+        SERVICE_DISCOVERY_INSTANCES.labels(service_name).set(len(services))
+
+    def _cache_age(self, service_name: str) -> float:
+        last_refresh = self._last_refresh.get(service_name)
+        return time.time() - last_refresh if last_refresh else float('inf')
+
+    def _watch_loop(self, service_name: str):
+        """Long-polls Consul for changes to a service's healthy instances."""
+        index = None
+        backoff = 1
+        while not self._stop_event.is_set():
+            try:
+                new_index, services = self.consul_client.health.service(
+                    service_name, passing=True, index=index, wait=self.watch_wait
+                )
+                # Consul may reset its index (e.g. after a restart); start over rather than block forever.
+                if index is not None and new_index is not None and int(new_index) < int(index):
+                    new_index = None
+                if new_index != index:
+                    logger.debug(f"Consul reported {len(services)} healthy instance(s) for '{service_name}' (index {new_index}).")
+                self._store_instances(service_name, services)
+                index = new_index
+                backoff = 1
+            except Exception as e:
+                SERVICE_DISCOVERY_REFRESH_ERRORS.labels(service_name).inc()
+                logger.warning(f"Failed to refresh instances of '{service_name}' from Consul: {e}. "
+                               f"Serving last known instances; retrying in {backoff}s.")
+                index = None
+                self._stop_event.wait(backoff)
+                backoff = min(backoff * 2, self.max_retry_backoff_seconds)
+
+    def watch_service(self, service_name: str):
+        """Loads the instances of a service once and keeps them current in a background thread."""
+        if not self.consul_client or service_name in self._watchers:
+            return
+
+        with self._watch_lock:
+            if service_name in self._watchers:
+                return
+
+            try:
+                _, services = self.consul_client.health.service(service_name, passing=True)
+                self._store_instances(service_name, services)
+            except Exception as e:
+                SERVICE_DISCOVERY_REFRESH_ERRORS.labels(service_name).inc()
+                logger.error(f"Error discovering service '{service_name}' from Consul: {e}", exc_info=True)
+
+            SERVICE_DISCOVERY_CACHE_AGE.labels(service_name).set_function(lambda: self._cache_age(service_name))
+            SERVICE_DISCOVERY_STALE.labels(service_name).set_function(
+                lambda: 1 if self._cache_age(service_name) > self.stale_after_seconds else 0
+            )
+
+            watcher = threading.Thread(target=self._watch_loop, args=(service_name,),
+                                       name=f"consul-watch-{service_name}", daemon=True)
+            self._watchers[service_name] = watcher
+            watcher.start()
+            logger.info(f"Started Consul watch for service '{service_name}'.")
+
+    def is_watched(self, service_name: str) -> bool:
+        """True if lookups for the service are served from the in-memory table without calling Consul."""
+        return service_name in self._watchers
+
+    def get_service_addresses(self, service_name: str) -> List[str]:
         """
-        Queries Consul for a healthy instance of the given service.
-        Returns the URL (http://host:port) of a random healthy instance.
+        Returns the URLs (http://host:port) of all known healthy instances of the given service.
+        Watched services are served from memory; any other name falls back to a direct Consul query.
         """
         if not self.consul_client:
             logger.error(f"Consul client not initialized. Cannot discover service '{service_name}'.")
-            return None
+            return []
+
+        if service_name in self._watchers:
+            if self.expire_after_seconds and self._cache_age(service_name) > self.expire_after_seconds:
+                logger.warning(f"Known instances of '{service_name}' expired: not confirmed by Consul "
+                               f"for over {self.expire_after_seconds}s.")
+                return []
+            return self._instances.get(service_name, [])
 
         try:
             _, services = self.consul_client.health.service(service_name, passing=True)
-            
-            if not services:
-                logger.warning(f"No healthy instances found for service: {service_name}")
-                return None
-            
-            instance = random.choice(services)
-            address = instance['Service']['Address']
-            port = instance['Service']['Port']
-            
-            service_url = f"http://{address}:{port}"
-            logger.debug(f"Discovered service '{service_name}': {service_url}")
-            return service_url
+            return [f"http://{instance['Service']['Address']}:{instance['Service']['Port']}" for instance in services]
         except Exception as e:
             logger.error(f"Error discovering service '{service_name}' from Consul: {e}", exc_info=True)
+            return []
+
+    def get_service_address(self, service_name: str, admit: Optional[Callable[[str], bool]] = None) -> Optional[str]:
+        """
+        Returns the URL (http://host:port) of a healthy instance of the given service,
+        picked by the service's load balancing strategy. Instances rejected by `admit`
+        (e.g. because their circuit is open) are skipped.
+        """
+        services = self.get_service_addresses(service_name)
+        if not services:
+            logger.warning(f"No healthy instances found for service: {service_name}")
             return None
 
+        while services:
+            service_url = self.load_balancer.choose(service_name, services)
+            if admit is None or admit(service_url):
+                logger.debug(f"Discovered service '{service_name}': {service_url}")
+                return service_url
+            services = [url for url in services if url != service_url]
+
+        logger.warning(f"All instances of service '{service_name}' were rejected by their circuit breakers.")
+        return None
+
     def get_all_service_names(self) -> List[str]:
         """
         Returns a list of all registered service names in Consul.
@@ -58,3 +173,7 @@ class ConsulServiceDiscovery:
         except Exception as e:
             logger.error(f"Error fetching service names from Consul: {e}", exc_info=True)
             return []
+
+    def close(self):
+        """Stops the background watches."""
+        self._stop_event.set()
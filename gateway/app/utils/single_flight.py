@@ -0,0 +1,51 @@
+import asyncio
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+
+class Flight:
+    """One in-progress origin fetch; followers wait on `event` and then read `result`."""
+    def __init__(self, event):
+        self.event = event
+        self.result: Optional[Any] = None
+        self.started = time.monotonic()
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent work per key within a process. The first caller for a key
+    becomes the leader and must call complete(); later callers wait for its result.
+    Flights older than `abandon_after` seconds are taken over by the next caller.
+    """
+    def __init__(self, abandon_after: float):
+        self.abandon_after = abandon_after
+        self._flights: Dict[str, Flight] = {}
+        self._lock = threading.Lock()
+
+    def _new_event(self):
+        return threading.Event()
+
+    def join(self, key: str) -> Tuple[Flight, bool]:
+        """Returns the flight for `key` and whether the caller is its leader."""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None and time.monotonic() - flight.started < self.abandon_after:
+                return flight, False
+            flight = Flight(self._new_event())
+            self._flights[key] = flight
+            return flight, True
+
+    def complete(self, key: str, flight: Flight, result: Optional[Any]):
+        """Publishes the leader's result (None if followers should fetch for themselves)."""
+        flight.result = result
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.event.set()
+
+
+class AsyncSingleFlight(SingleFlight):
+    """SingleFlight for coroutines running on one event loop."""
+    def _new_event(self):
+        return asyncio.Event()
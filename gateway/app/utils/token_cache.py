@@ -0,0 +1,78 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import jwt
+
+from ..metrics import AUTH_TOKEN_CACHE_LOOKUPS, AUTH_TOKEN_CACHE_ENTRIES
+
+
+def token_digest(token: str) -> str:
+    # Tokens are credentials; only their digest is kept in memory.
+    return hashlib.blake2b(token.encode('utf-8'), digest_size=16).hexdigest()
+
+
+class VerifiedTokenCache:
+    """
+    LRU cache of the claims of JWTs whose signature has been verified, keyed by a digest of
+    the token. An entry expires at the token's `exp`, or after `max_ttl_seconds` if that is
+    sooner, so a cached token is never accepted after it would have failed verification.
+    At most `max_entries` tokens are kept.
+    """
+    def __init__(self, max_entries: int, max_ttl_seconds: float):
+        self.max_entries = max_entries
+        self.max_ttl_seconds = max_ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[Dict[str, Any], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Optional[Dict[str, Any]]:
+        key = token_digest(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= time.time():
+                del self._entries[key]
+                AUTH_TOKEN_CACHE_ENTRIES.set(len(self._entries))
+                entry = None
+            if entry is None:
+                AUTH_TOKEN_CACHE_LOOKUPS.labels('miss').inc()
+                return None
+            self._entries.move_to_end(key)
+        AUTH_TOKEN_CACHE_LOOKUPS.labels('hit').inc()
+        return entry[0]
+
+    def set(self, token: str, claims: Dict[str, Any]):
+        expires_at = time.time() + self.max_ttl_seconds
+        if isinstance(claims.get('exp'), (int, float)):
+            expires_at = min(expires_at, claims['exp'])
+        key = token_digest(token)
+        with self._lock:
+            self._entries[key] = (claims, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            AUTH_TOKEN_CACHE_ENTRIES.set(len(self._entries))
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def verify_token(token: str, secret: str, token_cache: Optional[VerifiedTokenCache]) -> Dict[str, Any]:
+    """
+    Returns the claims of an HS256 JWT. The signature is only checked for tokens the cache has
+    not verified yet; raises jwt.InvalidTokenError for invalid ones.
+    """
+    claims = token_cache.get(token) if token_cache is not None else None
+    if claims is None:
+        claims = jwt.decode(token, secret, algorithms=['HS256'])
+        if token_cache is not None:
+            token_cache.set(token, claims)
+    return claims
+
+
+def build_token_cache(settings: Dict[str, Any]) -> Optional[VerifiedTokenCache]:
+    """Creates the cache of verified JWTs, or None if disabled."""
+    if not settings.get('ENABLED', True) or settings.get('MAX_ENTRIES', 10000) <= 0:
+        return None
+    return VerifiedTokenCache(settings.get('MAX_ENTRIES', 10000), settings.get('MAX_TTL_SECONDS', 300))
@@ -0,0 +1,31 @@
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+EXCLUDED_REQUEST_HEADERS = ['host', 'content-length', 'transfer-encoding', 'connection', 'keep-alive']
+EXCLUDED_RESPONSE_HEADERS = ['content-encoding', 'content-length', 'transfer-encoding', 'connection']
+
+
+def get_stream_threshold(streaming_settings: Dict, service_name: str, path: str) -> int:
+    """
+    Returns the body size above which the proxy streams instead of buffering.
+    Per-route thresholds are keyed by '<service_name>/<path prefix>'; the longest matching key wins.
+    """
+    route = f"{service_name}/{path}"
+    best_match = None
+    for route_prefix, threshold in streaming_settings.get('ROUTE_THRESHOLDS', {}).items():
+        if route.startswith(route_prefix) and (best_match is None or len(route_prefix) > len(best_match[0])):
+            best_match = (route_prefix, threshold)
+    if best_match:
+        return best_match[1]
+    return streaming_settings.get('THRESHOLD_BYTES', 1024 * 1024)
+
+
+def instance_label(url: str) -> str:
+    """Returns the 'host:port' an upstream URL points at, as used by the upstream metrics."""
+    parts = urlsplit(url)
+    return f"{parts.hostname}:{parts.port or (443 if parts.scheme == 'https' else 80)}"
+
+
+def status_class(status: Optional[int]) -> str:
+    """Buckets an upstream status code as '2xx'..'5xx', or 'error' if no response arrived."""
+    return 'error' if status is None else f"{status // 100}xx"
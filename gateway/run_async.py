@@ -0,0 +1,13 @@
+from app.aio import create_async_app
+from aiohttp import web
+from dotenv import load_dotenv
+import os
+
+
+load_dotenv()
+
+port = int(os.getenv("GATEWAY_PORT", 5000))
+
+app = create_async_app()
+if __name__ == '__main__':
+    web.run_app(app, host='0.0.0.0', port=port)
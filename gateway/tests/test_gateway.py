@@ -1,10 +1,59 @@
+import asyncio
 import pytest
+from aiohttp.test_utils import TestClient, TestServer
+from flask import Flask, Response, g, request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+from prometheus_client import REGISTRY
 from ..app import create_app
+from ..app.aio import create_async_app
+from ..app.aio import proxy as aio_proxy
+from ..app.config import Config
+from ..app.utils.http_client import UpstreamSessionPool
+from ..app.utils import service_discovery
+from ..app.utils.load_balancer import ServiceLoadBalancer
+from ..app.utils.service_discovery import ConsulServiceDiscovery
+from ..app.utils.hedging import RequestHedger, HedgeBudget
+from ..app.utils.concurrency import AdaptiveConcurrencyLimiter, ConcurrencySlot, GradientLimit
+from ..app.utils.token_cache import VerifiedTokenCache
+from ..app.utils.admission import AdmissionController, ADMITTED, QUEUE_FULL, QUEUE_TIMEOUT
+from ..app.utils.single_flight import SingleFlight
+from ..app.utils.local_cache import LocalLRUCache
+from ..app.utils.cache_keys import CacheKeyBuilder
+from ..app.middlewares.caching import (
+    resolve_cache_policy, cache_storage_ttl, compute_etag, etag_matches, serialize_cache_entry, deserialize_cache_entry,
+    cache_entry_tags, invalidation_tags, build_tag_version_key, purge_tags_args, store_entry_args,
+    serialize_etag_entry, CachingMiddleware, PURGE_TAGS_SCRIPT, STORE_ENTRY_SCRIPT,
+)
+from ..app.utils.paths import split_proxy_path
+from ..app.utils.upstream import instance_label, status_class
+from ..app.utils.route_classifier import RouteClassifier, ROUTE_PROXY, ROUTE_INTERNAL, ROUTE_OTHER
+from ..app.middleware_manager import MiddlewareManager
+from ..app.utils.rate_limits import (
+    SlidingWindowRateLimiter, RateLimitRules, client_ip, parse_api_keys, parse_trusted_proxies, request_identity
+)
+from ..app.middlewares.rate_limiter import RATE_LIMIT_HEADERS, RateLimiterMiddleware
+from ..app.middlewares.admission import AdmissionControlMiddleware
+from ..app.middlewares.auth import AuthMiddleware
+from ..app.middlewares.circuit_breaker import (
+    ACQUIRE_PERMISSION_SCRIPT, RELEASE_PERMISSION_SCRIPT, BreakerStateCache, acquire_permission_args, build_breaker_key,
+    build_breaker_outcomes, get_breaker_service_name, local_breaker_decision
+)
+from ..app.utils.errors import upstream_error, NotFoundError, APIError
 from unittest.mock import patch, MagicMock
+import aiohttp
+import socket
+import json
 import os
+import queue
+import random
+import uuid
 import jwt
 import time
+import threading
 import requests
+import urllib3
+import redis
 
 @pytest.fixture
 def client():
@@ -20,6 +69,83 @@ def client():
     with app.test_client() as client:
         yield client
 
+@pytest.fixture
+def redis_client():
+    client = redis.StrictRedis(host=os.getenv('REDIS_HOST', 'localhost'), port=int(os.getenv('REDIS_PORT', 6379)),
+                               decode_responses=True)
+    try:
+        client.ping()
+    except redis.RedisError:
+        pytest.skip("Redis is not reachable")
+    return client
+
+class UpstreamHandler(BaseHTTPRequestHandler):
+    """Serves the handlers in `server.routes`: path -> handler(request handler, body) -> (status, payload, headers)."""
+    protocol_version = 'HTTP/1.1'
+
+    def _respond(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        handler = self.server.routes.get(urlsplit(self.path).path)
+        status, payload, headers = handler(self, body) if handler else (404, b'{"message": "Not found"}', {})
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if isinstance(payload, bytes):
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+        # Any other payload is an iterable of chunks, sent as they are produced.
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for chunk in payload:
+            self.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _respond
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def upstream():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), UpstreamHandler)
+    server.routes = {}
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def gateway_config(redis_client, upstream):
+    """Points both engines at the test Redis and every service at the test upstream."""
+    connection = redis_client.connection_pool.connection_kwargs
+    with patch.object(Config, 'REDIS_HOST', connection['host']), patch.object(Config, 'REDIS_PORT', connection['port']), \
+            patch.dict(Config.RATE_LIMIT_SETTINGS, {'TRUSTED_PROXIES': ['127.0.0.1']}), \
+            patch.object(ConsulServiceDiscovery, 'get_service_addresses', lambda self, service_name: [upstream.url]):
+        yield Config
+
+def unique_service_name():
+    """A service of its own, so breaker state and cache entries left in Redis never leak between tests."""
+    return f"test_service_{uuid.uuid4().hex[:12]}"
+
+def random_client_ip():
+    return f"10.{random.randint(0, 255)}.{random.randint(0, 255)}.{random.randint(1, 254)}"
+
+def run_async_gateway(scenario):
+    """Runs `scenario(client)` against an aio gateway app served on a local port."""
+    async def run():
+        client = TestClient(TestServer(create_async_app()))
+        await client.start_server()
+        try:
+            return await scenario(client)
+        finally:
+            await client.close()
+    return asyncio.run(run())
+
 def generate_jwt_token(user_id, secret_key, expires_in_seconds=3600):
     payload = {
         'user_id': user_id,
@@ -33,7 +159,7 @@ def test_health_check(client):
     assert rv.status_code == 200
     assert b"Gateway is healthy" in rv.data
 
-@patch('requests.request')
+@patch('requests.Session.request')
 def test_proxy_users_service(mock_requests_request, client):
     mock_response = MagicMock()
     mock_response.status_code = 200
@@ -54,7 +180,7 @@ def test_proxy_users_service(mock_requests_request, client):
     assert rv.status_code == 200
     assert b'{"id": 1, "name": "Test User"}' in rv.data
 
-@patch('requests.request')
+@patch('requests.Session.request')
 def test_proxy_service_unavailable(mock_requests_request, client):
     mock_requests_request.side_effect = requests.exceptions.ConnectionError
 
@@ -67,7 +193,7 @@ def test_auth_middleware_no_token(client):
     assert rv.status_code == 401
     assert b"Authorization header missing" in rv.data
 
-@patch('requests.request')
+@patch('requests.Session.request')
 def test_auth_middleware_valid_token(mock_requests_request, client):
     mock_response = MagicMock()
     mock_response.status_code = 200
@@ -96,3 +222,835 @@ def test_rate_limiter_middleware(client):
     assert rv.status_code == 429
     assert b"Too many requests" in rv.data
 
+def test_upstream_session_pool_reuses_session_per_service():
+    pool = UpstreamSessionPool({'POOL_MAXSIZE': 5, 'IDLE_TIMEOUT_SECONDS': 30, 'MAX_LIFETIME_SECONDS': 300})
+    users_session = pool.get_session('users_service')
+
+    assert pool.get_session('users_service') is users_session
+    assert pool.get_session('products_service') is not users_session
+    assert users_session.get_adapter('http://users_service:5001').poolmanager.connection_pool_kw['maxsize'] == 5
+    pool.close()
+
+def upstream_pool_gauges(service, upstream):
+    """Reads the pool gauges and connection counters of `service` for the test upstream instance."""
+    labels = {'service_name': service, 'instance': urlsplit(upstream.url).netloc}
+    return {name: REGISTRY.get_sample_value(f"gateway_upstream_pool_{name}", labels) or 0
+            for name in ('checked_out_connections', 'idle_connections',
+                         'connections_created_total', 'connections_closed_total')}
+
+def upstream_connection_pool(session, upstream):
+    """The urllib3 pool `session` opened for the test upstream instance."""
+    poolmanager = session.get_adapter(upstream.url).poolmanager
+    [key] = poolmanager.pools.keys()
+    return poolmanager.pools[key]
+
+def test_upstream_session_pool_tracks_checked_out_and_idle_connections(upstream):
+    upstream.routes['/users'] = lambda handler, body: (200, b'[]', {})
+    service = unique_service_name()
+    pool = UpstreamSessionPool({'IDLE_TIMEOUT_SECONDS': 30, 'MAX_LIFETIME_SECONDS': 300})
+    session = pool.get_session(service)
+
+    assert session.get(f"{upstream.url}/users").status_code == 200
+    assert session.get(f"{upstream.url}/users").status_code == 200
+    gauges = upstream_pool_gauges(service, upstream)
+    assert gauges['checked_out_connections'] == 0
+    assert gauges['idle_connections'] == 1
+    assert gauges['connections_created_total'] == 1
+
+    # A connection discarded mid-request is no longer checked out.
+    connection_pool = upstream_connection_pool(session, upstream)
+    conn = connection_pool._get_conn()
+    assert upstream_pool_gauges(service, upstream) == {**gauges, 'idle_connections': 0, 'checked_out_connections': 1}
+    conn.close()
+    connection_pool._put_conn(None)
+    gauges = upstream_pool_gauges(service, upstream)
+    assert gauges['checked_out_connections'] == 0
+    assert gauges['idle_connections'] == 0
+    assert gauges['connections_closed_total'] == 1
+
+    # Disposing the pools closes the idle connections they still hold.
+    assert session.get(f"{upstream.url}/users").status_code == 200
+    assert upstream_pool_gauges(service, upstream)['idle_connections'] == 1
+    pool.close()
+    gauges = upstream_pool_gauges(service, upstream)
+    assert gauges['idle_connections'] == 0
+    assert gauges['connections_closed_total'] == 2
+
+    # urllib3 still returns None to a closed pool after a checkout that failed.
+    with pytest.raises(urllib3.exceptions.ClosedPoolError):
+        connection_pool.urlopen('GET', '/users', retries=False)
+    assert upstream_pool_gauges(service, upstream)['checked_out_connections'] == 0
+
+def test_upstream_session_pool_releases_connections_returned_to_an_evicted_pool(upstream):
+    upstream.routes['/users'] = lambda handler, body: (200, b'[]', {})
+    service = unique_service_name()
+    pool = UpstreamSessionPool({'POOL_CONNECTIONS': 1, 'IDLE_TIMEOUT_SECONDS': 30, 'MAX_LIFETIME_SECONDS': 300})
+    session = pool.get_session(service)
+
+    assert session.get(f"{upstream.url}/users").status_code == 200
+    connection_pool = upstream_connection_pool(session, upstream)
+    conn = connection_pool._get_conn()
+    # A pool for another instance evicts this one while the connection is out.
+    session.get_adapter(upstream.url).poolmanager.connection_from_url('http://localhost:1')
+    connection_pool._put_conn(conn)
+
+    gauges = upstream_pool_gauges(service, upstream)
+    assert gauges['checked_out_connections'] == 0
+    assert gauges['idle_connections'] == 0
+    assert gauges['connections_closed_total'] == 1
+    pool.close()
+
+@pytest.mark.parametrize('settings', [
+    {'IDLE_TIMEOUT_SECONDS': 0.1, 'MAX_LIFETIME_SECONDS': 300},
+    {'IDLE_TIMEOUT_SECONDS': 30, 'MAX_LIFETIME_SECONDS': 0.1},
+])
+def test_upstream_session_pool_recycles_expired_connections(upstream, settings):
+    upstream.routes['/users'] = lambda handler, body: (200, b'[]', {})
+    service = unique_service_name()
+    pool = UpstreamSessionPool(settings)
+    session = pool.get_session(service)
+
+    assert session.get(f"{upstream.url}/users").status_code == 200
+    assert session.get(f"{upstream.url}/users").status_code == 200
+    assert upstream_pool_gauges(service, upstream)['connections_created_total'] == 1
+
+    time.sleep(0.2)
+    assert session.get(f"{upstream.url}/users").status_code == 200
+    gauges = upstream_pool_gauges(service, upstream)
+    assert gauges['connections_created_total'] == 2
+    assert gauges['connections_closed_total'] == 1
+    assert gauges['checked_out_connections'] == 0
+    assert gauges['idle_connections'] == 1
+    pool.close()
+
+def test_upstream_error_maps_status_and_message():
+    error = upstream_error(404, '{"message": "User not found"}')
+    assert isinstance(error, NotFoundError)
+    assert error.message == "User not found"
+
+    error = upstream_error(502, '')
+    assert type(error) is APIError
+    assert error.code == 502
+    assert error.message == "Error from microservice: 502"
+
+def test_load_balancer_strategies_per_service():
+    balancer = ServiceLoadBalancer({
+        'DEFAULT_STRATEGY': 'round_robin',
+        'SERVICE_STRATEGIES': {'users_service': 'least_outstanding', 'products_service': 'p2c_ewma'},
+    })
+    instances = ['http://a:1', 'http://b:1']
+
+    assert [balancer.choose('orders_service', instances) for _ in range(4)] == instances * 2
+
+    balancer.on_request_start('http://a:1')
+    assert balancer.choose('users_service', instances) == 'http://b:1'
+    balancer.on_request_end('http://a:1', 0.01)
+
+    balancer.on_request_start('http://b:1')
+    balancer.on_request_end('http://b:1', 1.0, failed=True)
+    assert all(balancer.choose('products_service', instances) == 'http://a:1' for _ in range(10))
+
+    with pytest.raises(ValueError):
+        ServiceLoadBalancer({'DEFAULT_STRATEGY': 'fastest'})
+
+def fake_consul(responses):
+    """Consul client whose health queries block until a response (or an exception to raise) is queued."""
+    consul_client = MagicMock()
+
+    def health_service(service_name, passing=True, index=None, wait=None):
+        response = responses.get(timeout=5)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    consul_client.health.service.side_effect = health_service
+    return consul_client
+
+def consul_instance(host):
+    return {'Service': {'Address': host, 'Port': 5002}}
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+def test_service_discovery_serves_last_known_instances_until_consul_recovers():
+    responses = queue.Queue()
+    responses.put(('1', [consul_instance('a')]))
+    with patch.object(service_discovery.consul, 'Consul', return_value=fake_consul(responses)):
+        discovery = ConsulServiceDiscovery('consul', 8500, ['products_service'])
+    errors = lambda: REGISTRY.get_sample_value('gateway_service_discovery_refresh_errors_total', {'service_name': 'products_service'}) or 0
+    try:
+        assert discovery.get_service_addresses('products_service') == ['http://a:5002']
+
+        failed_refreshes = errors()
+        responses.put(ConnectionError("Consul is down"))
+        assert wait_for(lambda: errors() == failed_refreshes + 1)
+        assert discovery.get_service_addresses('products_service') == ['http://a:5002']
+
+        # Picked up by the watch once its retry backoff is over.
+        responses.put(('2', [consul_instance('a'), consul_instance('b')]))
+        assert wait_for(lambda: discovery.get_service_addresses('products_service') == ['http://a:5002', 'http://b:5002'])
+    finally:
+        discovery.close()
+        responses.put(('3', []))
+
+def test_service_discovery_expires_instances_not_confirmed_in_time():
+    responses = queue.Queue()
+    responses.put(('1', [consul_instance('a')]))
+    settings = {'STALE_AFTER_SECONDS': 0.1, 'EXPIRE_AFTER_SECONDS': 0.2}
+    with patch.object(service_discovery.consul, 'Consul', return_value=fake_consul(responses)):
+        discovery = ConsulServiceDiscovery('consul', 8500, ['users_service'], settings)
+    stale = lambda: REGISTRY.get_sample_value('gateway_service_discovery_cache_stale', {'service_name': 'users_service'})
+    try:
+        assert discovery.get_service_addresses('users_service') == ['http://a:5002']
+        assert stale() == 0
+
+        # The watch gets no answer from Consul, so the instances are never confirmed again.
+        assert wait_for(lambda: stale() == 1)
+        assert wait_for(lambda: discovery.get_service_addresses('users_service') == [])
+
+        responses.put(('2', [consul_instance('b')]))
+        assert wait_for(lambda: discovery.get_service_addresses('users_service') == ['http://b:5002'])
+        assert stale() == 0
+    finally:
+        discovery.close()
+        responses.put(('3', []))
+
+def test_hedge_budget_caps_extra_requests():
+    budget = HedgeBudget(ratio=0.25, burst=3)
+    for _ in range(20):
+        budget.deposit()
+
+    assert sum(budget.withdraw() for _ in range(10)) == 3
+
+def test_request_hedger_uses_backup_when_primary_is_slow():
+    hedger = RequestHedger({'ENABLED': True, 'MIN_SAMPLES': 16, 'BUDGET_RATIO': 1, 'BUDGET_BURST': 1})
+    closed = []
+    for _ in range(16):
+        assert hedger.execute('users_service', lambda: 'primary', lambda: 'backup', closed.append) == 'primary'
+    assert hedger.hedge_delay('users_service') is not None
+
+    def slow_primary():
+        time.sleep(0.2)
+        return 'slow'
+
+    assert hedger.execute('users_service', slow_primary, lambda: 'backup', closed.append) == 'backup'
+    time.sleep(0.3)
+    assert closed == ['slow']
+    hedger.close()
+
+def test_request_hedger_runs_primary_outside_the_backup_pool():
+    hedger = RequestHedger({'ENABLED': True, 'MIN_SAMPLES': 16, 'MAX_WORKERS': 1})
+    for _ in range(16):
+        hedger.execute('users_service', lambda: 'primary', lambda: 'backup', lambda resp: None)
+
+    # With the only backup worker busy, primaries must still run straight away.
+    release = threading.Event()
+    hedger._executor.submit(release.wait, 5)
+    started = time.time()
+    assert hedger.execute('users_service', lambda: 'primary', lambda: 'backup', lambda resp: None) == 'primary'
+    assert hedger.execute('users_service', lambda: 'primary', None, lambda resp: None) == 'primary'
+    assert time.time() - started < 1
+    release.set()
+    hedger.close()
+
+def test_request_hedger_bounds_its_threads_under_concurrent_calls():
+    hedger = RequestHedger({'ENABLED': True, 'MIN_SAMPLES': 16, 'MAX_WORKERS': 2, 'PRIMARY_MAX_WORKERS': 4,
+                            'BUDGET_RATIO': 1, 'BUDGET_BURST': 5})
+    for _ in range(16):
+        hedger.execute('users_service', lambda: 'primary', lambda: 'backup', lambda resp: None)
+
+    def slow_primary():
+        time.sleep(0.1)
+        return 'primary'
+
+    results = []
+    callers = [threading.Thread(target=lambda: results.append(
+        hedger.execute('users_service', slow_primary, lambda: 'backup', lambda resp: None))) for _ in range(40)]
+    hedge_threads = lambda: [t for t in threading.enumerate() if t.name.startswith('upstream-hedge')]
+    for caller in callers:
+        caller.start()
+    peak = 0
+    while any(caller.is_alive() for caller in callers):
+        peak = max(peak, len(hedge_threads()))
+        time.sleep(0.005)
+
+    # Calls beyond the primary pool run unhedged on the calling thread instead of starting new ones.
+    assert len(results) == 40 and set(results) <= {'primary', 'backup'}
+    assert peak <= 4 + 2
+    hedger.close()
+
+def test_single_flight_followers_get_leader_result():
+    single_flight = SingleFlight(abandon_after=5)
+    flight, is_leader = single_flight.join('cache:/proxy/products_service/products?')
+    follower_flight, follower_is_leader = single_flight.join('cache:/proxy/products_service/products?')
+
+    assert is_leader and not follower_is_leader
+    assert follower_flight is flight
+
+    single_flight.complete('cache:/proxy/products_service/products?', flight, {'content': '[]'})
+    assert follower_flight.event.is_set()
+    assert follower_flight.result == {'content': '[]'}
+    assert single_flight.join('cache:/proxy/products_service/products?')[1]
+
+def test_local_cache_evicts_least_recently_used_by_size():
+    cache = LocalLRUCache(max_bytes=100, ttl_seconds=60, max_item_bytes=60)
+    cache.set('a', 'A', 40)
+    cache.set('b', 'B', 40)
+    assert cache.get('a') == 'A'
+
+    cache.set('c', 'C', 40)
+    assert cache.get('b') is None
+    assert cache.get('a') == 'A' and cache.get('c') == 'C'
+    assert cache.set('big', 'X', 61) is False
+
+    cache.set('short', 'S', 1, ttl_seconds=0)
+    assert cache.get('short') is None
+
+def test_not_modified_falls_back_to_redis_etag_when_l1_entry_has_none():
+    middleware = CachingMiddleware()
+    middleware.local_cache = LocalLRUCache(max_bytes=1000, ttl_seconds=60)
+    middleware.redis_client = MagicMock()
+    etag = compute_etag(b'[]')
+    middleware.redis_client.get.return_value = serialize_etag_entry(etag, time.time()).encode()
+    middleware.local_cache.set('cache:products', {'body': b'[]', 'stored_at': time.time(), 'etag': None}, 10)
+    policy = {'TTL_SECONDS': 60, 'STALE_WHILE_REVALIDATE_SECONDS': 0}
+
+    with Flask(__name__).test_request_context('/proxy/products_service/products', headers={'If-None-Match': etag}):
+        response = middleware._check_not_modified(request, 'cache:products', policy)
+    assert response is not None and response.status_code == 304
+    middleware.redis_client.get.assert_called_once_with('etag:cache:products')
+
+def test_cache_hit_does_not_replay_the_filling_clients_rate_limit_headers(gateway_config, upstream):
+    upstream.routes['/products/'] = lambda handler, body: (200, b'[]', {})
+    path = f"/proxy/products_service/products/?run={uuid.uuid4().hex}"
+
+    with create_app().test_client() as client:
+        fill = client.get(path, headers={'X-Forwarded-For': random_client_ip()})
+        hit = client.get(path, headers={'X-Forwarded-For': random_client_ip()})
+    assert fill.status_code == 200 and 'X-RateLimit-Remaining' in fill.headers
+    assert hit.status_code == 200 and 'Age' in hit.headers
+    assert not [name for name in RATE_LIMIT_HEADERS if name in hit.headers]
+
+    async def scenario(client):
+        fill = await client.get(path + 'aio', headers={'X-Forwarded-For': random_client_ip()})
+        hit = await client.get(path + 'aio', headers={'X-Forwarded-For': random_client_ip()})
+        assert fill.status == 200 and 'X-RateLimit-Remaining' in fill.headers
+        assert hit.status == 200 and 'Age' in hit.headers
+        assert not [name for name in RATE_LIMIT_HEADERS if name in hit.headers]
+    run_async_gateway(scenario)
+
+def test_cache_policy_longest_route_prefix_wins():
+    default_policy = {'TTL_SECONDS': 300, 'STALE_WHILE_REVALIDATE_SECONDS': 30, 'STALE_IF_ERROR_SECONDS': 300}
+    route_policies = {
+        '/proxy/products_service': {'TTL_SECONDS': 60},
+        '/proxy/products_service/products': {'TTL_SECONDS': 10, 'STALE_IF_ERROR_SECONDS': 600},
+    }
+
+    policy = resolve_cache_policy('/proxy/products_service/products/1', default_policy, route_policies)
+    assert policy == {'TTL_SECONDS': 10, 'STALE_WHILE_REVALIDATE_SECONDS': 30, 'STALE_IF_ERROR_SECONDS': 600}
+    assert cache_storage_ttl(policy) == 610
+    assert resolve_cache_policy('/proxy/products_service/categories', default_policy, route_policies)['TTL_SECONDS'] == 60
+    assert resolve_cache_policy('/proxy/users_service/users', default_policy, route_policies) is default_policy
+
+def test_etag_matching_for_conditional_get():
+    etag = compute_etag(b'[{"id": 1}]')
+    assert etag == compute_etag(b'[{"id": 1}]')
+    assert etag != compute_etag(b'[{"id": 2}]')
+
+    assert etag_matches(etag, etag)
+    assert etag_matches(f'"other", W/{etag}', etag)
+    assert etag_matches('*', etag)
+    assert not etag_matches('"other"', etag)
+    assert not etag_matches(None, etag)
+
+def test_cache_entry_binary_round_trip():
+    body = bytes(range(256)) * 16
+    headers = [('Content-Type', 'application/octet-stream'), ('Set-Cookie', 'a=1'), ('Set-Cookie', 'b=2')]
+    compression = {'CODEC': 'gzip', 'MIN_SIZE_BYTES': 1024, 'LEVEL': 3}
+    entry = serialize_cache_entry(body, 200, headers, stored_at=1000.0, compression=compression)
+    assert len(entry) < len(body)
+
+    data = deserialize_cache_entry(entry)
+    assert data['body'] == body
+    assert data['status_code'] == 200
+    assert data['headers'] == headers
+    assert data['stored_at'] == 1000.0
+
+    with pytest.raises(ValueError):
+        deserialize_cache_entry(b'{"content": "legacy json entry"}')
+
+def test_cache_key_builder_normalizes_query_and_partitions_by_user():
+    builder = CacheKeyBuilder({'IGNORED_QUERY_PARAMS': ['gclid'], 'IGNORED_QUERY_PREFIXES': ['utm_'],
+                               'VARY': ['user', 'Accept'], 'MAX_KEY_LENGTH': 256}, jwt_secret='secret')
+    path = '/proxy/products_service/products'
+    key = builder.build(path, b'b=2&a=1&a=0', {})
+    assert key == builder.build(path, b'a=1&utm_source=mail&a=0&b=2&gclid=x', {})
+    assert key != builder.build(path, b'b=2&a=0&a=1', {})
+
+    alice = {'Authorization': f"Bearer {jwt.encode({'user_id': 'alice'}, 'secret', algorithm='HS256')}"}
+    forged = {'Authorization': f"Bearer {jwt.encode({'user_id': 'alice'}, 'wrong', algorithm='HS256')}"}
+    assert builder.build(path, b'', alice) != builder.build(path, b'', {})
+    assert builder.build(path, b'', forged) == builder.build(path, b'', {})
+    assert builder.build(path, b'', {'Accept': 'application/json'}) != builder.build(path, b'', {'Accept': 'text/html'})
+
+    long_key = builder.build(path, ('q=' + 'x' * 500).encode(), {})
+    assert long_key.startswith('cache:h:') and len(long_key) < 64
+
+def test_cache_key_builder_and_auth_verify_each_token_once():
+    secret = 'k' * 32
+    token_cache = VerifiedTokenCache(max_entries=10, max_ttl_seconds=60)
+    builder = CacheKeyBuilder({'VARY': ['user']}, jwt_secret=secret, token_cache=token_cache)
+    token = generate_jwt_token('alice', secret)
+    headers = {'Authorization': f"Bearer {token}"}
+
+    with patch('jwt.decode', wraps=jwt.decode) as decode, patch.dict(os.environ, {'JWT_SECRET_KEY': secret}):
+        keys = {builder.build('/proxy/products_service/products', b'', headers) for _ in range(3)}
+        assert AuthMiddleware(token_cache)._verify(token)['user_id'] == 'alice'
+    assert decode.call_count == 1
+    assert keys == {'cache:/proxy/products_service/products?|user=alice'}
+
+def test_invalidation_tags_cover_resource_subtree_and_parent_listings():
+    assert split_proxy_path('/proxy/products_service/products/5/') == ('products_service', '/products/5/')
+    assert split_proxy_path('/gateway/health') is None
+
+    item_tags = set(cache_entry_tags('products_service', '/products/5'))
+    review_tags = set(cache_entry_tags('products_service', '/products/5/reviews'))
+    listing_tags = set(cache_entry_tags('products_service', '/products/'))
+    other_item_tags = set(cache_entry_tags('products_service', '/products/6'))
+
+    update = set(invalidation_tags('products_service', '/products/5'))
+    assert update & item_tags and update & review_tags and update & listing_tags
+    assert not update & other_item_tags
+
+    create = set(invalidation_tags('products_service', '/products/', recursive=False))
+    assert create & listing_tags
+    assert not create & item_tags
+
+def test_fill_started_before_a_purge_is_not_stored(redis_client):
+    service_name = f"test-purge-{time.time()}"
+    tags = cache_entry_tags(service_name, '/products/5')
+    version_keys = [build_tag_version_key(tag) for tag in tags]
+    cache_key = f"cache:{service_name}:/products/5"
+
+    def store(versions):
+        return redis_client.eval(STORE_ENTRY_SCRIPT, *store_entry_args(cache_key, 'entry', 'etag', 60, tags, versions, 60))
+
+    try:
+        versions = redis_client.mget(version_keys)
+        assert store(versions) == 1
+        assert redis_client.get(cache_key) == 'entry'
+
+        purged = redis_client.eval(PURGE_TAGS_SCRIPT, *purge_tags_args(invalidation_tags(service_name, '/products/5'), 60))
+        assert purged == [cache_key]
+        # A fill that read the tag versions before the purge must not write its stale body back.
+        assert store(versions) == 0
+        assert redis_client.get(cache_key) is None
+        assert store(redis_client.mget(version_keys)) == 1
+    finally:
+        redis_client.delete(cache_key, f"etag:{cache_key}", *version_keys, *[f"tag:{tag}" for tag in tags])
+
+def test_breaker_local_state_decides_without_redis_until_recovery():
+    config = {'RECOVERY_TIMEOUT_SECONDS': 30}
+    assert local_breaker_decision('CLOSED', 0, 100, config) is True
+    assert local_breaker_decision('OPEN', 90, 100, config) is False
+    assert local_breaker_decision('OPEN', 60, 100, config) is None
+
+    states = BreakerStateCache(ttl_seconds=60)
+    assert states.get('products_service') is None
+    states.on_event('products_service OPEN 90.5')
+    assert states.get('products_service') == ('OPEN', 90.5)
+    states.on_event('garbage')
+    assert states.get('products_service') == ('OPEN', 90.5)
+
+def test_breaker_outcomes_cover_service_and_attempted_instances():
+    assert get_breaker_service_name('/proxy/products_service/products/1') == 'products_service'
+    assert get_breaker_service_name('/gateway/health') is None
+
+    config = {'SLOW_CALL_DURATION_SECONDS': 2, 'INSTANCE_BREAKERS_ENABLED': True}
+    attempts = [('http://a:5000', 2.5, False), ('http://b:5000', 0.1, True)]
+    assert build_breaker_outcomes('products_service', 502, 2.6, attempts, config) == [
+        ('products_service', True, True),
+        ('products_service@http://a:5000', False, True),
+        ('products_service@http://b:5000', True, False),
+    ]
+    config['INSTANCE_BREAKERS_ENABLED'] = False
+    assert build_breaker_outcomes('products_service', 200, 0.1, attempts, config) == [('products_service', False, False)]
+
+def test_sliding_window_limiter_weights_previous_window_and_caps_clients():
+    limiter = SlidingWindowRateLimiter(max_clients=2)
+    start = 1_700_000_000.0
+    assert [limiter.hit('1.2.3.4', 4, 10, start + 5)[0] for _ in range(5)] == [True, True, True, True, False]
+    # Halfway into the next window half of the previous window's 4 requests still count.
+    assert limiter.hit('1.2.3.4', 4, 10, start + 15)[:2] == (True, 1)
+    assert limiter.hit('1.2.3.4', 4, 10, start + 15)[:2] == (True, 0)
+    allowed, _, retry_after, _ = limiter.hit('1.2.3.4', 4, 10, start + 15)
+    assert not allowed and retry_after == pytest.approx(2.5)
+
+    limiter.hit('5.6.7.8', 4, 10, start + 15)
+    limiter.hit('9.9.9.9', 4, 10, start + 15)
+    assert list(limiter._clients) == ['5.6.7.8', '9.9.9.9']
+    assert limiter.hit('1.2.3.4', 4, 10, start + 15)[:2] == (True, 3)
+
+def test_rate_limit_rules_resolve_most_specific_rule():
+    rules = RateLimitRules([
+        {'name': 'exports', 'route': '/proxy/products_service/exports/', 'limit': 2, 'window_seconds': 60},
+        {'name': 'product-writes', 'service': 'products_service', 'methods': ['post'], 'identities': ['user'],
+         'limit': 20, 'window_seconds': 60},
+        {'name': 'partners', 'identities': ['api_key'], 'limit': 1000, 'window_seconds': 60},
+    ], {'limit': 100, 'window_seconds': 60})
+    assert rules.resolve('/proxy/products_service/exports/1', 'GET', 'user')['name'] == 'exports'
+    assert rules.resolve('/proxy/products_service/products', 'POST', 'user')['name'] == 'product-writes'
+    assert rules.resolve('/proxy/products_service/products', 'POST', 'api_key')['name'] == 'partners'
+    assert rules.resolve('/proxy/products_service/products', 'GET', 'ip')['name'] == 'default'
+    assert rules.resolve('/proxy/products_service/exportsx', 'GET', 'ip')['name'] == 'default'
+
+def test_client_ip_only_trusts_forwarded_for_from_trusted_proxies():
+    trusted = parse_trusted_proxies(['10.0.0.0/8'])
+    assert client_ip('10.0.0.5', '203.0.113.7, 10.0.0.9', trusted) == '203.0.113.7'
+    assert client_ip('198.51.100.1', '203.0.113.7', trusted) == '198.51.100.1'
+    # Hops left of the first untrusted one may be forged by the client.
+    assert client_ip('10.0.0.5', '1.1.1.1, 203.0.113.7', trusted) == '203.0.113.7'
+    assert request_identity(None, {'user_id': 42}, '203.0.113.7') == ('user', '42')
+    assert request_identity('secret', {'user_id': 42}, '203.0.113.7', parse_api_keys(['secret']))[0] == 'api_key'
+    assert request_identity('made-up', {'user_id': 42}, '203.0.113.7', parse_api_keys(['secret'])) == ('user', '42')
+
+def test_rate_limiter_ignores_unknown_api_keys():
+    app = Flask(__name__)
+    app.config.update(RATE_LIMIT_MAX_REQUESTS=3, RATE_LIMIT_WINDOW_SECONDS=60,
+                      RATE_LIMIT_SETTINGS={'BACKEND': 'local', 'API_KEY_HEADER': 'X-API-Key', 'API_KEYS': ['partner-key']})
+    limiter = RateLimiterMiddleware()
+    statuses = []
+    for i in range(5):
+        # A fresh made-up key per request must not buy a fresh allowance.
+        with app.test_request_context('/proxy/products_service/products', headers={'X-API-Key': f'random-{i}'}):
+            response = limiter.process_request(request)
+            statuses.append(response.status_code if response is not None else 200)
+    assert statuses == [200, 200, 200, 429, 429]
+
+    with app.test_request_context('/proxy/products_service/products', headers={'X-API-Key': 'partner-key'}):
+        assert limiter.process_request(request) is None
+
+@pytest.mark.parametrize('backend, expected_limit', [('redis', 3), ('local', 100)])
+def test_rate_limit_headers_report_the_limit_the_backend_enforces(redis_client, backend, expected_limit):
+    connection = redis_client.connection_pool.connection_kwargs
+    app = Flask(__name__)
+    app.config.update(RATE_LIMIT_MAX_REQUESTS=100, RATE_LIMIT_WINDOW_SECONDS=60,
+                      REDIS_HOST=connection['host'], REDIS_PORT=connection['port'],
+                      RATE_LIMIT_SETTINGS={'BACKEND': backend, 'BURST': 3})
+    limiter = RateLimiterMiddleware()
+    ip = random_client_ip()
+    headers = []
+    for _ in range(expected_limit + 1):
+        with app.test_request_context('/proxy/products_service/products', environ_base={'REMOTE_ADDR': ip}):
+            limiter.process_request(request)
+            headers.append(g.rate_limit_headers)
+
+    # GCRA admits a burst of 3 however high the sustained limit is, and Remaining counts down from it.
+    assert {h['X-RateLimit-Limit'] for h in headers} == {str(expected_limit)}
+    assert [int(h['X-RateLimit-Remaining']) for h in headers] == list(range(expected_limit - 1, -1, -1)) + [0]
+    assert 'Retry-After' in headers[-1] and 'Retry-After' not in headers[-2]
+
+def test_gradient_limit_sheds_at_limit_and_adapts_to_latency():
+    limit = GradientLimit({'INITIAL_LIMIT': 4, 'MIN_LIMIT': 2, 'MAX_LIMIT': 100, 'SMOOTHING': 1.0})
+    assert [limit.acquire() for _ in range(5)] == [True, True, True, True, False]
+    for _ in range(4):
+        limit.release(0.05, failed=False)
+    assert limit.limit > 4
+
+    grown = limit.limit
+    for _ in range(int(grown)):
+        limit.acquire()
+    limit.release(None, failed=True)
+    assert limit.limit == pytest.approx(grown * 0.9)
+
+    # Latency well above the baseline shrinks the limit, down to where the halved limit
+    # plus its square root stops shrinking it.
+    for _ in range(10):
+        while limit.acquire():
+            pass
+        limit.release(1.0, failed=False)
+    assert limit.limit < 5
+
+def test_concurrency_slot_is_released_once_with_the_call_latency():
+    limiter = AdaptiveConcurrencyLimiter({'ENABLED': True, 'INITIAL_LIMIT': 4})
+    assert limiter.acquire('exports_service')
+    slot = ConcurrencySlot(limiter, 'exports_service')
+    slot.started -= 2
+    with patch.object(limiter, 'release', wraps=limiter.release) as release:
+        slot.release([('http://exports:80', 0.01, False)])
+        slot.release([('http://exports:80', 0.01, False)])
+    # The sample covers the whole call, e.g. a streamed body, not just the upstream attempt.
+    assert release.call_count == 1
+    assert release.call_args.args[1] >= 2
+    assert limiter._limits['exports_service'].in_flight == 0
+
+def test_admission_controller_serves_important_classes_first():
+    controller = AdmissionController({
+        'MAX_CONCURRENT': 1,
+        'CLASSES': [
+            {'name': 'critical', 'max_queue': 1, 'max_queue_time_seconds': 2},
+            {'name': 'low', 'max_queue': 1, 'max_queue_time_seconds': 2},
+        ],
+        'RULES': [{'class': 'critical', 'route': '/gateway/health'},
+                  {'class': 'low', 'header': 'X-Request-Priority', 'value': 'low'}],
+        'DEFAULT_CLASS': 'low',
+    })
+    assert controller.classify('/gateway/health', 'GET', {}) == 'critical'
+    assert controller.classify('/proxy/products_service/products', 'GET', {'X-Request-Priority': 'low'}) == 'low'
+
+    assert controller.admit('low') == ADMITTED
+    admitted = []
+    waiters = [threading.Thread(target=lambda c=c: admitted.append((c, controller.admit(c)))) for c in ('low', 'critical')]
+    for waiter in waiters:
+        waiter.start()
+        time.sleep(0.05)
+    assert controller.admit('low') == QUEUE_FULL
+
+    controller.release()
+    waiters[1].join()
+    assert admitted == [('critical', ADMITTED)]
+    controller.release()
+    waiters[0].join()
+    assert admitted[1] == ('low', ADMITTED)
+    controller.release()
+    assert controller.in_flight == 0
+
+    controller.classes['low']['max_queue_time_seconds'] = 0.05
+    controller.admit('low')
+    assert controller.admit('low') == QUEUE_TIMEOUT
+
+def test_admission_slot_is_held_until_the_response_closes():
+    app = Flask(__name__)
+    app.config['ADMISSION_CONTROL_SETTINGS'] = {'MAX_CONCURRENT': 2, 'CLASSES': [{'name': 'normal'}]}
+    middleware = AdmissionControlMiddleware()
+
+    with app.test_request_context('/proxy/products_service/exports'):
+        assert middleware.process_request(request) is None
+        response = middleware.process_response(request, Response(iter([b'a', b'b'])))
+        middleware.teardown_request(None)
+        # The body is still being streamed.
+        assert middleware.controller.in_flight == 1
+        response.close()
+        response.close()
+        assert middleware.controller.in_flight == 0
+
+    # Requests whose response was never processed give their slot back on teardown.
+    with app.test_request_context('/proxy/products_service/exports'):
+        assert middleware.process_request(request) is None
+        middleware.teardown_request(RuntimeError())
+        assert middleware.controller.in_flight == 0
+
+def test_verified_token_cache_expires_at_exp_and_evicts_lru():
+    cache = VerifiedTokenCache(max_entries=2, max_ttl_seconds=300)
+    cache.set('expiring', {'user_id': 1, 'exp': time.time() - 1})
+    assert cache.get('expiring') is None
+
+    cache.set('a', {'user_id': 1, 'exp': time.time() + 60})
+    cache.set('b', {'user_id': 2})
+    assert cache.get('a')['user_id'] == 1
+    cache.set('c', {'user_id': 3})
+    assert cache.get('b') is None
+    assert [cache.get(token)['user_id'] for token in ('a', 'c')] == [1, 3]
+
+def test_route_classifier_matches_exact_paths_and_segment_prefixes():
+    classifier = RouteClassifier(
+        ['/', '/gateway/health', '/docs/<path:path>', '/proxy/users_service/login'],
+        ['/gateway/health', '/docs/<path:path>'],
+        ['/proxy/products_service', '/proxy/products_service/products'],
+    )
+    assert classifier.classify('/').auth_exempt
+    health = classifier.classify('/gateway/health')
+    assert health.auth_exempt and not health.cacheable and health.service_name is None
+    assert classifier.classify('/docs/swagger.json').auth_exempt
+    assert not classifier.classify('/docsx').auth_exempt
+    assert not classifier.classify('/proxy/users_service/login/other').auth_exempt
+
+    route = classifier.classify('/proxy/products_service/products/5')
+    assert not route.auth_exempt and route.cacheable
+    assert route.cache_route == '/proxy/products_service/products'
+    assert (route.service_name, route.resource_path, route.breaker_name) == ('products_service', '/products/5', 'products_service')
+    assert classifier.classify('/proxy/products_service/categories').cache_route == '/proxy/products_service'
+    assert classifier.classify('/proxy/users_service/users').cache_route is None
+
+def test_middleware_manager_compiles_a_chain_per_route_class():
+    class Recorder:
+        def __init__(self, name, calls):
+            self.name, self.calls = name, calls
+
+        def process_request(self, request):
+            self.calls.append(self.name)
+
+        def process_response(self, request, response):
+            self.calls.append(self.name)
+            return response
+
+    calls = []
+    manager = MiddlewareManager()
+    manager.add_middleware(Recorder('admission', calls))
+    manager.add_middleware(Recorder('breaker', calls), [ROUTE_PROXY])
+    manager.add_middleware(Recorder('limiter', calls), [ROUTE_PROXY, ROUTE_OTHER])
+
+    with Flask(__name__).test_request_context('/metrics'):
+        manager.process_request(request, ROUTE_INTERNAL)
+        manager.process_response(request, Response(), ROUTE_INTERNAL)
+        assert calls == ['admission', 'admission']
+        calls.clear()
+        manager.process_request(request, ROUTE_PROXY)
+        manager.process_response(request, Response(), ROUTE_PROXY)
+        assert calls == ['admission', 'breaker', 'limiter', 'limiter', 'breaker', 'admission']
+
+def test_middleware_manager_records_latency_and_short_circuits():
+    class Rejecting:
+        def process_request(self, request):
+            return Response(status=429)
+
+        def process_response(self, request, response):
+            return response
+
+    manager = MiddlewareManager()
+    manager.add_middleware(Rejecting())
+    labels = {'middleware': 'Rejecting'}
+    before = REGISTRY.get_sample_value('gateway_middleware_short_circuits_total', labels) or 0
+    with Flask(__name__).test_request_context('/proxy/products_service/products'):
+        response = manager.process_request(request)
+        manager.process_response(request, response)
+    assert response.status_code == 429
+    assert REGISTRY.get_sample_value('gateway_middleware_short_circuits_total', labels) == before + 1
+    for phase in ('request', 'response'):
+        assert REGISTRY.get_sample_value('gateway_middleware_duration_seconds_count', {**labels, 'phase': phase}) >= 1
+
+def test_upstream_metric_labels():
+    assert instance_label('http://10.0.0.5:8001/products?page=2') == '10.0.0.5:8001'
+    assert instance_label('http://products') == 'products:80'
+    assert instance_label('https://products') == 'products:443'
+    assert [status_class(code) for code in (200, 304, 404, 503)] == ['2xx', '3xx', '4xx', '5xx']
+    assert status_class(None) == 'error'
+
+def test_half_open_breaker_reuses_released_trial_permits(redis_client):
+    breaker_name = f"test-half-open-{time.time()}"
+    key = build_breaker_key(breaker_name)
+    config = {'RECOVERY_TIMEOUT_SECONDS': 30, 'HALF_OPEN_MAX_CALLS': 1, 'HALF_OPEN_TIMEOUT_SECONDS': 60}
+    acquire = redis_client.register_script(ACQUIRE_PERMISSION_SCRIPT)
+    release = redis_client.register_script(RELEASE_PERMISSION_SCRIPT)
+    now = time.time()
+    redis_client.hset(key, mapping={'s': 'OPEN', 't': now - 60})
+    try:
+        assert acquire(keys=[key], args=acquire_permission_args(breaker_name, now, config))[:2] == [1, 'HALF_OPEN']
+        # Rejected requests must not use up permits handed back later.
+        assert acquire(keys=[key], args=acquire_permission_args(breaker_name, now, config))[0] == 0
+        release(keys=[key])
+        assert acquire(keys=[key], args=acquire_permission_args(breaker_name, now, config))[:2] == [1, 'HALF_OPEN']
+    finally:
+        redis_client.delete(key)
+
+def test_async_gateway_proxies_requests_to_the_upstream(gateway_config, upstream):
+    service = unique_service_name()
+    upstream.routes['/products/5'] = lambda handler, body: (200, json.dumps({
+        'method': handler.command, 'path': handler.path, 'body': body.decode(), 'trace': handler.headers.get('X-Trace-Id'),
+    }).encode(), {'X-Upstream': 'products'})
+
+    async def scenario(client):
+        resp = await client.get(f"/proxy/{service}/products/5?fields=name", headers={'X-Trace-Id': 'abc'})
+        assert resp.status == 200 and resp.headers['X-Upstream'] == 'products'
+        assert await resp.json() == {'method': 'GET', 'path': '/products/5?fields=name', 'body': '', 'trace': 'abc'}
+
+        resp = await client.put(f"/proxy/{service}/products/5", json={'name': 'Lamp'})
+        assert resp.status == 200
+        assert (await resp.json())['body'] == '{"name": "Lamp"}'
+    run_async_gateway(scenario)
+
+def test_async_gateway_maps_upstream_errors_like_the_flask_gateway(gateway_config, upstream):
+    service = unique_service_name()
+    upstream.routes['/products/404'] = lambda handler, body: (404, b'{"message": "Product not found"}', {})
+    upstream.routes['/slow'] = lambda handler, body: (time.sleep(1), (200, b'{}', {}))[1]
+    with socket.socket() as unused:
+        unused.bind(('127.0.0.1', 0))
+        dead_url = f"http://127.0.0.1:{unused.getsockname()[1]}"
+
+    def flask_error(path):
+        with create_app().test_client() as client:
+            rv = client.get(f"/proxy/{service}{path}")
+            return rv.status_code, rv.get_json()['message']
+
+    async def aio_error(client, path):
+        resp = await client.get(f"/proxy/{service}{path}")
+        return resp.status, (await resp.json())['message']
+
+    expected_not_found = (404, 'Product not found')
+    expected_unavailable = (503, f"Service '{service}' is unavailable.")
+    expected_timeout = (503, f"Service '{service}' timed out.")
+
+    assert flask_error('/products/404') == expected_not_found
+    # The Flask engine's upstream timeout is fixed at 10 seconds, so its timeout is simulated.
+    with patch.object(UpstreamSessionPool, 'request', side_effect=requests.exceptions.ReadTimeout):
+        assert flask_error('/slow') == expected_timeout
+    with patch.object(ConsulServiceDiscovery, 'get_service_addresses', lambda self, service_name: [dead_url]):
+        assert flask_error('/products/404') == expected_unavailable
+
+    async def scenario(client):
+        assert await aio_error(client, '/products/404') == expected_not_found
+        with patch.object(aio_proxy, 'UPSTREAM_TIMEOUT', aiohttp.ClientTimeout(total=None, sock_read=0.2)):
+            assert await aio_error(client, '/slow') == expected_timeout
+        with patch.object(ConsulServiceDiscovery, 'get_service_addresses', lambda self, service_name: [dead_url]):
+            assert await aio_error(client, '/products/404') == expected_unavailable
+    run_async_gateway(scenario)
+
+def test_async_gateway_holds_the_concurrency_slot_until_a_streamed_body_is_relayed(gateway_config, upstream):
+    service = unique_service_name()
+    rest_of_body = threading.Event()
+
+    def export(handler, body):
+        def chunks():
+            yield b'a' * 1024
+            rest_of_body.wait(5)
+            yield b'b' * 1024
+        return 200, chunks(), {}
+    upstream.routes['/export'] = export
+    in_flight = lambda: REGISTRY.get_sample_value('gateway_concurrency_in_flight', {'service_name': service})
+
+    async def scenario(client):
+        resp = await client.get(f"/proxy/{service}/export")
+        assert resp.status == 200
+        assert in_flight() == 1
+        rest_of_body.set()
+        assert await resp.read() == b'a' * 1024 + b'b' * 1024
+        assert in_flight() == 0
+    with patch.dict(Config.ADAPTIVE_CONCURRENCY_SETTINGS, {'ENABLED': True, 'SERVICES': [service]}):
+        run_async_gateway(scenario)
+
+def test_async_gateway_serves_cache_hits_and_not_modified(gateway_config, upstream):
+    service = unique_service_name()
+    calls = []
+    upstream.routes['/products/'] = lambda handler, body: (calls.append(handler.path), (200, b'[{"id": 1}]', {}))[1]
+
+    async def scenario(client):
+        fill = await client.get(f"/proxy/{service}/products/")
+        assert fill.status == 200 and await fill.read() == b'[{"id": 1}]'
+        etag = fill.headers['ETag']
+
+        hit = await client.get(f"/proxy/{service}/products/")
+        assert hit.status == 200 and 'Age' in hit.headers and await hit.read() == b'[{"id": 1}]'
+
+        not_modified = await client.get(f"/proxy/{service}/products/", headers={'If-None-Match': etag})
+        assert not_modified.status == 304 and not_modified.headers['ETag'] == etag
+        assert len(calls) == 1
+    run_async_gateway(scenario)
+
+def test_async_gateway_rejects_requests_while_the_circuit_is_open(gateway_config, upstream, redis_client):
+    service = unique_service_name()
+    calls = []
+    upstream.routes['/products/'] = lambda handler, body: (calls.append(handler.path), (200, b'[]', {}))[1]
+    redis_client.hset(build_breaker_key(service), mapping={'s': 'OPEN', 't': time.time()})
+
+    async def scenario(client):
+        resp = await client.get(f"/proxy/{service}/products/")
+        assert resp.status == 503
+        assert (await resp.json())['message'] == Config.CIRCUIT_BREAKER_FALLBACK_MESSAGE
+        assert calls == []
+    try:
+        run_async_gateway(scenario)
+    finally:
+        redis_client.delete(build_breaker_key(service))